@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+回答緩存
+首輪問題的回答按 (數據集, 數據集世代號, 歸一化問題, 是否引用) 緩存：內存 LRU 為第一層，
+SQLite 文件為第二層，重啟後的請求在內存未命中時從文件讀取，不必重新調用 LLM。
+內存中的回答以共享字典壓縮後的字節保存，命中時才解碼，容量按實際字節數計算。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache import SizedTTLCache, normalize_query
+from compression import DictionaryCompressor
+from refresh_ahead import RefreshAheadScheduler
+from serialization import BINARY_MEDIA_TYPES, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, dump, load
+
+logger = logging.getLogger(__name__)
+
+# 文件中的記錄格式，已安裝 msgpack 時使用更緊湊的 MessagePack
+RECORD_MEDIA_TYPE = MSGPACK_MEDIA_TYPE if MSGPACK_MEDIA_TYPE in BINARY_MEDIA_TYPES else JSON_MEDIA_TYPE
+
+def encode_record(value: Any) -> Tuple[str, bytes]:
+    return RECORD_MEDIA_TYPE, dump(value, RECORD_MEDIA_TYPE)
+
+def decode_record(media_type: str, body: bytes) -> Any:
+    if media_type == JSON_MEDIA_TYPE:
+        return json.loads(body)
+    return load(body, media_type)
+
+class AnswerStore:
+    """SQLite 回答存儲
+
+    每條回答記錄所屬數據集及寫入時的世代號，數據集變化後可按數據集刪除舊記錄；
+    數據集的世代號和元數據也保存在同一文件中，重啟後變化偵測從上次的狀態繼續。
+    所有方法都是同步的，由 AnswerCache 在專用線程中調用。
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            'key BLOB PRIMARY KEY, dataset_id TEXT NOT NULL, generation INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, '
+            'media_type TEXT NOT NULL, value BLOB NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS answers_dataset ON answers (dataset_id, generation)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS datasets ('
+            'dataset_id TEXT PRIMARY KEY, generation INTEGER NOT NULL, signature TEXT)'
+        )
+        self._connection.execute('DELETE FROM answers WHERE expires_at <= ?', (time.time(),))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, key: bytes, generation: int) -> Optional[Tuple[float, str, bytes]]:
+        """返回 (過期時間, 格式, 記錄)，不存在、過期或世代號不符時返回 None"""
+        now = time.time()
+        row = self._connection.execute(
+            'SELECT generation, expires_at, media_type, value FROM answers WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != generation or row[1] <= now:
+            self._connection.execute('DELETE FROM answers WHERE key = ?', (key,))
+            return None
+        self._connection.execute('UPDATE answers SET accessed_at = ?, hits = hits + 1 WHERE key = ?', (now, key))
+        return row[1], row[2], row[3]
+
+    def put(self, key: bytes, dataset_id: str, generation: int, expires_at: float, media_type: str, value: bytes):
+        self._connection.execute(
+            'INSERT OR REPLACE INTO answers (key, dataset_id, generation, expires_at, accessed_at, media_type, value) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, dataset_id, generation, expires_at, time.time(), media_type, value)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        """刪除過期記錄，超出條數上限時淘汰最久未讀取的記錄"""
+        cursor = self._connection.execute('DELETE FROM answers WHERE expires_at <= ?', (time.time(),))
+        removed = cursor.rowcount
+        (count,) = self._connection.execute('SELECT COUNT(*) FROM answers').fetchone()
+        if count > self.max_entries:
+            cursor = self._connection.execute(
+                'DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_entries,)
+            )
+            removed += cursor.rowcount
+        return removed
+
+    def purge_dataset(self, dataset_id: str, generation: int) -> int:
+        """刪除數據集在指定世代號之前寫入的記錄"""
+        cursor = self._connection.execute(
+            'DELETE FROM answers WHERE dataset_id = ? AND generation < ?', (dataset_id, generation)
+        )
+        return cursor.rowcount
+
+    def hottest(self, limit: int) -> List[Tuple[bytes, str, int, float, str, bytes]]:
+        """按讀取次數和最近讀取時間返回最常用的未過期記錄"""
+        return self._connection.execute(
+            'SELECT key, dataset_id, generation, expires_at, media_type, value FROM answers '
+            'WHERE expires_at > ? ORDER BY hits DESC, accessed_at DESC LIMIT ?',
+            (time.time(), limit)
+        ).fetchall()
+
+    def load_datasets(self) -> Tuple[Dict[str, int], Dict[str, Tuple]]:
+        """返回保存的 (世代號, 元數據)"""
+        generations, signatures = {}, {}
+        for dataset_id, generation, signature in self._connection.execute(
+            'SELECT dataset_id, generation, signature FROM datasets'
+        ):
+            generations[dataset_id] = generation
+            if signature is not None:
+                signatures[dataset_id] = tuple(json.loads(signature))
+        return generations, signatures
+
+    def save_datasets(self, generations: Dict[str, int], signatures: Dict[str, Tuple]):
+        """整體替換保存的世代號和元數據"""
+        rows = [
+            (dataset_id, generations.get(dataset_id, 0),
+             json.dumps(signatures[dataset_id]) if dataset_id in signatures else None)
+            for dataset_id in set(generations) | set(signatures)
+        ]
+        with self._connection:
+            self._connection.execute('BEGIN')
+            self._connection.execute('DELETE FROM datasets')
+            self._connection.executemany(
+                'INSERT INTO datasets (dataset_id, generation, signature) VALUES (?, ?, ?)', rows
+            )
+
+class AnswerCache:
+    """兩層回答緩存
+
+    generation(dataset_id) 返回數據集當前的世代號，數據集變化後舊的回答不再命中。
+    內存中保存的是記錄經 compressor 壓縮後的字節，文件中保存未壓縮的記錄（字典只存在於內存）。
+    文件讀寫都在一個專用線程中串行執行，寫入不等待完成；未配置 store 時只使用內存。
+    設置 scheduler 後，帶 question、quote、chat_id 字段的回答會登記命中次數，供提前刷新。
+    """
+
+    def __init__(self, generation: Callable[[str], int], max_bytes: int = 128 * 1024 * 1024,
+                 ttl_seconds: float = 3600, store: Optional[AnswerStore] = None,
+                 compressor: Optional[DictionaryCompressor] = None):
+        self.generation = generation
+        self.ttl_seconds = ttl_seconds
+        self.memory = SizedTTLCache(max_bytes, ttl_seconds)
+        self.compressor = compressor or DictionaryCompressor()
+        self.store = store
+        self.disk_hits = 0
+        self.scheduler: Optional[RefreshAheadScheduler] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    @staticmethod
+    def key(dataset_id: str, question: str, quote: bool) -> bytes:
+        return hashlib.sha256(
+            json.dumps([dataset_id, normalize_query(question), quote], ensure_ascii=False).encode('utf-8')
+        ).digest()
+
+    def _unpack(self, blob: bytes) -> Dict[str, Any]:
+        return decode_record(RECORD_MEDIA_TYPE, self.compressor.decompress(blob))
+
+    def _remember(self, key: bytes, generation: int, media_type: str, body: bytes, ttl_seconds: Optional[float] = None):
+        """把文件中的記錄放入內存，格式相同時不經解碼直接壓縮"""
+        if media_type != RECORD_MEDIA_TYPE:
+            body = dump(decode_record(media_type, body), RECORD_MEDIA_TYPE)
+        self.memory.set((key, generation), self.compressor.compress(body), ttl_seconds)
+
+    def _track(self, key: bytes, dataset_id: str, value: Dict[str, Any], ttl_seconds: float):
+        if self.scheduler is not None and value.get('question') and value.get('chat_id'):
+            self.scheduler.track(key, dataset_id, value['question'], value.get('quote', True),
+                                 value['chat_id'], ttl_seconds)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _submit(self, func, *args):
+        """提交不需要等待結果的文件操作"""
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(
+            lambda done: done.exception() and logger.error(f"回答緩存文件寫入失敗: {done.exception()!r}")
+        )
+
+    async def start(self):
+        """打開緩存文件，返回保存的數據集 (世代號, 元數據)"""
+        if self.store is None or not self.enabled:
+            return {}, {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='answer-cache')
+        try:
+            await self._run(self.store.open)
+            return await self._run(self.store.load_datasets)
+        except Exception as e:
+            logger.error(f"回答緩存文件無法打開，只使用內存緩存: {str(e)}")
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            return {}, {}
+
+    async def stop(self):
+        if self._executor is not None:
+            await self._run(self.store.close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def warm(self, limit: int, batch_size: int = 100) -> int:
+        """把文件中最常用的回答分批載入內存，返回載入的條數
+
+        在後台執行，期間的請求照常按需從文件讀取。
+        """
+        if self._executor is None or limit <= 0:
+            return 0
+        rows = await self._run(self.store.hottest, limit)
+        loaded = 0
+        for start in range(0, len(rows), batch_size):
+            for key, dataset_id, generation, expires_at, media_type, value in rows[start:start + batch_size]:
+                if generation != self.generation(dataset_id):
+                    continue
+                self._remember(key, generation, media_type, value, expires_at - time.time())
+                if self.scheduler is not None:
+                    self._track(key, dataset_id, decode_record(media_type, value), expires_at - time.time())
+                loaded += 1
+            await asyncio.sleep(0)
+        return loaded
+
+    async def get(self, dataset_id: str, question: str, quote: bool) -> Optional[Dict[str, Any]]:
+        """返回緩存的上游回答數據，未命中時返回 None"""
+        if not self.enabled:
+            return None
+        key, generation = self.key(dataset_id, question, quote), self.generation(dataset_id)
+        blob = self.memory.get((key, generation))
+        if blob is not None:
+            if self.scheduler is not None:
+                self.scheduler.hit(key)
+            return self._unpack(blob)
+        if self._executor is None:
+            return None
+
+        try:
+            row = await self._run(self.store.get, key, generation)
+        except Exception as e:
+            logger.error(f"回答緩存文件讀取失敗: {str(e)}")
+            return None
+        if row is None:
+            return None
+        expires_at, media_type, body = row
+        self._remember(key, generation, media_type, body, expires_at - time.time())
+        self.disk_hits += 1
+        value = decode_record(media_type, body)
+        self._track(key, dataset_id, value, expires_at - time.time())
+        if self.scheduler is not None:
+            self.scheduler.hit(key)
+        return value
+
+    def set(self, dataset_id: str, question: str, quote: bool, value: Dict[str, Any]):
+        if not self.enabled:
+            return
+        key, generation = self.key(dataset_id, question, quote), self.generation(dataset_id)
+        media_type, body = encode_record(value)
+        self.memory.set((key, generation), self.compressor.compress(body))
+        self._track(key, dataset_id, value, self.ttl_seconds)
+        if self._executor is not None:
+            self._submit(self.store.put, key, dataset_id, generation, time.time() + self.ttl_seconds,
+                         media_type, body)
+
+    def purge(self, dataset_ids: List[str]):
+        """刪除文件中這些數據集舊世代的回答（內存中的舊條目不再命中，隨 LRU 淘汰）"""
+        if self._executor is None:
+            return
+        for dataset_id in dataset_ids:
+            self._submit(self.store.purge_dataset, dataset_id, self.generation(dataset_id))
+
+    def save_datasets(self, generations: Dict[str, int], signatures: Dict[str, Tuple]):
+        if self._executor is not None:
+            self._submit(self.store.save_datasets, dict(generations), dict(signatures))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+服務端緩存
+帶過期時間的 LRU 緩存（按條數或按字節數限制容量），以及查詢文本的歸一化
+"""
+
+import re
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_query(text: str) -> str:
+    """歸一化查詢文本：全角轉半角、忽略大小寫、合併空白"""
+    text = unicodedata.normalize('NFKC', text)
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+class TTLCache:
+    """帶過期時間的 LRU 緩存"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """讀取緩存，過期或不存在時返回 None"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """寫入緩存，超出容量時淘汰最久未使用的條目；ttl_seconds 默認為緩存的過期時間"""
+        self._data[key] = (time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+class SizedTTLCache:
+    """值為 bytes、按實際佔用字節數限制容量的帶過期時間 LRU 緩存
+
+    每條的大小按 sys.getsizeof 計算（含 bytes 對象頭），另加 ENTRY_OVERHEAD 估算鍵和索引的開銷。
+    """
+
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes: int, ttl_seconds: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, Tuple[float, bytes]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _entry_size(self, value: bytes) -> int:
+        return sys.getsizeof(value) + self.ENTRY_OVERHEAD
+
+    def _discard(self, key: Hashable):
+        _, value = self._data.pop(key)
+        self.nbytes -= self._entry_size(value)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """讀取緩存，過期或不存在時返回 None"""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: bytes, ttl_seconds: Optional[float] = None):
+        """寫入緩存，超出字節上限時淘汰最久未使用的條目；單條超過上限時不緩存"""
+        if key in self._data:
+            self._discard(key)
+        size = self._entry_size(value)
+        if size > self.max_bytes:
+            return
+        self._data[key] = (time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), value)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            self._discard(next(iter(self._data)))
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+數據集目錄緩存
+在本地保存最近一次從 RAGFlow 拉取的數據集列表，內容變化時遞增版本號，並維護按 ID、名稱和文件數的索引
+"""
+
+import asyncio
+import bisect
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from cache import normalize_query
+from serialization import dump_json
+
+def _grams(text: str) -> Set[str]:
+    """名稱的單字和相鄰雙字，中文不需要分詞也能做子串查找"""
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+class DatasetIndex:
+    """數據集索引
+
+    - by_id：按 ID 直接查找
+    - by_name：按歸一化名稱排序，前綴查找用二分
+    - 單字和雙字倒排表：子串查找先取各個雙字的交集，再逐個確認
+    - by_document_count：按文件數排序，範圍過濾用二分
+    目錄刷新時只更新新增、刪除和內容變化的數據集。
+    """
+
+    def __init__(self):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.names: Dict[str, str] = {}
+        self.by_name: List[Tuple[str, str]] = []
+        self.by_document_count: List[Tuple[int, str]] = []
+        self.postings: Dict[str, Set[str]] = {}
+        self.positions: Dict[str, int] = {}
+        self._normalized: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def get(self, dataset_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(dataset_id)
+
+    def _add(self, dataset: Dict[str, Any]):
+        dataset_id = dataset['id']
+        normalized = normalize_query(dataset.get('name') or '')
+        self.by_id[dataset_id] = dataset
+        self.names[dataset_id] = dataset.get('name', 'Unknown')
+        self._normalized[dataset_id] = normalized
+        bisect.insort(self.by_name, (normalized, dataset_id))
+        bisect.insort(self.by_document_count, (dataset.get('document_count') or 0, dataset_id))
+        for gram in _grams(normalized):
+            self.postings.setdefault(gram, set()).add(dataset_id)
+
+    def _remove(self, dataset_id: str):
+        dataset = self.by_id.pop(dataset_id)
+        del self.names[dataset_id]
+        normalized = self._normalized.pop(dataset_id)
+        self._remove_entry(self.by_name, (normalized, dataset_id))
+        self._remove_entry(self.by_document_count, (dataset.get('document_count') or 0, dataset_id))
+        for gram in _grams(normalized):
+            ids = self.postings[gram]
+            ids.discard(dataset_id)
+            if not ids:
+                del self.postings[gram]
+
+    @staticmethod
+    def _remove_entry(index: List[tuple], entry: tuple):
+        position = bisect.bisect_left(index, entry)
+        if position < len(index) and index[position] == entry:
+            del index[position]
+
+    def update(self, datasets: List[Dict[str, Any]]) -> Tuple[int, int, int]:
+        """按新的目錄增量更新索引，返回 (新增, 刪除, 變化) 的數量"""
+        current = {dataset['id']: dataset for dataset in datasets}
+        removed = [dataset_id for dataset_id in self.by_id if dataset_id not in current]
+        for dataset_id in removed:
+            self._remove(dataset_id)
+
+        added = changed = 0
+        for dataset_id, dataset in current.items():
+            existing = self.by_id.get(dataset_id)
+            if existing == dataset:
+                continue
+            if existing is None:
+                added += 1
+            else:
+                changed += 1
+                self._remove(dataset_id)
+            self._add(dataset)
+
+        # 保持上游的排列順序，查詢結果按此排序
+        self.positions = {dataset['id']: position for position, dataset in enumerate(datasets)}
+        return added, len(removed), changed
+
+    def _prefix_ids(self, prefix: str) -> Iterable[str]:
+        start = bisect.bisect_left(self.by_name, (prefix,))
+        for position in range(start, len(self.by_name)):
+            name, dataset_id = self.by_name[position]
+            if not name.startswith(prefix):
+                break
+            yield dataset_id
+
+    def _substring_ids(self, text: str) -> Set[str]:
+        grams = [text] if len(text) == 1 else [text[i:i + 2] for i in range(len(text) - 1)]
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        return {dataset_id for dataset_id in candidates if text in self._normalized[dataset_id]}
+
+    def _document_count_ids(self, min_documents: Optional[int], max_documents: Optional[int]) -> Iterable[str]:
+        start = bisect.bisect_left(self.by_document_count, (min_documents,)) if min_documents is not None else 0
+        end = len(self.by_document_count)
+        if max_documents is not None:
+            end = bisect.bisect_left(self.by_document_count, (max_documents + 1,))
+        return (dataset_id for _, dataset_id in self.by_document_count[start:end])
+
+    def search(self, q: Optional[str] = None, prefix_only: bool = False,
+               min_documents: Optional[int] = None, max_documents: Optional[int] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按名稱和文件數查找數據集
+
+        q 按名稱子串匹配（prefix_only 時只匹配前綴），忽略大小寫和全半角；
+        結果中名稱以 q 開頭的排在前面，其餘按目錄順序。
+        """
+        text = normalize_query(q) if q else ''
+        if text:
+            ids = set(self._prefix_ids(text)) if prefix_only else self._substring_ids(text)
+            if min_documents is not None or max_documents is not None:
+                ids = {
+                    dataset_id for dataset_id in ids
+                    if (min_documents is None or (self.by_id[dataset_id].get('document_count') or 0) >= min_documents)
+                    and (max_documents is None or (self.by_id[dataset_id].get('document_count') or 0) <= max_documents)
+                }
+            ordered = sorted(ids, key=lambda dataset_id: (
+                not self._normalized[dataset_id].startswith(text), self.positions.get(dataset_id, 0)
+            ))
+        else:
+            ordered = sorted(self._document_count_ids(min_documents, max_documents),
+                             key=lambda dataset_id: self.positions.get(dataset_id, 0))
+        if limit is not None:
+            ordered = ordered[:limit]
+        return [self.by_id[dataset_id] for dataset_id in ordered]
+
+class DatasetCatalog:
+    """帶過期時間的數據集目錄
+
+    過期後的第一次讀取重新拉取，並發的讀取共用同一次拉取。只有列表內容確實變化時 version 才遞增，
+    可用於生成 ETag 或判斷依賴目錄的數據是否需要更新。
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[List[Dict[str, Any]]]], ttl_seconds: float = 30):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.datasets: List[Dict[str, Any]] = []
+        self.index = DatasetIndex()
+        self.fingerprint: Optional[str] = None
+        self.refreshed_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Future] = None
+
+    def is_fresh(self) -> bool:
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.ttl_seconds
+
+    def update(self, datasets: List[Dict[str, Any]]) -> bool:
+        """替換目錄內容，返回內容是否變化"""
+        fingerprint = hashlib.sha256(dump_json(datasets)).hexdigest()
+        self.refreshed_at = time.monotonic()
+        if fingerprint == self.fingerprint:
+            return False
+        self.datasets = datasets
+        self.index.update(datasets)
+        self.fingerprint = fingerprint
+        self.version += 1
+        return True
+
+    def invalidate(self):
+        """下次讀取時強制重新拉取"""
+        self.refreshed_at = None
+
+    async def _refresh(self):
+        try:
+            self.update(await self.fetch())
+        finally:
+            self._refreshing = None
+
+    async def get(self) -> List[Dict[str, Any]]:
+        """返回數據集列表，過期時先重新拉取"""
+        if not self.is_fresh():
+            if self._refreshing is None:
+                self._refreshing = asyncio.ensure_future(self._refresh())
+            # 單個調用方被取消時不中斷其他調用方共用的拉取
+            await asyncio.shield(self._refreshing)
+        return self.datasets
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+按內容尋址的引用片段存儲
+片段以內容哈希標識，在內存中只保存一份；同一會話或連接已收到過的片段只返回哈希
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+HASH_FIELD = 'chunk_hash'
+
+def chunk_hash(chunk: Dict[str, Any]) -> Tuple[str, bytes]:
+    """返回片段的內容哈希和規範化編碼，字段順序不影響哈希"""
+    encoded = json.dumps(chunk, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:32], encoded
+
+class ChunkStore:
+    """LRU 片段存儲
+
+    總字節數超過 max_bytes 時淘汰最久未使用的片段。每個範圍（會話或連接）記錄已發送過的哈希，
+    已發送且仍在存儲中的片段只返回引用，客戶端本地缺失時可通過哈希再取。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._chunks: 'OrderedDict[str, Tuple[Dict[str, Any], int]]' = OrderedDict()
+        self._seen: Dict[str, Set[str]] = {}
+
+    def put(self, chunk: Dict[str, Any]) -> str:
+        """保存片段並返回其哈希"""
+        digest, encoded = chunk_hash(chunk)
+        if digest in self._chunks:
+            self._chunks.move_to_end(digest)
+            return digest
+
+        self._chunks[digest] = (chunk, len(encoded))
+        self.total_bytes += len(encoded)
+        while self.total_bytes > self.max_bytes and len(self._chunks) > 1:
+            _, (_, size) = self._chunks.popitem(last=False)
+            self.total_bytes -= size
+        return digest
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        """按哈希獲取片段"""
+        entry = self._chunks.get(digest)
+        if entry is None:
+            return None
+        self._chunks.move_to_end(digest)
+        return entry[0]
+
+    def pack(self, scope: str, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """把片段列表轉為帶哈希的形式：範圍內首次出現的片段附帶內容，其餘只返回哈希"""
+        seen = self._seen.setdefault(scope, set())
+        packed = []
+        for chunk in chunks:
+            if not isinstance(chunk, dict):
+                packed.append(chunk)
+                continue
+            digest = self.put(chunk)
+            if digest in seen:
+                packed.append({HASH_FIELD: digest})
+            else:
+                seen.add(digest)
+                packed.append({**chunk, HASH_FIELD: digest})
+        return packed
+
+    def forget(self, scope: str):
+        """會話刪除或連接關閉時清除其發送記錄"""
+        self._seen.pop(scope, None)
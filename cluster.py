@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+多節點部署支持
+以一致性哈希環分配會話的歸屬節點，並通過連接池在節點間轉發請求
+"""
+
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+from typing import Dict, List, Optional, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 節點間轉發時攜帶的請求頭
+FORWARDED_HEADER = 'X-RAGFlow-Forwarded-By'
+TOKEN_HEADER = 'X-Cluster-Token'
+
+def normalize_node(url: str) -> str:
+    """統一節點地址格式"""
+    return url.strip().rstrip('/')
+
+class HashRing:
+    """帶虛擬節點的一致性哈希環
+
+    成員變化時只有落在變化節點區間內的鍵會改變歸屬。
+    """
+
+    def __init__(self, nodes: List[str] = None, replicas: int = 100):
+        self.replicas = replicas
+        self.nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.set_nodes(nodes or [])
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def set_nodes(self, nodes: List[str]):
+        """重建哈希環"""
+        unique_nodes = sorted(set(nodes))
+        ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in unique_nodes
+            for replica in range(self.replicas)
+        )
+        self.nodes = unique_nodes
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def get_node(self, key: str) -> Optional[str]:
+        """返回鍵的歸屬節點"""
+        if not self._points:
+            return None
+        position = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[position]
+
+class ClusterManager:
+    """集群成員管理與節點間轉發
+
+    成員列表優先從本地文件讀取（每行一個節點地址），否則使用靜態列表。
+    """
+
+    def __init__(self, self_url: str = '', nodes: List[str] = None, nodes_file: str = '',
+                 secret: str = '', pool_size: int = 20, forward_timeout: float = 120):
+        self.self_url = normalize_node(self_url) if self_url else ''
+        self.static_nodes = [normalize_node(node) for node in (nodes or []) if node.strip()]
+        self.nodes_file = nodes_file
+        self.secret = secret
+        self.forward_timeout = forward_timeout
+        self.ring = HashRing()
+        self._nodes_file_mtime = None
+
+        # 節點間共用的 HTTP 連接池
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+        self.reload()
+
+    @property
+    def enabled(self) -> bool:
+        """只有本節點在多節點環中時才啟用轉發"""
+        return len(self.ring.nodes) > 1 and self.self_url in self.ring.nodes
+
+    def _load_nodes(self) -> List[str]:
+        if self.nodes_file and os.path.exists(self.nodes_file):
+            with open(self.nodes_file, 'r', encoding='utf-8') as f:
+                return [
+                    normalize_node(line) for line in f
+                    if line.strip() and not line.strip().startswith('#')
+                ]
+        return list(self.static_nodes)
+
+    def reload(self) -> bool:
+        """重新讀取成員列表，成員有變化時返回 True"""
+        if self.nodes_file and os.path.exists(self.nodes_file):
+            mtime = os.path.getmtime(self.nodes_file)
+            if mtime == self._nodes_file_mtime:
+                return False
+            self._nodes_file_mtime = mtime
+
+        nodes = self._load_nodes()
+        if sorted(set(nodes)) == self.ring.nodes:
+            return False
+
+        logger.info(f"集群成員變更: {self.ring.nodes} -> {sorted(set(nodes))}")
+        self.ring.set_nodes(nodes)
+        return True
+
+    def owner_of(self, session_id: str) -> Optional[str]:
+        """返回會話的歸屬節點，未啟用集群時返回 None"""
+        if not self.enabled:
+            return None
+        return self.ring.get_node(session_id)
+
+    def is_remote(self, session_id: str) -> bool:
+        """會話是否歸屬其他節點"""
+        owner = self.owner_of(session_id)
+        return owner is not None and owner != self.self_url
+
+    def verify_token(self, token: Optional[str]) -> bool:
+        """校驗節點間請求的共享密鑰，未設置密鑰時拒絕所有節點間請求"""
+        if not self.secret:
+            return False
+        return token is not None and hmac.compare_digest(token, self.secret)
+
+    def forward(self, node: str, method: str, path: str, json: Any = None,
+                params: Dict[str, Any] = None, headers: Dict[str, str] = None,
+                stream: bool = False) -> requests.Response:
+        """將請求轉發到指定節點，stream 為 True 時回應體由調用方逐塊讀取並負責關閉"""
+        headers = {**(headers or {}), FORWARDED_HEADER: self.self_url}
+        if self.secret:
+            headers[TOKEN_HEADER] = self.secret
+        return self.http.request(
+            method,
+            f'{node}{path}',
+            json=json,
+            params=params,
+            headers=headers,
+            timeout=self.forward_timeout,
+            stream=stream
+        )
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+回應壓縮
+按 Accept-Encoding 協商 zstd / br / gzip；完整回應超過大小閾值才壓縮，流式回應逐塊壓縮並立即刷新。
+另提供以共享字典壓縮大量相似小記錄的 DictionaryCompressor，供內存緩存使用。
+"""
+
+import logging
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # 未安裝時不提供 br
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 未安裝時不提供 zstd
+    zstandard = None
+
+# 服務端偏好順序：客戶端給出相同權重時優先使用靠前的算法
+SUPPORTED_ENCODINGS = [
+    encoding for encoding, available in (('zstd', zstandard), ('br', brotli), ('gzip', zlib)) if available
+]
+
+# 流式回應每塊都要刷新，使用低壓縮級別控制 CPU 開銷
+# brotli 質量 0、1 逐塊刷新時幾乎不壓縮，從 2 起才有效
+STREAM_LEVELS = {'zstd': 1, 'br': 2, 'gzip': 1}
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/msgpack', 'application/cbor', 'text/')
+
+def compress(encoding: str, data: bytes, level: int) -> bytes:
+    """一次性壓縮完整的回應體"""
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 輸出 gzip 格式
+    return compressor.compress(data) + compressor.flush()
+
+def stream_compressor(encoding: str, level: int) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    """返回 (壓縮並刷新一塊, 結束) 兩個函數，每塊的輸出都可以被客戶端立即解壓"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        return (
+            lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush
+        )
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return lambda data: compressor.process(data) + compressor.flush(), compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def choose_encoding(accept_encoding: str, encodings: List[str] = None) -> Optional[str]:
+    """按 Accept-Encoding 的權重選擇壓縮算法，沒有可用算法時返回 None"""
+    encodings = SUPPORTED_ENCODINGS if encodings is None else encodings
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+class CompressionMiddleware:
+    """按 Accept-Encoding 壓縮 HTTP 回應
+
+    完整回應小於 minimum_size 時不壓縮；流式回應（SSE、NDJSON）逐塊壓縮並刷新，
+    客戶端收到每塊後即可解壓，不會因壓縮而延遲事件。
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, levels: Dict[str, int] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {'zstd': 3, 'br': 4, 'gzip': 6, **(levels or {})}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        mode = None  # None: 等待第一塊；'identity': 不壓縮；'stream': 逐塊壓縮
+        compress_chunk = finish = None
+
+        async def send_compressed(message):
+            nonlocal start_message, mode, compress_chunk, finish
+
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            if mode is None:
+                headers = MutableHeaders(raw=start_message['headers'])
+                content_type = headers.get('content-type', '')
+                compressible = (
+                    'content-encoding' not in headers
+                    and content_type.startswith(COMPRESSIBLE_TYPES)
+                )
+                if not compressible or (not more_body and len(body) < self.minimum_size):
+                    mode = 'identity'
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                headers['Content-Encoding'] = encoding
+                headers.add_vary_header('Accept-Encoding')
+                # 壓縮後的字節與原回應不同，強 ETag 改為弱 ETag（條件請求按弱比較仍可命中）
+                etag = headers.get('etag')
+                if etag and not etag.startswith('W/'):
+                    headers['ETag'] = 'W/' + etag
+                if not more_body:
+                    # 完整回應一次壓縮
+                    body = compress(encoding, body, self.levels[encoding])
+                    headers['Content-Length'] = str(len(body))
+                    await send(start_message)
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+                    return
+
+                mode = 'stream'
+                del headers['Content-Length']
+                compress_chunk, finish = stream_compressor(encoding, STREAM_LEVELS[encoding])
+                await send(start_message)
+
+            if mode == 'identity':
+                await send(message)
+                return
+
+            data = compress_chunk(body) if body else b''
+            if not more_body:
+                data += finish()
+            if data or not more_body:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+class DictionaryCompressor:
+    """以共享字典壓縮相似的小記錄
+
+    單條記錄只有幾 KB 時，普通壓縮找不到足夠的重複內容；用收集到的前 training_samples 條記錄
+    訓練一個字典（zstd；未安裝時以樣本拼成 zlib 預設字典），之後每條記錄都可引用字典中的常見片段。
+    字典在後台線程中訓練，完成前的記錄不使用字典壓縮。每條輸出的第一個字節標記是否使用了字典，
+    兩種記錄都能解壓。
+    """
+
+    def __init__(self, level: int = 3, dict_size: int = 64 * 1024, training_samples: int = 200):
+        self.level = level
+        self.dict_size = dict_size
+        self.training_samples = training_samples
+        self.dictionary: Optional[bytes] = None
+        self._samples: List[bytes] = []
+        self._training = False
+        if zstandard is not None:
+            self._plain = (zstandard.ZstdCompressor(level=level), zstandard.ZstdDecompressor())
+        self._trained = None
+
+    def _train(self, samples: List[bytes]):
+        try:
+            if zstandard is not None:
+                dictionary = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+                self._trained = (
+                    zstandard.ZstdCompressor(level=self.level, dict_data=dictionary),
+                    zstandard.ZstdDecompressor(dict_data=dictionary)
+                )
+                self.dictionary = dictionary.as_bytes()
+            else:
+                # zlib 的預設字典最多使用最後 32KB，常見內容應放在末尾
+                self.dictionary = b''.join(samples)[-32 * 1024:]
+                self._trained = self.dictionary
+            logger.info(f"共享壓縮字典訓練完成: {len(self.dictionary)} 字節，{len(samples)} 條樣本")
+        except Exception as e:
+            # 樣本不足以訓練時收集加倍的樣本後再試
+            logger.warning(f"共享壓縮字典訓練失敗: {str(e)}")
+            self._samples = samples
+            self.training_samples *= 2
+        finally:
+            self._training = False
+
+    def train(self, samples: List[bytes]):
+        """用給定的樣本同步訓練字典；已有字典時不再訓練，以免之前壓縮的記錄無法解壓"""
+        if self._trained is None:
+            self._train(list(samples))
+
+    def _collect(self, data: bytes):
+        if self._trained is not None or self._training:
+            return
+        self._samples.append(data)
+        if len(self._samples) >= self.training_samples:
+            samples, self._samples = self._samples, []
+            self._training = True
+            threading.Thread(target=self._train, args=(samples,), name='dictionary-training', daemon=True).start()
+
+    def compress(self, data: bytes) -> bytes:
+        self._collect(data)
+        trained = self._trained
+        if zstandard is not None:
+            if trained is not None:
+                return b'\x01' + trained[0].compress(data)
+            return b'\x00' + self._plain[0].compress(data)
+        if trained is not None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 15, zdict=trained)
+            return b'\x01' + compressor.compress(data) + compressor.flush()
+        return b'\x00' + zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        marker, body = data[0], data[1:]
+        if zstandard is not None:
+            return (self._trained if marker else self._plain)[1].decompress(body)
+        if marker:
+            decompressor = zlib.decompressobj(15, zdict=self._trained)
+            return decompressor.decompress(body) + decompressor.flush()
+        return zlib.decompress(body)
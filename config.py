@@ -18,4 +18,84 @@ ENDPOINTS = {
 
 # 請求設定
 REQUEST_TIMEOUT = 10
-MAX_RETRIES = 3
\ No newline at end of file
+MAX_RETRIES = 3
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '16'))  # 同時發往 RAGFlow 的請求上限
+
+# 批量聊天設定
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '1000'))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv('BATCH_DEFAULT_CONCURRENCY', '8'))
+
+# 檢索設定
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))  # 檢索結果緩存時間（秒）
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '1000'))
+
+# 回答緩存設定（只緩存不帶 session_id 的首輪問題）
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '0'))  # 回答緩存時間（秒），默認 0 不緩存；命中後的第一次追問要多一次 LLM 調用重建會話歷史
+ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))  # 內存中壓縮後回答的總字節上限
+ANSWER_CACHE_PATH = os.getenv('ANSWER_CACHE_PATH', 'data/answer_cache.db')  # 回答緩存文件，空字符串表示只使用內存
+ANSWER_CACHE_DISK_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_DISK_MAX_ENTRIES', '100000'))  # 文件中的回答條數上限
+ANSWER_CACHE_WARM_ENTRIES = int(os.getenv('ANSWER_CACHE_WARM_ENTRIES', '500'))  # 啟動後在後台從文件載入內存的最常用回答數
+ANSWER_REFRESH_AHEAD = float(os.getenv('ANSWER_REFRESH_AHEAD', '300'))  # 熱門回答在過期前多少秒開始後台刷新，0 表示不刷新
+ANSWER_REFRESH_MIN_HITS = int(os.getenv('ANSWER_REFRESH_MIN_HITS', '3'))  # 本緩存週期內至少命中多少次才算熱門
+ANSWER_REFRESH_PER_MINUTE = int(os.getenv('ANSWER_REFRESH_PER_MINUTE', '10'))  # 每分鐘最多刷新的回答數
+ANSWER_REFRESH_MAX_INFLIGHT = int(os.getenv('ANSWER_REFRESH_MAX_INFLIGHT', '2'))  # 進行中的上游調用達到此數時暫停刷新
+ANSWER_REFRESH_INTERVAL = float(os.getenv('ANSWER_REFRESH_INTERVAL', '10'))  # 檢查需要刷新的回答的間隔（秒）
+
+# 異步任務設定
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # 同時執行的任務數
+JOB_MAX_QUEUED = int(os.getenv('JOB_MAX_QUEUED', '1000'))  # 排隊任務上限
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '3600'))  # 已完成任務的保存時間（秒）
+JOB_SSE_HEARTBEAT = float(os.getenv('JOB_SSE_HEARTBEAT', '15'))  # SSE 心跳間隔（秒）
+
+# 引用片段存儲設定
+CHUNK_STORE_MAX_BYTES = int(os.getenv('CHUNK_STORE_MAX_BYTES', str(64 * 1024 * 1024)))  # 內存中片段的總字節上限
+
+# 流式回答設定
+STREAM_COALESCE_INTERVAL = float(os.getenv('STREAM_COALESCE_INTERVAL', '0.05'))  # 合併增量的間隔（秒），0 表示逐條發送
+STREAM_REPLAY_MAX_BYTES = int(os.getenv('STREAM_REPLAY_MAX_BYTES', str(1024 * 1024)))  # 每個流式回答重放緩衝的字節上限
+STREAM_REPLAY_TTL = float(os.getenv('STREAM_REPLAY_TTL', '60'))  # 回答結束後保留重放緩衝的時間（秒）
+STREAM_RESUME_GRACE = float(os.getenv('STREAM_RESUME_GRACE', '30'))  # 客戶端斷開後繼續生成、等待重連的時間（秒）
+
+# WebSocket 設定
+WS_MAX_INFLIGHT = int(os.getenv('WS_MAX_INFLIGHT', '32'))  # 每個連接同時進行的對話上限
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '256'))  # 每個連接待發送的幀上限，滿時暫停讀取上游
+WS_HEARTBEAT_INTERVAL = float(os.getenv('WS_HEARTBEAT_INTERVAL', '20'))  # 服務端 ping 間隔（秒）
+WS_IDLE_TIMEOUT = float(os.getenv('WS_IDLE_TIMEOUT', '60'))  # 超過此時間未收到客戶端消息則關閉連接（秒）
+
+# 數據集目錄設定
+DATASET_PAGE_SIZE = int(os.getenv('DATASET_PAGE_SIZE', '100'))  # 從 RAGFlow 分頁拉取數據集時的每頁數量
+DATASET_PAGE_CONCURRENCY = int(os.getenv('DATASET_PAGE_CONCURRENCY', '4'))  # 同時進行的分頁請求上限
+DATASET_CATALOG_TTL = float(os.getenv('DATASET_CATALOG_TTL', '30'))  # 數據集列表在本地緩存的時間（秒），0 表示每次都向 RAGFlow 拉取
+DATASETS_MAX_AGE = int(os.getenv('DATASETS_MAX_AGE', '10'))  # /datasets 回應允許客戶端和中間緩存直接使用的時間（秒）
+DATASET_WATCH_INTERVAL = float(os.getenv('DATASET_WATCH_INTERVAL', '10'))  # 數據集變化輪詢間隔（秒），0 表示不輪詢
+DATASET_WATCH_PAGES = int(os.getenv('DATASET_WATCH_PAGES', '1'))  # 每輪輪詢最多請求的頁數
+
+# 回應壓縮設定
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))  # 完整回應小於此字節數時不壓縮
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))  # gzip 壓縮級別（1-9）
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))  # brotli 壓縮質量（0-11）
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))  # zstd 壓縮級別（1-22）
+
+# 多數據集查詢設定
+MULTI_DATASET_MAX = int(os.getenv('MULTI_DATASET_MAX', '20'))  # 單次查詢的數據集上限
+MULTI_DATASET_TIMEOUT = float(os.getenv('MULTI_DATASET_TIMEOUT', '30'))  # 默認總時間預算（秒）
+
+# 會話設定
+SESSION_TOUCH_FLUSH_INTERVAL = float(os.getenv('SESSION_TOUCH_FLUSH_INTERVAL', '5'))  # 會話使用時間批量寫回間隔（秒）
+
+# 消息日誌設定
+MESSAGE_LOG_DIR = os.getenv('MESSAGE_LOG_DIR', 'data/messages')
+MESSAGE_LOG_SEGMENT_BYTES = int(os.getenv('MESSAGE_LOG_SEGMENT_BYTES', str(64 * 1024 * 1024)))  # 單個分段文件上限
+
+# 冪等鍵設定
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '600'))  # 已完成回應的保存時間（秒）
+IDEMPOTENCY_MAX_BYTES = int(os.getenv('IDEMPOTENCY_MAX_BYTES', str(32 * 1024 * 1024)))  # 保存回應的總字節上限
+
+# 集群設定（多節點部署時按一致性哈希分配會話歸屬）
+CLUSTER_SELF_URL = os.getenv('CLUSTER_SELF_URL', '')  # 本節點對其他節點可見的地址
+CLUSTER_NODES = [node for node in os.getenv('CLUSTER_NODES', '').split(',') if node.strip()]
+CLUSTER_NODES_FILE = os.getenv('CLUSTER_NODES_FILE', '')  # 成員列表文件，每行一個節點地址，優先於 CLUSTER_NODES
+CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+CLUSTER_POOL_SIZE = int(os.getenv('CLUSTER_POOL_SIZE', '20'))
+CLUSTER_FORWARD_TIMEOUT = float(os.getenv('CLUSTER_FORWARD_TIMEOUT', '120'))
+CLUSTER_REFRESH_INTERVAL = float(os.getenv('CLUSTER_REFRESH_INTERVAL', '10'))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+數據集變化偵測
+分批輪詢 RAGFlow 的數據集元數據，數據集的文件數、片段數或更新時間變化時遞增該數據集的世代號。
+緩存鍵帶上相關數據集的世代號，數據集變化後只有它的緩存條目失效，其餘條目不受影響。
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+def dataset_signature(dataset: Dict[str, Any]) -> Tuple:
+    """影響檢索和回答結果的元數據"""
+    return (
+        dataset.get('document_count'),
+        dataset.get('chunk_count'),
+        dataset.get('update_time') or dataset.get('update_date')
+    )
+
+class DatasetWatcher:
+    """按頁輪流輪詢數據集元數據
+
+    每輪最多請求 pages_per_round 頁，對 RAGFlow 的開銷與數據集總數無關；
+    數據集很多時完整掃描一遍需要多輪，變化最遲在下一遍掃描到該頁時發現。
+    連續兩遍掃描都未出現的數據集視為已刪除，同樣遞增世代號
+    （刪除數據集會使後面的數據集前移一位，只錯過一遍的可能是被移到了已掃描的頁）。
+    """
+
+    def __init__(self, fetch_page: Callable[[int, int], Awaitable[List[Dict[str, Any]]]],
+                 page_size: int = 100, pages_per_round: int = 1, interval: float = 30):
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.pages_per_round = pages_per_round
+        self.interval = interval
+        self.generations: Dict[str, int] = {}
+        self.signatures: Dict[str, Tuple] = {}
+        self.listeners: List[Callable[[List[str]], None]] = []
+        self.sweep_listeners: List[Callable[[], None]] = []
+        self.sweeps = 0
+        self._page = 1
+        self._seen: Set[str] = set()
+        self._missing: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def generation(self, dataset_id: str) -> int:
+        return self.generations.get(dataset_id, 0)
+
+    def generation_key(self, dataset_ids: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+        """緩存鍵中代表數據集內容版本的部分"""
+        return tuple((dataset_id, self.generation(dataset_id)) for dataset_id in sorted(set(dataset_ids)))
+
+    def restore(self, generations: Dict[str, int], signatures: Dict[str, Tuple]):
+        """載入上次保存的世代號和元數據，重啟期間發生的變化在第一遍掃描中發現"""
+        self.generations.update(generations)
+        self.signatures.update(signatures)
+
+    def bump(self, dataset_ids: Iterable[str]):
+        """遞增世代號並通知監聽者"""
+        changed = list(dataset_ids)
+        if not changed:
+            return
+        for dataset_id in changed:
+            self.generations[dataset_id] = self.generation(dataset_id) + 1
+        for listener in self.listeners:
+            try:
+                listener(changed)
+            except Exception as e:
+                logger.error(f"數據集變化通知失敗: {str(e)}")
+
+    def observe(self, datasets: List[Dict[str, Any]]) -> List[str]:
+        """比較一批數據集的元數據，返回發生變化的數據集 ID
+
+        第一次見到的數據集只記錄元數據，不視為變化。
+        """
+        changed = []
+        for dataset in datasets:
+            dataset_id = dataset.get('id')
+            if not dataset_id:
+                continue
+            self._seen.add(dataset_id)
+            signature = dataset_signature(dataset)
+            previous = self.signatures.get(dataset_id)
+            self.signatures[dataset_id] = signature
+            if previous is not None and previous != signature:
+                changed.append(dataset_id)
+        self.bump(changed)
+        return changed
+
+    def _finish_sweep(self) -> List[str]:
+        """一遍掃描結束：找出已刪除的數據集，下一輪從第一頁開始"""
+        missing = {dataset_id for dataset_id in self.signatures if dataset_id not in self._seen}
+        removed = sorted(missing & self._missing)
+        for dataset_id in removed:
+            del self.signatures[dataset_id]
+        self._missing = missing - set(removed)
+        self.bump(removed)
+        self._page = 1
+        self._seen = set()
+        self.sweeps += 1
+        for listener in self.sweep_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"數據集掃描完成通知失敗: {str(e)}")
+        return removed
+
+    async def poll_once(self) -> List[str]:
+        """輪詢一輪，返回變化或刪除的數據集 ID"""
+        changed = []
+        for _ in range(self.pages_per_round):
+            datasets = await self.fetch_page(self._page, self.page_size)
+            changed += self.observe(datasets)
+            if len(datasets) < self.page_size:
+                changed += self._finish_sweep()
+                break
+            self._page += 1
+        return changed
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                changed = await self.poll_once()
+                if changed:
+                    logger.info(f"偵測到 {len(changed)} 個數據集變化: {', '.join(changed[:10])}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"數據集變化輪詢失敗: {str(e)}")
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
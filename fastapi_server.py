@@ -4,18 +4,62 @@ RAGFlow FastAPI 後端服務
 為聊天代理機器人提供 RAG 聊天 API 接口
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Header, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Tuple, Literal, AsyncIterator, Awaitable, Callable, Deque
 import uuid
 import time
 import asyncio
-from datetime import datetime
+import base64
+import json
+import re
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import logging
+import requests
+from sortedcontainers import SortedList
 
 # 導入 RAGFlow 客戶端
 from ragflow_chatbot import RAGFlowOfficialClient
+from cluster import ClusterManager
+from message_log import MessageLog
+from cache import TTLCache, normalize_query
+from answer_cache import AnswerCache, AnswerStore
+from refresh_ahead import RefreshAheadScheduler, RefreshEntry
+from serialization import (
+    FastJSONResponse, BinaryBodyRoute, JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE, BINARY_MEDIA_TYPES, SEQUENCE_MEDIA_TYPES,
+    dump, dump_json, dump_record, negotiate_media_type, negotiated_response
+)
+from chunk_store import ChunkStore
+from compression import CompressionMiddleware
+from catalog import DatasetCatalog
+from dataset_watch import DatasetWatcher
+from http_cache import make_etag, etag_matches, not_modified
+from jobs import JobManager, JobQueueFull, Job
+from streams import AnswerStream, StreamRegistry, parse_last_event_id
+from idempotency import IdempotencyStore, IdempotencyConflict, StoredResponse, request_fingerprint
+from config import (
+    SESSION_TOUCH_FLUSH_INTERVAL, MESSAGE_LOG_DIR, MESSAGE_LOG_SEGMENT_BYTES,
+    IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_BYTES,
+    UPSTREAM_MAX_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_DEFAULT_CONCURRENCY,
+    MULTI_DATASET_MAX, MULTI_DATASET_TIMEOUT, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_PATH, ANSWER_CACHE_DISK_MAX_ENTRIES, ANSWER_CACHE_WARM_ENTRIES,
+    ANSWER_REFRESH_AHEAD, ANSWER_REFRESH_MIN_HITS, ANSWER_REFRESH_PER_MINUTE, ANSWER_REFRESH_MAX_INFLIGHT, ANSWER_REFRESH_INTERVAL,
+    JOB_WORKERS, JOB_MAX_QUEUED, JOB_RESULT_TTL, JOB_SSE_HEARTBEAT,
+    CHUNK_STORE_MAX_BYTES, STREAM_COALESCE_INTERVAL, STREAM_REPLAY_MAX_BYTES, STREAM_REPLAY_TTL, STREAM_RESUME_GRACE,
+    WS_MAX_INFLIGHT, WS_SEND_QUEUE_SIZE, WS_HEARTBEAT_INTERVAL, WS_IDLE_TIMEOUT,
+    COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY, COMPRESSION_ZSTD_LEVEL,
+    DATASET_CATALOG_TTL, DATASETS_MAX_AGE, DATASET_PAGE_SIZE, DATASET_PAGE_CONCURRENCY, DATASET_WATCH_INTERVAL, DATASET_WATCH_PAGES,
+    CLUSTER_SELF_URL, CLUSTER_NODES, CLUSTER_NODES_FILE, CLUSTER_SECRET,
+    CLUSTER_POOL_SIZE, CLUSTER_FORWARD_TIMEOUT, CLUSTER_REFRESH_INTERVAL
+)
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +73,8 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc"
 )
+# 所有路由都接受 MessagePack / CBOR 請求體
+app.router.route_class = BinaryBodyRoute
 
 # 配置 CORS
 app.add_middleware(
@@ -39,9 +85,91 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 按 Accept-Encoding 壓縮回應，流式回應逐塊壓縮
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MIN_SIZE,
+    levels={'gzip': COMPRESSION_GZIP_LEVEL, 'br': COMPRESSION_BROTLI_QUALITY, 'zstd': COMPRESSION_ZSTD_LEVEL},
+)
+
 # 全局變量
-ragflow_client = RAGFlowOfficialClient()
+ragflow_client = RAGFlowOfficialClient(pool_size=UPSTREAM_MAX_CONCURRENCY)
+# RAGFlow 客戶端是同步的，統一放到有界線程池中調用：不阻塞事件循環，同時限制對 RAGFlow 的並發
+upstream_executor = ThreadPoolExecutor(
+    max_workers=UPSTREAM_MAX_CONCURRENCY, thread_name_prefix='ragflow-upstream'
+)
 active_sessions = {}  # 存儲活躍的聊天會話
+cluster = ClusterManager(
+    self_url=CLUSTER_SELF_URL,
+    nodes=CLUSTER_NODES,
+    nodes_file=CLUSTER_NODES_FILE,
+    secret=CLUSTER_SECRET,
+    pool_size=CLUSTER_POOL_SIZE,
+    forward_timeout=CLUSTER_FORWARD_TIMEOUT
+)
+message_log = MessageLog(MESSAGE_LOG_DIR, MESSAGE_LOG_SEGMENT_BYTES)
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_BYTES)
+search_cache = TTLCache(SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL)
+chunk_store = ChunkStore(CHUNK_STORE_MAX_BYTES)
+stream_registry = StreamRegistry(STREAM_REPLAY_MAX_BYTES, STREAM_REPLAY_TTL, STREAM_RESUME_GRACE)
+
+# 進行中的上游調用數，後台刷新據此避讓實時請求
+upstream_inflight = 0
+
+async def call_upstream(func, *args, **kwargs):
+    """在上游線程池中執行同步的 RAGFlow 調用"""
+    global upstream_inflight
+    loop = asyncio.get_running_loop()
+    upstream_inflight += 1
+    try:
+        return await loop.run_in_executor(upstream_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        upstream_inflight -= 1
+
+async def stream_upstream(func, *args, buffer_size: int = 16, **kwargs) -> AsyncIterator[Any]:
+    """在上游線程池中迭代同步生成器，逐項交給事件循環
+    
+    緩衝隊列有界：消費方變慢時讀取線程會阻塞等待，上游連接隨之暫停讀取。
+    消費方提前退出時通知線程停止並關閉生成器，釋放上游連接。
+    """
+    global upstream_inflight
+    loop = asyncio.get_running_loop()
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+    stopped = threading.Event()
+    finished = object()
+    
+    def put(item):
+        asyncio.run_coroutine_threadsafe(buffer.put(item), loop).result()
+    
+    def pump():
+        iterator = func(*args, **kwargs)
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    return
+                put((item, None))
+            put((finished, None))
+        except Exception as e:
+            put((finished, e))
+        finally:
+            iterator.close()
+    
+    loop.run_in_executor(upstream_executor, pump)
+    upstream_inflight += 1
+    try:
+        while True:
+            item, error = await buffer.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                break
+            yield item
+    finally:
+        upstream_inflight -= 1
+        stopped.set()
+        # 騰出緩衝空間，讓阻塞中的線程能走到停止檢查
+        while not buffer.empty():
+            buffer.get_nowait()
 
 # Pydantic 模型
 class DatasetInfo(BaseModel):
@@ -56,8 +184,12 @@ class ChatRequest(BaseModel):
     dataset_id: str = Field(..., description="數據集 ID")
     session_id: Optional[str] = Field(None, description="會話 ID，如果不提供則創建新會話")
     user_id: Optional[str] = Field(None, description="用戶 ID")
-    quote: bool = Field(True, description="是否顯示引用來源")
+    quote: bool = Field(True, description="是否顯示引用來源，為 false 時不返回 sources")
     stream: bool = Field(False, description="是否流式回應")
+    source_fields: Optional[List[str]] = Field(None, description="只返回引用片段的這些字段，例如 [\"doc_name\", \"content\"]，不提供時返回全部字段")
+    max_source_chars: Optional[int] = Field(None, ge=0, description="每個引用片段 content 的最大字符數")
+    max_sources: Optional[int] = Field(None, ge=0, description="最多返回的引用片段數")
+    source_refs: bool = Field(False, description="引用片段附帶 chunk_hash，同一會話中已返回過的片段只返回哈希")
 
 class ChatResponse(BaseModel):
     success: bool
@@ -67,6 +199,71 @@ class ChatResponse(BaseModel):
     chat_id: str
     message: str
     timestamp: datetime
+    cached: bool = False
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS, description="聊天請求列表")
+    concurrency: int = Field(BATCH_DEFAULT_CONCURRENCY, ge=1, description="並發數，不超過服務端的上游並發上限")
+    share_session: bool = Field(False, description="沒有 session_id 的請求按 (dataset_id, user_id) 共用同一個會話")
+
+class MultiDatasetChatRequest(BaseModel):
+    question: str = Field(..., description="用戶問題")
+    dataset_ids: List[str] = Field(..., min_length=1, max_length=MULTI_DATASET_MAX, description="要查詢的數據集 ID 列表")
+    session_ids: Dict[str, str] = Field({}, description="按數據集 ID 指定已有會話，用於繼續上一輪對話")
+    user_id: Optional[str] = Field(None, description="用戶 ID")
+    quote: bool = Field(True, description="是否顯示引用來源")
+    source_fields: Optional[List[str]] = Field(None, description="只返回引用片段的這些字段，例如 [\"doc_name\", \"content\"]，不提供時返回全部字段")
+    max_source_chars: Optional[int] = Field(None, ge=0, description="每個引用片段 content 的最大字符數")
+    max_sources: Optional[int] = Field(None, ge=0, description="最多返回的引用片段數")
+    mode: Literal['first', 'all'] = Field('all', description="first: 返回第一個有效回答並取消其餘查詢；all: 返回全部回答並合併來源")
+    timeout: float = Field(MULTI_DATASET_TIMEOUT, gt=0, description="總時間預算（秒），超時返回已完成的部分結果")
+
+class DatasetAnswer(BaseModel):
+    dataset_id: str
+    status: Literal['ok', 'error', 'timeout', 'cancelled']
+    answer: Optional[str] = None
+    sources: List[Dict[str, Any]] = []
+    session_id: Optional[str] = None
+    chat_id: Optional[str] = None
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+
+class MultiDatasetChatResponse(BaseModel):
+    success: bool
+    mode: str
+    answer: Optional[str] = Field(None, description="按完成順序第一個有效回答")
+    answered_by: Optional[str] = Field(None, description="第一個有效回答所屬的數據集 ID")
+    sources: List[Dict[str, Any]] = []
+    answers: List[DatasetAnswer]
+    partial: bool = Field(False, description="是否因時間預算用完而只返回部分結果")
+    elapsed_ms: float
+    timestamp: datetime
+
+class SearchRequest(BaseModel):
+    question: str = Field(..., description="查詢內容")
+    dataset_ids: List[str] = Field(..., min_length=1, description="數據集 ID 列表")
+    document_ids: List[str] = Field([], description="只在這些文檔中檢索")
+    top_k: int = Field(10, ge=1, le=100, description="返回的片段數")
+    similarity_threshold: float = Field(0.2, ge=0, le=1, description="最低相似度")
+    vector_similarity_weight: float = Field(0.3, ge=0, le=1, description="向量相似度權重，其餘為關鍵詞相似度")
+    keyword: bool = Field(False, description="是否啟用關鍵詞擴展")
+
+class SearchResponse(BaseModel):
+    success: bool
+    chunks: List[Dict[str, Any]] = []
+    doc_aggs: List[Dict[str, Any]] = []
+    total: int = 0
+    cached: bool = False
+    timestamp: datetime
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued / running / succeeded / failed")
+    result: Optional[ChatResponse] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 class SessionInfo(BaseModel):
     session_id: str
@@ -77,30 +274,114 @@ class SessionInfo(BaseModel):
     created_at: datetime
     last_used: datetime
 
+class SessionRecord(SessionInfo):
+    """節點間移交的會話記錄，包含不對外返回的字段"""
+    ragflow_session_id: Optional[str] = None
+    deferred_question: Optional[str] = None
+
+class SessionListResponse(BaseModel):
+    success: bool = True
+    sessions: List[SessionInfo]
+    next_cursor: Optional[str] = Field(None, description="下一頁游標，為空表示沒有更多數據")
+
+class ChatMessage(BaseModel):
+    message_id: str
+    question: str
+    answer: str
+    sources: List[Dict[str, Any]] = []
+    latency_ms: float
+    created_at: datetime
+
+class MessageListResponse(BaseModel):
+    success: bool = True
+    session_id: str
+    messages: List[ChatMessage]
+    next_cursor: Optional[int] = Field(None, description="下一頁游標，為空表示沒有更多數據")
+
 class ErrorResponse(BaseModel):
     success: bool = False
     error: str
     timestamp: datetime
 
+# 會話分頁游標
+def encode_cursor(last_used: datetime, session_id: str) -> str:
+    """將排序鍵編碼為不透明的分頁游標"""
+    raw = f"{last_used.isoformat()}|{session_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析分頁游標，格式錯誤時拋出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, session_id = raw.split('|', 1)
+        return datetime.fromisoformat(timestamp), session_id
+    except Exception as e:
+        raise ValueError(f"無效的分頁游標: {cursor}") from e
+
+def to_local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """會話時間均為本地無時區時間，將帶時區的查詢參數轉換後再比較"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def create_chat_assistant(dataset_id: str) -> str:
+    """為數據集創建聊天助手，返回 chat_id"""
+    chat_name = f"API聊天機器人_{uuid.uuid4().hex[:8]}"
+    chat_result = ragflow_client.create_chat(
+        name=chat_name,
+        dataset_ids=[dataset_id]
+    )
+    
+    if not chat_result['success']:
+        raise Exception(f"創建聊天助手失敗: {chat_result['message']}")
+    
+    return chat_result['data']['id']
+
 # 會話管理類
 class SessionManager:
     def __init__(self):
         self.sessions = {}
+        # 二級索引：按 (last_used, session_id) 升序排列，分頁與過濾時只需二分查找；
+        # SortedList 的插入和刪除為 O(log n)，每次寫回使用時間不再移動整個列表
+        self.by_last_used: SortedList = SortedList()
+        self.by_user: Dict[str, SortedList] = {}
+        self.by_dataset: Dict[str, SortedList] = {}
+        # 寫後緩衝：同一會話的多次使用只保留最新時間，定期批量寫回
+        self.pending_touches: Dict[str, datetime] = {}
+        # 會話創建在上游線程池中執行，修改存儲和索引時需要加鎖
+        self.lock = threading.RLock()
+        # 會話存儲的版本號，任何增刪改都會遞增，用於生成列表的 ETag
+        self.version = 0
+    
+    def _index_session(self, session_info: Dict[str, Any]):
+        """將會話加入所有索引"""
+        entry = (session_info['last_used'], session_info['session_id'])
+        self.by_last_used.add(entry)
+        if session_info.get('user_id'):
+            self.by_user.setdefault(session_info['user_id'], SortedList()).add(entry)
+        self.by_dataset.setdefault(session_info['dataset_id'], SortedList()).add(entry)
     
-    def create_session(self, dataset_id: str, dataset_name: str, user_id: str = None) -> Dict[str, Any]:
-        """創建新的聊天會話"""
+    def _unindex_session(self, session_info: Dict[str, Any]):
+        """將會話從所有索引中移除"""
+        entry = (session_info['last_used'], session_info['session_id'])
+        self.by_last_used.discard(entry)
+        user_id = session_info.get('user_id')
+        if user_id and user_id in self.by_user:
+            self.by_user[user_id].discard(entry)
+            if not self.by_user[user_id]:
+                del self.by_user[user_id]
+        dataset_id = session_info['dataset_id']
+        if dataset_id in self.by_dataset:
+            self.by_dataset[dataset_id].discard(entry)
+            if not self.by_dataset[dataset_id]:
+                del self.by_dataset[dataset_id]
+    
+    def create_session(self, dataset_id: str, dataset_name: str, user_id: str = None,
+                       chat_id: str = None) -> Dict[str, Any]:
+        """創建新的聊天會話，提供 chat_id 時復用已有的聊天助手"""
         try:
-            # 創建聊天助手
-            chat_name = f"API聊天機器人_{uuid.uuid4().hex[:8]}"
-            chat_result = ragflow_client.create_chat(
-                name=chat_name,
-                dataset_ids=[dataset_id]
-            )
-            
-            if not chat_result['success']:
-                raise Exception(f"創建聊天助手失敗: {chat_result['message']}")
-            
-            chat_id = chat_result['data']['id']
+            if not chat_id:
+                chat_id = create_chat_assistant(dataset_id)
             
             # 創建會話
             session_result = ragflow_client.create_session(chat_id, user_id)
@@ -121,7 +402,10 @@ class SessionManager:
                 'last_used': datetime.now()
             }
             
-            self.sessions[session_id] = session_info
+            with self.lock:
+                self.sessions[session_id] = session_info
+                self._index_session(session_info)
+                self.version += 1
             
             logger.info(f"創建會話成功: {session_id}, 聊天助手: {chat_id}")
             
@@ -139,35 +423,328 @@ class SessionManager:
                 'message': str(e)
             }
     
+    def add_deferred_session(self, session_id: str, dataset_id: str, dataset_name: str, user_id: Optional[str],
+                             chat_id: str, question: str) -> Dict[str, Any]:
+        """登記回答緩存命中時的會話，不調用 RAGFlow；第一次追問時由 materialize_session 補建"""
+        session_info = {
+            'session_id': session_id,
+            'chat_id': chat_id,
+            'dataset_id': dataset_id,
+            'dataset_name': dataset_name,
+            'user_id': user_id,
+            'created_at': datetime.now(),
+            'last_used': datetime.now(),
+            'deferred_question': question
+        }
+        with self.lock:
+            self.sessions[session_id] = session_info
+            self._index_session(session_info)
+            self.version += 1
+        return session_info
+    
+    def materialize_session(self, session_id: str) -> str:
+        """為延遲會話創建 RAGFlow 會話，並重新提問首輪問題以補上會話歷史，返回 RAGFlow 的 session_id
+        
+        RAGFlow 的會話接口不能寫入歷史消息，只能重新提問：每個命中緩存後被追問的會話多一次 LLM 調用，
+        重新生成的回答不返回給客戶端。因此回答緩存默認關閉，由 ANSWER_CACHE_TTL 開啟。
+        """
+        session_info = self.sessions.get(session_id)
+        if not session_info:
+            raise Exception("會話不存在")
+        if not session_info.get('deferred_question'):
+            return session_info.get('ragflow_session_id') or session_id
+        
+        chat_id = session_info['chat_id']
+        session_result = ragflow_client.create_session(chat_id, session_info.get('user_id'))
+        if not session_result['success']:
+            # 緩存中記錄的聊天助手可能已被刪除，換一個新的
+            chat_id = create_chat_assistant(session_info['dataset_id'])
+            session_result = ragflow_client.create_session(chat_id, session_info.get('user_id'))
+            if not session_result['success']:
+                raise Exception(f"創建會話失敗: {session_result['message']}")
+        ragflow_session_id = session_result['data']['id']
+        
+        chat_result = ragflow_client.chat_completion(
+            chat_id=chat_id,
+            session_id=ragflow_session_id,
+            question=session_info['deferred_question'],
+            quote=False,
+            stream=False
+        )
+        if not chat_result['success']:
+            raise Exception(f"重建會話歷史失敗: {chat_result['message']}")
+        
+        with self.lock:
+            session_info['chat_id'] = chat_id
+            session_info['ragflow_session_id'] = ragflow_session_id
+            session_info.pop('deferred_question', None)
+            self.version += 1
+        logger.info(f"延遲會話已補建: {session_id} -> {ragflow_session_id}")
+        return ragflow_session_id
+    
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """獲取會話信息"""
         return self.sessions.get(session_id)
     
     def update_session_usage(self, session_id: str):
-        """更新會話使用時間"""
+        """記錄會話使用時間，寫入先在緩衝區合併，由 flush_touches 批量寫回"""
         if session_id in self.sessions:
-            self.sessions[session_id]['last_used'] = datetime.now()
+            self.pending_touches[session_id] = datetime.now()
     
-    def cleanup_old_sessions(self, max_age_hours: int = 24):
-        """清理舊會話"""
-        current_time = datetime.now()
-        expired_sessions = []
+    def flush_touches(self) -> int:
+        """將緩衝的會話使用時間批量寫回存儲和索引"""
+        if not self.pending_touches:
+            return 0
         
-        for session_id, session_info in self.sessions.items():
-            age = (current_time - session_info['last_used']).total_seconds() / 3600
-            if age > max_age_hours:
-                expired_sessions.append(session_id)
+        with self.lock:
+            batch, self.pending_touches = self.pending_touches, {}
+            flushed = 0
+            for session_id, last_used in batch.items():
+                session_info = self.sessions.get(session_id)
+                if session_info and last_used > session_info['last_used']:
+                    self._unindex_session(session_info)
+                    session_info['last_used'] = last_used
+                    self._index_session(session_info)
+                    flushed += 1
+            if flushed:
+                self.version += 1
+        return flushed
+    
+    def import_session(self, session_info: Dict[str, Any]):
+        """導入其他節點移交過來的會話"""
+        with self.lock:
+            self.delete_session(session_info['session_id'])
+            self.sessions[session_info['session_id']] = session_info
+            self._index_session(session_info)
+            self.version += 1
+    
+    def delete_session(self, session_id: str) -> bool:
+        """刪除單個會話"""
+        with self.lock:
+            self.pending_touches.pop(session_id, None)
+            session_info = self.sessions.pop(session_id, None)
+            if not session_info:
+                return False
+            self._unindex_session(session_info)
+            self.version += 1
+        chunk_store.forget(session_id)
+        return True
+    
+    def _iter_matching(self, user_id: str = None, dataset_id: str = None,
+                       last_used_after: datetime = None, last_used_before: datetime = None,
+                       cursor: Tuple[datetime, str] = None):
+        """按 last_used 降序遍歷符合條件的會話
+        
+        優先選用最小的索引，時間範圍與游標均以二分查找定位，不做全表掃描。
+        """
+        candidates = [self.by_last_used]
+        if user_id:
+            candidates.append(self.by_user.get(user_id, SortedList()))
+        if dataset_id:
+            candidates.append(self.by_dataset.get(dataset_id, SortedList()))
+        index = min(candidates, key=len)
         
-        for session_id in expired_sessions:
-            del self.sessions[session_id]
-            logger.info(f"清理過期會話: {session_id}")
+        low = index.bisect_left((last_used_after,)) if last_used_after else 0
+        high = len(index)
+        if last_used_before:
+            high = min(high, index.bisect_left((last_used_before,)))
+        if cursor:
+            high = min(high, index.bisect_left(cursor))
+        
+        for _, session_id in index.islice(low, high, reverse=True):
+            session_info = self.sessions[session_id]
+            if user_id and session_info.get('user_id') != user_id:
+                continue
+            if dataset_id and session_info['dataset_id'] != dataset_id:
+                continue
+            yield session_info
+    
+    def list_sessions(self, user_id: str = None, dataset_id: str = None,
+                      last_used_after: datetime = None, last_used_before: datetime = None,
+                      cursor: str = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分頁列出會話，返回 (會話列表, 下一頁游標)"""
+        position = decode_cursor(cursor) if cursor else None
+        page = []
+        with self.lock:
+            for session_info in self._iter_matching(user_id, dataset_id, last_used_after,
+                                                    last_used_before, position):
+                if len(page) == limit:
+                    last = page[-1]
+                    return page, encode_cursor(last['last_used'], last['session_id'])
+                page.append(session_info)
+        return page, None
+    
+    def delete_sessions(self, user_id: str = None, dataset_id: str = None,
+                        last_used_after: datetime = None, last_used_before: datetime = None) -> List[str]:
+        """按條件批量刪除會話，返回被刪除的會話 ID"""
+        # 先寫回緩衝的使用時間，按 last_used 篩選時才不會誤刪剛使用過的會話
+        self.flush_touches()
+        with self.lock:
+            matched = [
+                session_info['session_id']
+                for session_info in self._iter_matching(user_id, dataset_id, last_used_after, last_used_before)
+            ]
+            for session_id in matched:
+                self.delete_session(session_id)
+        return matched
+    
+    def cleanup_old_sessions(self, max_age_hours: int = 24) -> List[str]:
+        """清理舊會話，返回被清理的會話 ID"""
+        # 先寫回緩衝的使用時間，避免把剛使用過的會話當作過期
+        self.flush_touches()
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        with self.lock:
+            expired_sessions = [
+                session_id
+                for _, session_id in self.by_last_used.irange(maximum=(cutoff,), inclusive=(True, False))
+            ]
+            
+            for session_id in expired_sessions:
+                self.delete_session(session_id)
+                logger.info(f"清理過期會話: {session_id}")
         
-        return len(expired_sessions)
+        return expired_sessions
 
 # 創建會話管理器
 session_manager = SessionManager()
 
+# 集群轉發
+async def forward_to_owner(session_id: str, method: str, path: str, json: Any = None,
+                           headers: Dict[str, str] = None) -> Response:
+    """將請求轉發到會話的歸屬節點並原樣返回其回應"""
+    owner = cluster.owner_of(session_id)
+    try:
+        response = await run_in_threadpool(cluster.forward, owner, method, path, json=json, headers=headers)
+    except requests.RequestException as e:
+        logger.error(f"轉發到節點 {owner} 失敗: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"轉發到節點 {owner} 失敗: {str(e)}")
+    
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get('content-type')
+    )
+
+async def forward_stream_to_owner(resource_id: str, path: str, headers: Dict[str, str] = None) -> Response:
+    """將 SSE 請求轉發到歸屬節點，邊收邊發，不等整個流結束"""
+    owner = cluster.owner_of(resource_id)
+    try:
+        response = await run_in_threadpool(cluster.forward, owner, 'GET', path, headers=headers, stream=True)
+    except requests.RequestException as e:
+        logger.error(f"轉發到節點 {owner} 失敗: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"轉發到節點 {owner} 失敗: {str(e)}")
+    
+    # 錯誤回應（流不存在、已過期等）原樣返回
+    if response.status_code != 200:
+        try:
+            content = await run_in_threadpool(lambda: response.content)
+        finally:
+            response.close()
+        return Response(content=content, status_code=response.status_code,
+                        media_type=response.headers.get('content-type'))
+    
+    async def relay():
+        try:
+            async for chunk in iterate_in_threadpool(response.iter_content(chunk_size=None)):
+                yield chunk
+        finally:
+            response.close()
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if 'X-Stream-Id' in response.headers:
+        headers['X-Stream-Id'] = response.headers['X-Stream-Id']
+    return StreamingResponse(relay(), media_type=response.headers.get('content-type'), headers=headers)
+
+async def handoff_sessions(node: str, session_infos: List[Dict[str, Any]]) -> bool:
+    """將會話記錄移交給歸屬節點"""
+    try:
+        response = await run_in_threadpool(
+            cluster.forward, node, 'POST', '/internal/sessions', json=jsonable_encoder(session_infos)
+        )
+        response.raise_for_status()
+        return True
+    except requests.RequestException as e:
+        logger.error(f"移交會話到節點 {node} 失敗: {str(e)}")
+        return False
+
+async def handoff_messages(node: str, session_ids: List[str]) -> bool:
+    """將會話的消息記錄移交給歸屬節點，沒有記錄的會話不發送"""
+    def export() -> Dict[str, List[Dict[str, Any]]]:
+        message_log.flush()
+        transcripts = {}
+        for session_id in session_ids:
+            messages = message_log.export_session(session_id)
+            if messages:
+                transcripts[session_id] = messages
+        return transcripts
+    
+    transcripts = await run_in_threadpool(export)
+    if not transcripts:
+        return True
+    try:
+        response = await run_in_threadpool(
+            cluster.forward, node, 'POST', '/internal/messages', json=jsonable_encoder(transcripts)
+        )
+        response.raise_for_status()
+        return True
+    except requests.RequestException as e:
+        logger.error(f"移交消息記錄到節點 {node} 失敗: {str(e)}")
+        return False
+
+async def lookup_dataset_names() -> Dict[str, str]:
+    """返回數據集 ID 到名稱的映射（數據集目錄索引中的字典，只讀）"""
+    try:
+        await dataset_catalog.get()
+    except Exception as e:
+        logger.warning(f"獲取數據集名稱失敗: {str(e)}")
+        return {}
+    return dataset_catalog.index.names
+
+async def open_session(dataset_id: str, dataset_name: str, user_id: str = None,
+                       chat_id: str = None, handoff: bool = True) -> str:
+    """創建會話，會話不歸屬本節點時把記錄移交給歸屬節點"""
+    session_result = await call_upstream(
+        session_manager.create_session,
+        dataset_id=dataset_id,
+        dataset_name=dataset_name,
+        user_id=user_id,
+        chat_id=chat_id
+    )
+    
+    if not session_result['success']:
+        raise HTTPException(status_code=500, detail=session_result['message'])
+    
+    session_id = session_result['session_id']
+    if handoff and cluster.is_remote(session_id):
+        if await handoff_sessions(cluster.owner_of(session_id), [session_manager.get_session(session_id)]):
+            session_manager.delete_session(session_id)
+    return session_id
+
+async def rebalance_sessions() -> int:
+    """成員變更後，只把歸屬發生變化的會話移交給新節點"""
+    session_manager.flush_touches()
+    
+    handoffs: Dict[str, List[Dict[str, Any]]] = {}
+    with session_manager.lock:
+        for session_id, session_info in session_manager.sessions.items():
+            if cluster.is_remote(session_id):
+                handoffs.setdefault(cluster.owner_of(session_id), []).append(session_info)
+    
+    # 先移交消息記錄再移交會話，新節點接管會話時歷史記錄已經就位
+    moved_count = 0
+    for node, session_infos in handoffs.items():
+        session_ids = [session_info['session_id'] for session_info in session_infos]
+        if await handoff_messages(node, session_ids) and await handoff_sessions(node, session_infos):
+            for session_id in session_ids:
+                session_manager.delete_session(session_id)
+                message_log.delete_session(session_id)
+            moved_count += len(session_infos)
+    return moved_count
+
 # API 端點
+ACCEPT_DESCRIPTION = "application/msgpack 或 application/cbor 時以二進制格式返回"
+IF_NONE_MATCH_DESCRIPTION = "上次回應的 ETag，數據未變化時返回 304"
+
 @app.get("/", summary="健康檢查")
 async def root():
     """API 健康檢查"""
@@ -178,61 +755,382 @@ async def root():
         "timestamp": datetime.now()
     }
 
-@app.get("/datasets", response_model=List[DatasetInfo], summary="獲取數據集列表")
-async def get_datasets():
-    """獲取所有可用的數據集"""
+def dataset_info(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """把上游的數據集整理為 DatasetInfo 的字段"""
+    return {
+        'id': dataset.get('id', ''),
+        'name': dataset.get('name', 'Unknown'),
+        'description': dataset.get('description'),
+        'document_count': dataset.get('document_count') or 0,
+        'create_time': dataset.get('create_time')
+    }
+
+async def iter_dataset_pages() -> AsyncIterator[List[Dict[str, Any]]]:
+    """按頁序逐頁返回全部數據集，同時最多有 DATASET_PAGE_CONCURRENCY 個頁請求在進行
+    
+    每頁是一次獨立的上游調用，與其他 RAGFlow 請求共用 UPSTREAM_MAX_CONCURRENCY 的上限。
+    第一頁返回總數時只請求需要的頁；否則向後預取，遇到不滿一頁的結果即停止。任何一頁失敗時拋出 RuntimeError。
+    """
+    first = await call_upstream(ragflow_client.list_datasets_page, 1, DATASET_PAGE_SIZE)
+    yield first['data']
+    if len(first['data']) < DATASET_PAGE_SIZE:
+        return
+    
+    last_page = -(-first['total'] // DATASET_PAGE_SIZE) if first['total'] is not None else None
+    next_page = 2
+    pending: Deque[asyncio.Future] = deque()
     try:
-        result = ragflow_client.list_datasets()
-        
-        if not result['success']:
-            raise HTTPException(status_code=500, detail=result['message'])
-        
+        while True:
+            while len(pending) < max(1, DATASET_PAGE_CONCURRENCY) and (last_page is None or next_page <= last_page):
+                pending.append(asyncio.ensure_future(
+                    call_upstream(ragflow_client.list_datasets_page, next_page, DATASET_PAGE_SIZE)
+                ))
+                next_page += 1
+            if not pending:
+                return
+            page = (await pending.popleft())['data']
+            if page:
+                yield page
+            if len(page) < DATASET_PAGE_SIZE:
+                return
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def fetch_datasets() -> List[Dict[str, Any]]:
+    """從 RAGFlow 分頁拉取全部數據集"""
+    try:
+        return [dataset_info(dataset) async for page in iter_dataset_pages() for dataset in page]
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+dataset_catalog = DatasetCatalog(fetch_datasets, DATASET_CATALOG_TTL)
+
+async def fetch_dataset_page(page: int, page_size: int) -> List[Dict[str, Any]]:
+    """按創建時間從舊到新獲取一頁數據集的元數據，供變化偵測使用"""
+    result = await call_upstream(ragflow_client.list_datasets_page, page, page_size, desc=False)
+    return result['data']
+
+dataset_watcher = DatasetWatcher(fetch_dataset_page, DATASET_PAGE_SIZE, DATASET_WATCH_PAGES, DATASET_WATCH_INTERVAL)
+# 數據集內容變化時文件數也可能變化，下次讀取目錄時重新拉取
+dataset_watcher.listeners.append(lambda changed: dataset_catalog.invalidate())
+
+answer_cache = AnswerCache(
+    dataset_watcher.generation,
+    max_bytes=ANSWER_CACHE_MAX_BYTES,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    store=AnswerStore(ANSWER_CACHE_PATH, ANSWER_CACHE_DISK_MAX_ENTRIES) if ANSWER_CACHE_PATH else None
+)
+dataset_watcher.listeners.append(answer_cache.purge)
+# 世代號與回答一起保存，重啟後文件中的舊回答仍能正確判斷是否過時
+dataset_watcher.sweep_listeners.append(
+    lambda: answer_cache.save_datasets(dataset_watcher.generations, dataset_watcher.signatures)
+)
+
+def cacheable_answer(question: str, quote: bool, chat_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """回答緩存中保存的內容，附帶提前刷新時重新提問所需的字段"""
+    return {
+        'question': question,
+        'quote': quote,
+        'chat_id': chat_id,
+        'answer': data['answer'],
+        'reference': data.get('reference', [])
+    }
+
+async def refresh_cached_answer(entry: RefreshEntry):
+    """在臨時的 RAGFlow 會話中重新生成緩存的回答，不創建本地會話或消息記錄
+
+    臨時會話用完即刪除，不在 RAGFlow 上累積；不復用會話，以免歷史問答影響重新生成的回答。
+    """
+    session_result = await call_upstream(ragflow_client.create_session, entry.chat_id)
+    if not session_result['success']:
+        raise RuntimeError(session_result['message'])
+    session_id = session_result['data']['id']
+    try:
+        chat_result = await call_upstream(
+            ragflow_client.chat_completion,
+            chat_id=entry.chat_id,
+            session_id=session_id,
+            question=entry.question,
+            quote=entry.quote,
+            stream=False
+        )
+    finally:
+        delete_result = await call_upstream(ragflow_client.delete_sessions, entry.chat_id, [session_id])
+        if not delete_result['success']:
+            logger.warning(f"刪除刷新用的 RAGFlow 會話 {session_id} 失敗: {delete_result['message']}")
+    if not chat_result['success'] or not chat_result['data'].get('answer'):
+        raise RuntimeError(chat_result['message'] or '回答為空')
+    answer_cache.set(entry.dataset_id, entry.question, entry.quote,
+                     cacheable_answer(entry.question, entry.quote, entry.chat_id, chat_result['data']))
+
+answer_cache.scheduler = RefreshAheadScheduler(
+    refresh_cached_answer,
+    is_idle=lambda: upstream_inflight < ANSWER_REFRESH_MAX_INFLIGHT,
+    ahead_seconds=ANSWER_REFRESH_AHEAD if ANSWER_CACHE_TTL > 0 else 0,
+    min_hits=ANSWER_REFRESH_MIN_HITS,
+    per_minute=ANSWER_REFRESH_PER_MINUTE,
+    interval=ANSWER_REFRESH_INTERVAL
+)
+
+async def stream_datasets() -> StreamingResponse:
+    """邊從 RAGFlow 分頁拉取邊以 NDJSON 輸出，全部取完後更新數據集目錄
+    
+    第一頁在返回回應前取得，失敗時返回 500；之後的頁失敗時中斷連接，客戶端應視為不完整。
+    """
+    pages = iter_dataset_pages()
+    try:
+        first_page = await pages.__anext__()
+    except Exception as e:
+        await pages.aclose()
+        logger.error(f"獲取數據集失敗: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def ndjson_lines():
         datasets = []
-        for dataset in result['data']:
-            datasets.append(DatasetInfo(
-                id=dataset.get('id', ''),
-                name=dataset.get('name', 'Unknown'),
-                description=dataset.get('description'),
-                document_count=dataset.get('document_count', 0),
-                create_time=dataset.get('create_time')
-            ))
-        
-        return datasets
-        
+        page = first_page
+        try:
+            while True:
+                page = [dataset_info(dataset) for dataset in page]
+                datasets.extend(page)
+                yield dump(page, NDJSON_MEDIA_TYPE)
+                try:
+                    page = await pages.__anext__()
+                except StopAsyncIteration:
+                    break
+        except Exception as e:
+            # 已經開始輸出，只能中斷連接讓客戶端看到不完整的回應
+            logger.error(f"分頁拉取數據集中斷: {str(e)}")
+            raise
+        finally:
+            await pages.aclose()
+        dataset_catalog.update(datasets)
+    
+    return StreamingResponse(
+        ndjson_lines(), media_type=NDJSON_MEDIA_TYPE, headers={'Vary': 'Accept', 'Cache-Control': 'no-cache'}
+    )
+
+async def load_catalog() -> List[Dict[str, Any]]:
+    """讀取數據集目錄，拉取失敗時返回 500"""
+    try:
+        return await dataset_catalog.get()
     except Exception as e:
         logger.error(f"獲取數據集失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/chat", response_model=ChatResponse, summary="發送聊天消息")
-async def chat(request: ChatRequest):
-    """發送聊天消息並獲取回答"""
+def catalog_headers(media_type: str) -> Dict[str, str]:
+    """數據集目錄回應的 ETag 和緩存頭"""
+    return {
+        'ETag': make_etag('datasets', dataset_catalog.version, media_type.rsplit('/', 1)[1]),
+        'Cache-Control': f'public, max-age={DATASETS_MAX_AGE}'
+    }
+
+@app.get("/datasets", response_model=List[DatasetInfo], summary="獲取數據集列表")
+async def get_datasets(
+    q: Optional[str] = Query(None, description="按名稱查找，忽略大小寫和全半角"),
+    match: Literal['substring', 'prefix'] = Query('substring', description="q 的匹配方式：子串或前綴"),
+    min_documents: Optional[int] = Query(None, ge=0, description="最少文件數"),
+    max_documents: Optional[int] = Query(None, ge=0, description="最多文件數"),
+    limit: Optional[int] = Query(None, ge=1, description="最多返回的數據集數"),
+    accept: Optional[str] = Header(None, description=ACCEPT_DESCRIPTION + "；application/x-ndjson 時每行一個數據集"),
+    if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION)
+):
+    """獲取所有可用的數據集，或按名稱和文件數查找
+    
+    列表由服務端從上游數據構建，直接編碼返回，不再逐條校驗 DatasetInfo。
+    目錄在本地緩存 DATASET_CATALOG_TTL 秒，ETag 由目錄版本號生成；If-None-Match 命中時返回 304，不序列化回應體。
+    查找走目錄的內存索引，名稱以 q 開頭的排在前面。
+    Accept 為 application/x-ndjson、不帶查詢條件且目錄需要刷新時，邊從 RAGFlow 分頁拉取邊輸出，客戶端不必等最後一頁。
+    """
+    filtered = q or min_documents is not None or max_documents is not None or limit is not None
+    media_type = negotiate_media_type(accept, [NDJSON_MEDIA_TYPE, *BINARY_MEDIA_TYPES])
+    if media_type == NDJSON_MEDIA_TYPE and not filtered and not dataset_catalog.is_fresh():
+        return await stream_datasets()
+    
+    datasets = await load_catalog()
+    headers = catalog_headers(media_type)
+    if etag_matches(if_none_match, headers['ETag']):
+        return not_modified({**headers, 'Vary': 'Accept'})
+    if filtered:
+        datasets = dataset_catalog.index.search(
+            q, prefix_only=match == 'prefix', min_documents=min_documents, max_documents=max_documents, limit=limit
+        )
+    return negotiated_response(datasets, media_type, headers=headers)
+
+@app.get("/datasets/{dataset_id}", response_model=DatasetInfo, summary="獲取單個數據集")
+async def get_dataset(dataset_id: str,
+                      accept: Optional[str] = Header(None, description=ACCEPT_DESCRIPTION),
+                      if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION)):
+    """按 ID 從數據集目錄索引中直接查找，RAGFlow 中剛創建的數據集在目錄刷新後才可見"""
+    await load_catalog()
+    dataset = dataset_catalog.index.get(dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="數據集不存在")
+    
+    media_type = negotiate_media_type(accept)
+    headers = catalog_headers(media_type)
+    if etag_matches(if_none_match, headers['ETag']):
+        return not_modified({**headers, 'Vary': 'Accept'})
+    return negotiated_response(dataset, media_type, headers=headers)
+
+async def dataset_name_of(dataset_id: str) -> str:
+    """從數據集目錄索引中查找名稱"""
+    try:
+        await dataset_catalog.get()
+    except Exception:
+        raise HTTPException(status_code=500, detail="無法獲取數據集信息")
+    return dataset_catalog.index.names.get(dataset_id, "Unknown")
+
+# 正在補建的延遲會話，同一會話的並發追問只補建一次
+materializing_sessions: Dict[str, asyncio.Future] = {}
+
+async def upstream_session_id(session_info: Dict[str, Any]) -> str:
+    """返回會話在 RAGFlow 中的 session_id
+    
+    回答緩存命中時創建的延遲會話沒有對應的 RAGFlow 會話，在第一次追問時才創建，
+    並先重新提問首輪問題，使 RAGFlow 的會話歷史包含首輪問答。
+    """
+    if not session_info.get('deferred_question'):
+        return session_info.get('ragflow_session_id') or session_info['session_id']
+    
+    session_id = session_info['session_id']
+    pending = materializing_sessions.get(session_id)
+    if pending is None:
+        pending = asyncio.ensure_future(call_upstream(session_manager.materialize_session, session_id))
+        materializing_sessions[session_id] = pending
+        pending.add_done_callback(lambda _: materializing_sessions.pop(session_id, None))
+    return await asyncio.shield(pending)
+
+async def resolve_session(request: ChatRequest, forwarded_by: Optional[str] = None,
+                          dataset_name: Optional[str] = None, chat_id: Optional[str] = None) -> ChatRequest:
+    """確保請求帶有 session_id，沒有時創建新會話
+    
+    新建會話時可傳入已知的 dataset_name 和 chat_id，省去數據集查詢並復用聊天助手。
+    """
+    if request.session_id:
+        return request
+    
+    if dataset_name is None:
+        dataset_name = await dataset_name_of(request.dataset_id)
+    
+    # 創建新會話，不歸屬本節點時會移交給歸屬節點
+    session_id = await open_session(
+        dataset_id=request.dataset_id,
+        dataset_name=dataset_name,
+        user_id=request.user_id,
+        chat_id=chat_id,
+        handoff=not forwarded_by
+    )
+    return request.model_copy(update={'session_id': session_id})
+
+def normalize_sources(reference: Any) -> List[Dict[str, Any]]:
+    """把 RAGFlow 的 reference 統一為片段列表"""
+    if isinstance(reference, dict) and 'chunks' in reference:
+        return reference['chunks']
+    if isinstance(reference, list):
+        return reference
+    return []
+
+def project_sources(sources: List[Dict[str, Any]], fields: Optional[List[str]] = None,
+                    max_chars: Optional[int] = None, max_count: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按請求裁剪引用片段：限制數量、只保留指定字段、截斷內容
+    
+    返回新的列表和字典，不修改原片段（消息日誌中保存的仍是完整片段）。
+    """
+    if max_count is not None:
+        sources = sources[:max_count]
+    if fields is None and max_chars is None:
+        return sources
+    
+    projected = []
+    for source in sources:
+        if isinstance(source, dict):
+            if fields is not None:
+                source = {field: source[field] for field in fields if field in source}
+            if max_chars is not None:
+                for key in ('content', 'content_with_weight'):
+                    value = source.get(key)
+                    if isinstance(value, str) and len(value) > max_chars:
+                        source = {**source, key: value[:max_chars]}
+        projected.append(source)
+    return projected
+
+def record_answer(request: ChatRequest, session_info: Dict[str, Any], data: Dict[str, Any],
+                  started_at: float, chunk_scope: Optional[str] = None, cached: bool = False) -> ChatResponse:
+    """整理上游回答，寫入消息日誌並返回 ChatResponse
+    
+    請求 source_refs 時，片段在 chunk_scope（默認為會話）內只有第一次返回內容。
+    """
+    sources = normalize_sources(data.get('reference', []))
+    answer = data.get('answer', '')
+    
+    # 記錄到消息日誌（只入隊，不阻塞回應）
+    message_log.append(request.session_id, {
+        'message_id': uuid.uuid4().hex,
+        'question': request.question,
+        'answer': answer,
+        'sources': sources,
+        'latency_ms': round((time.perf_counter() - started_at) * 1000, 1),
+        'created_at': datetime.now()
+    })
+    
+    # 回應中的引用按請求裁剪，quote 為 false 時不返回
+    if request.quote:
+        sources = project_sources(sources, request.source_fields, request.max_source_chars, request.max_sources)
+        if request.source_refs:
+            # 裁剪後的片段哈希與日誌中的完整片段不同，也寫入日誌，內存存儲淘汰後仍可按哈希取回
+            if request.source_fields is not None or request.max_source_chars is not None:
+                message_log.append_chunks(sources)
+            sources = chunk_store.pack(chunk_scope or request.session_id, sources)
+    else:
+        sources = []
+    
+    # 數據由服務端構建，跳過校驗
+    return ChatResponse.model_construct(
+        success=True,
+        answer=answer,
+        sources=sources,
+        session_id=request.session_id,
+        chat_id=session_info['chat_id'],
+        message='回答成功',
+        timestamp=datetime.now(),
+        cached=cached
+    )
+
+async def process_chat(request: ChatRequest, forwarded_by: Optional[str] = None,
+                       forward_headers: Dict[str, str] = None,
+                       dataset_name: Optional[str] = None, chat_id: Optional[str] = None):
+    """處理一次聊天請求，返回 ChatResponse；轉發到其他節點時返回其原始回應
+    
+    不帶 session_id 的首輪問題與會話歷史無關，先查回答緩存。命中時不調用 RAGFlow，
+    返回的會話是延遲會話：客戶端繼續追問時才創建 RAGFlow 會話並補上首輪問答（見 upstream_session_id）。
+    """
+    started_at = time.perf_counter()
+    first_turn = not request.session_id
     try:
+        if first_turn:
+            cached = await answer_cache.get(request.dataset_id, request.question, request.quote)
+            if cached is not None:
+                session_info = session_manager.add_deferred_session(
+                    new_local_id(),
+                    request.dataset_id,
+                    dataset_name or await dataset_name_of(request.dataset_id),
+                    request.user_id,
+                    cached['chat_id'],
+                    request.question
+                )
+                request = request.model_copy(update={'session_id': session_info['session_id']})
+                return record_answer(request, session_info, cached, started_at, cached=True)
+        
+        request = await resolve_session(request, forwarded_by, dataset_name, chat_id)
         session_id = request.session_id
         
-        # 如果沒有提供 session_id，創建新會話
-        if not session_id:
-            # 首先獲取數據集信息
-            datasets_result = ragflow_client.list_datasets()
-            if not datasets_result['success']:
-                raise HTTPException(status_code=500, detail="無法獲取數據集信息")
-            
-            dataset_name = "Unknown"
-            for dataset in datasets_result['data']:
-                if dataset.get('id') == request.dataset_id:
-                    dataset_name = dataset.get('name', 'Unknown')
-                    break
-            
-            # 創建新會話
-            session_result = session_manager.create_session(
-                dataset_id=request.dataset_id,
-                dataset_name=dataset_name,
-                user_id=request.user_id
+        # 會話歸屬其他節點且本地沒有記錄時，轉發給歸屬節點處理
+        if (not forwarded_by and not session_manager.get_session(session_id)
+                and cluster.is_remote(session_id)):
+            return await forward_to_owner(
+                session_id, 'POST', '/chat', json=jsonable_encoder(request), headers=forward_headers
             )
-            
-            if not session_result['success']:
-                raise HTTPException(status_code=500, detail=session_result['message'])
-            
-            session_id = session_result['session_id']
         
         # 獲取會話信息
         session_info = session_manager.get_session(session_id)
@@ -243,35 +1141,24 @@ async def chat(request: ChatRequest):
         session_manager.update_session_usage(session_id)
         
         # 發送聊天請求
-        chat_result = ragflow_client.chat_completion(
+        ragflow_session_id = await upstream_session_id(session_info)
+        chat_result = await call_upstream(
+            ragflow_client.chat_completion,
             chat_id=session_info['chat_id'],
-            session_id=session_id,
+            session_id=ragflow_session_id,
             question=request.question,
             quote=request.quote,
-            stream=request.stream
+            stream=False  # 流式回應由 stream_chat 處理
         )
         
         if not chat_result['success']:
             raise HTTPException(status_code=500, detail=chat_result['message'])
         
         data = chat_result['data']
-        
-        # 處理 sources 格式
-        sources = data.get('reference', [])
-        if isinstance(sources, dict) and 'chunks' in sources:
-            sources = sources['chunks']
-        elif not isinstance(sources, list):
-            sources = []
-        
-        return ChatResponse(
-            success=True,
-            answer=data.get('answer', ''),
-            sources=sources,
-            session_id=session_id,
-            chat_id=session_info['chat_id'],
-            message='回答成功',
-            timestamp=datetime.now()
-        )
+        if first_turn and data.get('answer'):
+            answer_cache.set(request.dataset_id, request.question, request.quote,
+                             cacheable_answer(request.question, request.quote, session_info['chat_id'], data))
+        return record_answer(request, session_info, data, started_at)
         
     except HTTPException:
         raise
@@ -279,36 +1166,893 @@ async def chat(request: ChatRequest):
         logger.error(f"聊天請求失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sessions", response_model=List[SessionInfo], summary="獲取活躍會話列表")
-async def get_sessions():
-    """獲取所有活躍的會話"""
-    sessions = []
-    for session_id, session_info in session_manager.sessions.items():
-        sessions.append(SessionInfo(
-            session_id=session_info['session_id'],
-            chat_id=session_info['chat_id'],
-            dataset_id=session_info['dataset_id'],
-            dataset_name=session_info['dataset_name'],
-            user_id=session_info['user_id'],
-            created_at=session_info['created_at'],
-            last_used=session_info['last_used']
-        ))
+def unwrap_chat_result(result) -> ChatResponse:
+    """把 process_chat 的結果統一為 ChatResponse，轉發回應出錯時拋出 HTTPException"""
+    if not isinstance(result, Response):
+        return result
+    data = json.loads(result.body)
+    if result.status_code != 200:
+        raise HTTPException(status_code=result.status_code, detail=data.get('detail', data))
+    return ChatResponse(**data)
+
+# RAGFlow 成功回應的開頭，用於在不解析回應體的情況下判斷是否出錯
+RAW_SUCCESS_PREFIX = re.compile(rb'\s*\{\s*"code"\s*:\s*0\s*[,}]')
+
+def expand_raw_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """把透傳模式記錄的 RAGFlow 原始回應展開為 answer 和 sources"""
+    raw = message.pop('ragflow', None)
+    if raw is not None:
+        data = raw.get('data') or {}
+        message['answer'] = data.get('answer', '')
+        message['sources'] = normalize_sources(data.get('reference', []))
+    return message
+
+async def process_chat_raw(request: ChatRequest, forwarded_by: Optional[str] = None) -> Response:
+    """透傳模式：RAGFlow 的回應體不經解析原樣流式返回，外層只加上會話信息
+    
+    回應格式為 {"success": true, "session_id": ..., "chat_id": ..., "timestamp": ..., "ragflow": <原始回應體>}。
+    """
+    started_at = time.perf_counter()
+    request = await resolve_session(request, forwarded_by)
+    session_id = request.session_id
+    
+    if (not forwarded_by and not session_manager.get_session(session_id)
+            and cluster.is_remote(session_id)):
+        return await forward_to_owner(session_id, 'POST', '/chat?raw=true', json=jsonable_encoder(request))
+    
+    session_info = session_manager.get_session(session_id)
+    if not session_info:
+        raise HTTPException(status_code=404, detail="會話不存在")
+    session_manager.update_session_usage(session_id)
+    
+    ragflow_session_id = await upstream_session_id(session_info)
+    chunks = stream_upstream(
+        ragflow_client.chat_completion_raw,
+        chat_id=session_info['chat_id'],
+        session_id=ragflow_session_id,
+        question=request.question,
+        quote=request.quote
+    )
+    
+    # 先讀到足以判斷 code 的開頭，出錯時仍可返回正常的錯誤狀態碼
+    parts: List[bytes] = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            if sum(len(part) for part in parts) >= 64:
+                break
+        head = b''.join(parts)
+        if not RAW_SUCCESS_PREFIX.match(head):
+            # 開頭不是標準格式時讀完整個回應體再判斷
+            async for chunk in chunks:
+                parts.append(chunk)
+            result = json.loads(b''.join(parts))
+            if result.get('code') != 0:
+                raise HTTPException(status_code=500, detail=result.get('message', '獲取回答失敗'))
+    except RuntimeError as e:
+        await chunks.aclose()
+        raise HTTPException(status_code=500, detail=str(e))
+    except ValueError:
+        await chunks.aclose()
+        raise HTTPException(status_code=502, detail="RAGFlow 回應不是有效的 JSON")
+    
+    envelope = json.dumps({
+        'success': True,
+        'session_id': session_id,
+        'chat_id': session_info['chat_id'],
+        'timestamp': datetime.now().isoformat()
+    }, ensure_ascii=False)
+    
+    async def body():
+        try:
+            yield envelope[:-1].encode('utf-8') + b',"ragflow":'
+            for part in list(parts):
+                yield part
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            yield b'}'
+        finally:
+            await chunks.aclose()
+        
+        # 原始回應體直接拼入日誌記錄，讀取時再展開為 answer 和 sources
+        message_log.append(session_id, {
+            'message_id': uuid.uuid4().hex,
+            'question': request.question,
+            'latency_ms': round((time.perf_counter() - started_at) * 1000, 1),
+            'created_at': datetime.now()
+        }, raw_fields={'ragflow': b''.join(parts)})
+    
+    return StreamingResponse(body(), media_type='application/json')
+
+async def stream_chat(request: ChatRequest, on_delta: Callable[[str], Awaitable[None]],
+                      chunk_scope: Optional[str] = None) -> ChatResponse:
+    """流式處理一次聊天請求，把新增的回答文字交給 on_delta，返回完整的 ChatResponse
+    
+    上游每次推送截至當前的完整回答，這裡只取新增的後綴；STREAM_COALESCE_INTERVAL 內到達的
+    多段增量合併為一次調用。會話歸屬其他節點時通過 /chat 轉發，整個回答作為一段增量返回。
+    """
+    started_at = time.perf_counter()
+    request = await resolve_session(request)
+    session_info = session_manager.get_session(request.session_id)
+    if not session_info:
+        if cluster.is_remote(request.session_id):
+            response = unwrap_chat_result(await process_chat(request.model_copy(update={'stream': False})))
+            await on_delta(response.answer)
+            return response
+        raise HTTPException(status_code=404, detail="會話不存在")
+    
+    session_manager.update_session_usage(request.session_id)
+    
+    ragflow_session_id = await upstream_session_id(session_info)
+    events = stream_upstream(
+        ragflow_client.chat_completion_stream,
+        chat_id=session_info['chat_id'],
+        session_id=ragflow_session_id,
+        question=request.question,
+        quote=request.quote
+    )
+    data: Dict[str, Any] = {}
+    emitted = ''  # 已交給 on_delta 或等待合併的文字
+    pending = ''  # 等待合併的增量
+    last_flush = time.monotonic()
+    next_event = asyncio.ensure_future(events.__anext__())
+    try:
+        while True:
+            # 有待發增量時最多等到合併間隔結束，避免上游停頓時增量被長時間扣住
+            timeout = None
+            if pending:
+                timeout = max(0.0, last_flush + STREAM_COALESCE_INTERVAL - time.monotonic())
+            done, _ = await asyncio.wait({next_event}, timeout=timeout)
+            
+            if done:
+                try:
+                    data = next_event.result()
+                except StopAsyncIteration:
+                    break
+                next_event = asyncio.ensure_future(events.__anext__())
+                
+                current = data.get('answer') or ''
+                # 上游改寫了已發出的文字時不再發增量，以最終回應中的完整回答為準
+                if current.startswith(emitted):
+                    pending += current[len(emitted):]
+                    emitted = current
+            
+            if pending and time.monotonic() - last_flush >= STREAM_COALESCE_INTERVAL:
+                await on_delta(pending)
+                pending = ''
+                last_flush = time.monotonic()
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    finally:
+        if not next_event.done():
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+        await events.aclose()
+    
+    if pending:
+        await on_delta(pending)
+    return record_answer(request, session_info, data, started_at, chunk_scope)
+
+def new_local_id() -> str:
+    """生成歸屬本節點的 ID（任務、流式回答），其他節點收到查詢時可轉發過來"""
+    while True:
+        local_id = uuid.uuid4().hex
+        if not cluster.is_remote(local_id):
+            return local_id
+
+async def produce_answer(request: ChatRequest, stream: AnswerStream):
+    """生成一次流式回答，把 delta / done / error 事件寫入流"""
+    async def on_delta(text: str):
+        stream.publish('delta', {'delta': text})
+    
+    try:
+        response = await stream_chat(request, on_delta)
+        stream.publish('done', jsonable_encoder(response))
+    except HTTPException as e:
+        stream.publish('error', {'status': e.status_code, 'message': e.detail})
+    except Exception as e:
+        logger.error(f"流式聊天請求失敗: {str(e)}")
+        stream.publish('error', {'status': 500, 'message': str(e)})
+
+def stream_response(stream: AnswerStream, last_seq: int = 0) -> StreamingResponse:
+    """以 SSE 輸出流中 last_seq 之後的事件，每個事件的 id 為 "流 ID:序號"，可作為 Last-Event-ID 續傳"""
+    async def events():
+        stream_registry.attach(stream)
+        try:
+            async for event in stream.follow(last_seq):
+                yield f"id: {stream.stream_id}:{event.seq}\nevent: {event.event}\ndata: {event.data}\n\n"
+        finally:
+            stream_registry.detach(stream)
+    
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Stream-Id': stream.stream_id}
+    )
+
+async def resume_stream(last_event_id: Optional[str], stream_id: Optional[str] = None,
+                        forwarded_by: Optional[str] = None) -> Response:
+    """按 Last-Event-ID 續傳流式回答，流已過期或缺失的事件已被丟棄時拋出 HTTPException
+    
+    流 ID 歸屬其他節點時（見 new_local_id）轉發到該節點續傳。
+    """
+    parsed = parse_last_event_id(last_event_id)
+    if parsed and stream_id and parsed[0] != stream_id:
+        raise HTTPException(status_code=400, detail="Last-Event-ID 與流 ID 不符")
+    stream_id, last_seq = parsed or (stream_id, 0)
+    
+    stream = stream_registry.get(stream_id)
+    if not stream:
+        if not forwarded_by and cluster.is_remote(stream_id):
+            headers = {'Last-Event-ID': last_event_id} if parsed else None
+            return await forward_stream_to_owner(stream_id, f'/chat/streams/{stream_id}', headers=headers)
+        raise HTTPException(status_code=404, detail="流式回答不存在或已過期")
+    if not stream.can_resume(last_seq):
+        raise HTTPException(status_code=410, detail="斷開期間的事件已超出重放緩衝，請重新提問")
+    return stream_response(stream, last_seq)
+
+@app.post("/chat", response_model=ChatResponse, summary="發送聊天消息")
+async def chat(request: ChatRequest,
+               x_ragflow_forwarded_by: Optional[str] = Header(None),
+               idempotency_key: Optional[str] = Header(None, description="冪等鍵，重試時攜帶相同的值"),
+               last_event_id: Optional[str] = Header(None, description="流式回應斷線重連時攜帶最後收到的事件 ID"),
+               raw: bool = Query(False, description="透傳模式：直接返回 RAGFlow 原始回應體，外層只加會話信息"),
+               accept: Optional[str] = Header(None, description=ACCEPT_DESCRIPTION)):
+    """發送聊天消息並獲取回答
+    
+    stream 為 true 時以 SSE 逐段返回回答，重連時攜帶 Last-Event-ID 可從斷開處續傳。
+    raw 為 true 時透傳 RAGFlow 的原始回應體，省去解析和重新序列化（始終為 JSON）。
+    攜帶 Idempotency-Key 時，相同鍵的並發請求共享同一次回答，之後的重試直接返回保存的回應；
+    流式和透傳回應無法保存，與 Idempotency-Key 同時使用時返回 400，以免重試時再次調用 RAGFlow。
+    """
+    if idempotency_key and request.stream:
+        raise HTTPException(status_code=400, detail="流式回應不支持 Idempotency-Key，斷線後請攜帶 Last-Event-ID 續傳")
+    if idempotency_key and raw:
+        raise HTTPException(status_code=400, detail="透傳模式不支持 Idempotency-Key")
+    
+    if request.stream:
+        if parse_last_event_id(last_event_id):
+            return await resume_stream(last_event_id, forwarded_by=x_ragflow_forwarded_by)
+        stream = stream_registry.create(new_local_id(), functools.partial(produce_answer, request))
+        return stream_response(stream)
+    
+    if raw:
+        return await process_chat_raw(request, x_ragflow_forwarded_by)
+    
+    media_type = negotiate_media_type(accept)
+    if not idempotency_key:
+        result = await process_chat(request, x_ragflow_forwarded_by)
+        # 本地回答直接編碼，不再經過 response_model 校驗
+        if not isinstance(result, Response):
+            return negotiated_response(result, media_type)
+        # 轉發回應是 JSON，客戶端要求二進制格式時轉碼
+        if media_type != JSON_MEDIA_TYPE and result.status_code == 200:
+            return negotiated_response(json.loads(result.body), media_type)
+        return result
+    
+    async def run_chat() -> StoredResponse:
+        result = await process_chat(
+            request, x_ragflow_forwarded_by, forward_headers={'Idempotency-Key': idempotency_key}
+        )
+        if isinstance(result, Response):
+            return StoredResponse(result.status_code, result.body, result.media_type)
+        return StoredResponse(200, dump_json(result), 'application/json')
+    
+    try:
+        stored, replayed = await idempotency_store.execute(
+            idempotency_key, request_fingerprint(jsonable_encoder(request)), run_chat
+        )
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key 已用於內容不同的請求")
+    
+    headers = {'Idempotent-Replayed': 'true' if replayed else 'false'}
+    # 保存的回應統一為 JSON，重放時按本次請求的 Accept 轉碼
+    if media_type != JSON_MEDIA_TYPE and stored.status_code == 200:
+        return negotiated_response(json.loads(stored.body), media_type, headers=headers)
+    return Response(
+        content=stored.body,
+        status_code=stored.status_code,
+        media_type=stored.media_type,
+        headers=headers
+    )
+
+@app.get("/chat/streams/{stream_id}", summary="續傳流式回答")
+async def get_chat_stream(stream_id: str,
+                          last_event_id: Optional[str] = Header(None, description="最後收到的事件 ID"),
+                          x_ragflow_forwarded_by: Optional[str] = Header(None)):
+    """補發 Last-Event-ID 之後的事件，再跟隨生成中的回答直到結束；不帶 Last-Event-ID 時從頭輸出"""
+    return await resume_stream(last_event_id, stream_id, x_ragflow_forwarded_by)
+
+@app.get("/chunks/{chunk_hash}", summary="按哈希獲取引用片段")
+async def get_chunk(chunk_hash: str,
+                    session_id: Optional[str] = Query(None, description="片段所屬會話，多節點部署時用於找到歸屬節點"),
+                    x_ragflow_forwarded_by: Optional[str] = Header(None)):
+    """返回 source_refs 模式下只以哈希出現的片段內容，供客戶端本地緩存缺失時使用"""
+    chunk = chunk_store.get(chunk_hash)
+    if chunk is None:
+        chunk = await run_in_threadpool(message_log.read_chunk, chunk_hash)
+    if chunk is None:
+        if session_id and not x_ragflow_forwarded_by and cluster.is_remote(session_id):
+            return await forward_to_owner(session_id, 'GET', f'/chunks/{chunk_hash}')
+        raise HTTPException(status_code=404, detail="片段不存在或已淘汰")
+    return FastJSONResponse(chunk)
+
+@app.post("/search", response_model=SearchResponse, summary="檢索相關片段")
+async def search(request: SearchRequest):
+    """只檢索相關片段，不調用 LLM 生成回答
+    
+    結果按 (數據集及其世代號, 歸一化查詢, 參數) 緩存 SEARCH_CACHE_TTL 秒，數據集變化後其舊結果不再命中。
+    """
+    cache_key = (
+        dataset_watcher.generation_key(request.dataset_ids),
+        normalize_query(request.question),
+        tuple(sorted(set(request.document_ids))),
+        request.top_k,
+        request.similarity_threshold,
+        request.vector_similarity_weight,
+        request.keyword
+    )
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return SearchResponse(success=True, cached=True, timestamp=datetime.now(), **cached)
+    
+    result = await call_upstream(
+        ragflow_client.retrieve_chunks,
+        question=request.question,
+        dataset_ids=request.dataset_ids,
+        document_ids=request.document_ids,
+        page_size=request.top_k,
+        similarity_threshold=request.similarity_threshold,
+        vector_similarity_weight=request.vector_similarity_weight,
+        keyword=request.keyword
+    )
+    if not result['success']:
+        raise HTTPException(status_code=500, detail=result['message'])
+    
+    data = result['data'] or {}
+    retrieved = {
+        'chunks': data.get('chunks', []),
+        'doc_aggs': data.get('doc_aggs', []),
+        'total': data.get('total', 0)
+    }
+    search_cache.set(cache_key, retrieved)
+    return SearchResponse(success=True, cached=False, timestamp=datetime.now(), **retrieved)
+
+async def run_chat_job(request: ChatRequest) -> ChatResponse:
+    """執行一個異步聊天任務"""
+    return unwrap_chat_result(await process_chat(request))
+
+job_manager = JobManager(run_chat_job, JOB_WORKERS, JOB_MAX_QUEUED, JOB_RESULT_TTL)
+
+def job_info(job: Job) -> JobInfo:
+    return JobInfo(
+        job_id=job.job_id,
+        status=job.status,
+        result=job.result,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+@app.post("/jobs", response_model=JobInfo, status_code=202, summary="提交異步聊天任務")
+async def create_job(request: ChatRequest):
+    """提交聊天請求並立即返回任務 ID，回答在後台工作池中生成"""
+    try:
+        job = job_manager.submit(request, job_id=new_local_id())
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="任務隊列已滿，請稍後重試", headers={'Retry-After': '5'})
+    return job_info(job)
+
+@app.get("/jobs/{job_id}", response_model=JobInfo, summary="查詢異步任務")
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=55, description="長輪詢：最多等待任務完成的秒數"),
+    x_ragflow_forwarded_by: Optional[str] = Header(None)
+):
+    """查詢任務狀態和結果，wait 大於 0 時在任務完成或超時後返回"""
+    job = job_manager.get(job_id)
+    if not job:
+        if not x_ragflow_forwarded_by and cluster.is_remote(job_id):
+            return await forward_to_owner(job_id, 'GET', f'/jobs/{job_id}?wait={wait}')
+        raise HTTPException(status_code=404, detail="任務不存在或已過期")
+    
+    if wait and not job.finished:
+        await job_manager.wait(job, wait)
+    return job_info(job)
+
+@app.get("/jobs/{job_id}/events", summary="以 SSE 推送異步任務結果")
+async def get_job_events(job_id: str,
+                         x_ragflow_forwarded_by: Optional[str] = Header(None)):
+    """先推送當前狀態，等待期間定期發送心跳，任務完成後推送結果並結束"""
+    job = job_manager.get(job_id)
+    if not job:
+        if not x_ragflow_forwarded_by and cluster.is_remote(job_id):
+            return await forward_stream_to_owner(job_id, f'/jobs/{job_id}/events')
+        raise HTTPException(status_code=404, detail="任務不存在或已過期")
+    
+    async def job_events():
+        status = json.dumps({'job_id': job.job_id, 'status': job.status})
+        yield f"event: status\ndata: {status}\n\n"
+        while not await job_manager.wait(job, JOB_SSE_HEARTBEAT):
+            yield ": keep-alive\n\n"
+        yield f"event: {job.status}\ndata: {job_info(job).model_dump_json()}\n\n"
+    
+    return StreamingResponse(
+        job_events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.post("/chat/batch", summary="批量發送聊天消息")
+async def chat_batch(batch: BatchChatRequest,
+                     accept: Optional[str] = Header(None, description=ACCEPT_DESCRIPTION)):
+    """並發處理一批聊天請求，以 NDJSON 按完成順序流式返回
+    
+    每行是一個 {"type": "result"} 結果（含 index、耗時和錯誤信息），最後一行是 {"type": "summary"}。
+    沒有 session_id 的請求在整批內只查詢一次數據集，同一數據集共用一個聊天助手。
+    Accept 要求二進制格式時逐條輸出 MessagePack 對象或 CBOR Sequence，記錄結構相同。
+    """
+    media_type = negotiate_media_type(accept)
+    started_at = time.perf_counter()
+    semaphore = asyncio.Semaphore(min(batch.concurrency, UPSTREAM_MAX_CONCURRENCY))
     
-    return sessions
+    dataset_names: Dict[str, str] = {}
+    if any(not item.session_id for item in batch.requests):
+        dataset_names = await lookup_dataset_names()
+    
+    assistants: Dict[str, asyncio.Future] = {}
+    shared_sessions: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+    
+    def get_assistant(dataset_id: str) -> asyncio.Future:
+        if dataset_id not in assistants:
+            assistants[dataset_id] = asyncio.ensure_future(call_upstream(create_chat_assistant, dataset_id))
+        return assistants[dataset_id]
+    
+    def get_shared_session(item: ChatRequest, chat_id: str) -> asyncio.Future:
+        key = (item.dataset_id, item.user_id)
+        if key not in shared_sessions:
+            shared_sessions[key] = asyncio.ensure_future(open_session(
+                item.dataset_id, dataset_names.get(item.dataset_id, 'Unknown'), item.user_id, chat_id
+            ))
+        return shared_sessions[key]
+    
+    async def run_item(index: int, item: ChatRequest) -> Dict[str, Any]:
+        item_started_at = time.perf_counter()
+        async with semaphore:
+            try:
+                if item.session_id:
+                    result = await process_chat(item)
+                else:
+                    chat_id = await get_assistant(item.dataset_id)
+                    if batch.share_session:
+                        session_id = await get_shared_session(item, chat_id)
+                        result = await process_chat(item.model_copy(update={'session_id': session_id}))
+                    else:
+                        result = await process_chat(
+                            item, dataset_name=dataset_names.get(item.dataset_id, 'Unknown'), chat_id=chat_id
+                        )
+                
+                if isinstance(result, Response):
+                    status_code, data = result.status_code, json.loads(result.body)
+                else:
+                    status_code, data = 200, result
+                error = None if status_code == 200 else str(data.get('detail', data))
+            except HTTPException as e:
+                status_code, data, error = e.status_code, None, str(e.detail)
+            except Exception as e:
+                status_code, data, error = 500, None, str(e)
+        
+        return {
+            'type': 'result',
+            'index': index,
+            'success': status_code == 200,
+            'status_code': status_code,
+            'data': data if status_code == 200 else None,
+            'error': error,
+            'elapsed_ms': round((time.perf_counter() - item_started_at) * 1000, 1)
+        }
+    
+    async def stream_results():
+        tasks = [asyncio.ensure_future(run_item(index, item)) for index, item in enumerate(batch.requests)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                succeeded += line['success']
+                yield dump_record(line, media_type)
+            
+            yield dump_record({
+                'type': 'summary',
+                'total': len(tasks),
+                'succeeded': succeeded,
+                'failed': len(tasks) - succeeded,
+                'elapsed_ms': round((time.perf_counter() - started_at) * 1000, 1)
+            }, media_type)
+        finally:
+            # 客戶端斷開時取消尚未完成的請求
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        stream_results(), media_type=SEQUENCE_MEDIA_TYPES[media_type], headers={'Vary': 'Accept'}
+    )
+
+def source_key(source: Dict[str, Any]) -> str:
+    """來源片段的去重鍵：優先使用片段 ID，否則按文檔和內容判斷"""
+    if source.get('id'):
+        return str(source['id'])
+    document_id = source.get('document_id') or source.get('doc_id') or source.get('doc_name', '')
+    return f"{document_id}:{hash(source.get('content', ''))}"
+
+def merge_sources(source_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """合併多個數據集的來源並去重，重複時保留相似度較高的一份，結果按相似度降序"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for sources in source_lists:
+        for source in sources:
+            if not isinstance(source, dict):
+                continue
+            key = source_key(source)
+            existing = merged.get(key)
+            if existing is None or source.get('similarity', 0) > existing.get('similarity', 0):
+                merged[key] = source
+    return sorted(merged.values(), key=lambda source: source.get('similarity', 0), reverse=True)
+
+@app.post("/chat/multi", response_model=MultiDatasetChatResponse, summary="同時查詢多個數據集")
+async def chat_multi(request: MultiDatasetChatRequest):
+    """把同一個問題並發發送到多個數據集
+    
+    first 模式在拿到第一個有效回答（有回答內容，要求引用時還需有來源）後取消其餘查詢；
+    all 模式等待全部完成並合併去重來源。超過時間預算時返回已完成的部分結果。
+    """
+    started_at = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + request.timeout
+    dataset_ids = list(dict.fromkeys(request.dataset_ids))
+    
+    dataset_names: Dict[str, str] = {}
+    if any(dataset_id not in request.session_ids for dataset_id in dataset_ids):
+        dataset_names = await lookup_dataset_names()
+    
+    async def ask_dataset(dataset_id: str) -> DatasetAnswer:
+        dataset_started_at = time.perf_counter()
+        item = ChatRequest(
+            question=request.question,
+            dataset_id=dataset_id,
+            session_id=request.session_ids.get(dataset_id),
+            user_id=request.user_id,
+            quote=request.quote
+        )
+        try:
+            result = unwrap_chat_result(
+                await process_chat(item, dataset_name=dataset_names.get(dataset_id, 'Unknown'))
+            )
+            return DatasetAnswer(
+                dataset_id=dataset_id,
+                status='ok',
+                answer=result.answer,
+                sources=result.sources,
+                session_id=result.session_id,
+                chat_id=result.chat_id,
+                latency_ms=round((time.perf_counter() - dataset_started_at) * 1000, 1)
+            )
+        except Exception as e:
+            return DatasetAnswer(
+                dataset_id=dataset_id,
+                status='error',
+                error=str(e.detail) if isinstance(e, HTTPException) else str(e),
+                latency_ms=round((time.perf_counter() - dataset_started_at) * 1000, 1)
+            )
+    
+    def is_good(answer: DatasetAnswer) -> bool:
+        return answer.status == 'ok' and bool((answer.answer or '').strip()) and (
+            not request.quote or bool(answer.sources)
+        )
+    
+    tasks = {asyncio.ensure_future(ask_dataset(dataset_id)): dataset_id for dataset_id in dataset_ids}
+    results: Dict[str, DatasetAnswer] = {}
+    first_good: Optional[DatasetAnswer] = None
+    pending = set(tasks)
+    
+    while pending:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            answer = task.result()
+            results[answer.dataset_id] = answer
+            if first_good is None and is_good(answer):
+                first_good = answer
+        if request.mode == 'first' and first_good:
+            break
+    
+    # 仍有未完成的查詢且不是 first 模式提前拿到回答，說明時間預算已用完
+    timed_out = bool(pending) and not (request.mode == 'first' and first_good)
+    # 取消剩餘查詢；已發出的上游請求會在後台完成，結果被丟棄
+    for task in pending:
+        task.cancel()
+        dataset_id = tasks[task]
+        results[dataset_id] = DatasetAnswer(
+            dataset_id=dataset_id,
+            status='timeout' if timed_out else 'cancelled',
+            latency_ms=round((time.perf_counter() - started_at) * 1000, 1)
+        )
+    
+    answers = [results[dataset_id] for dataset_id in dataset_ids]
+    if request.mode == 'first':
+        sources = first_good.sources if first_good else []
+    else:
+        sources = merge_sources([answer.sources for answer in answers if answer.status == 'ok'])
+    
+    # 合併去重需要完整片段，裁剪放在最後
+    projection = (request.source_fields, request.max_source_chars, request.max_sources)
+    sources = project_sources(sources, *projection)
+    for answer in answers:
+        answer.sources = project_sources(answer.sources, *projection)
+    
+    return MultiDatasetChatResponse(
+        success=first_good is not None,
+        mode=request.mode,
+        answer=first_good.answer if first_good else None,
+        answered_by=first_good.dataset_id if first_good else None,
+        sources=sources,
+        answers=answers,
+        partial=timed_out,
+        elapsed_ms=round((time.perf_counter() - started_at) * 1000, 1),
+        timestamp=datetime.now()
+    )
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """在一個 WebSocket 連接上同時進行多個對話
+    
+    客戶端發送帶 id 的 chat 消息，各對話並發執行，回答增量以 delta 幀交錯返回，
+    完成時發送 done 幀。待發送幀隊列有界，客戶端讀取變慢時上游讀取隨之暫停。
+    """
+    await websocket.accept()
+    outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+    streams: Dict[str, asyncio.Task] = {}
+    # source_refs 的發送記錄按連接計算，連接上的所有會話共享
+    chunk_scope = f'ws:{uuid.uuid4().hex}'
+    
+    async def send(frame: Dict[str, Any]):
+        await outbox.put(frame)
+    
+    async def sender():
+        while True:
+            frame = await outbox.get()
+            await websocket.send_text(dump_json(frame).decode('utf-8'))
+    
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            await send({'type': 'ping'})
+    
+    async def run_stream(correlation_id: str, request: ChatRequest):
+        async def on_delta(text: str):
+            await send({'type': 'delta', 'id': correlation_id, 'delta': text})
+        
+        try:
+            response = await stream_chat(request, on_delta, chunk_scope)
+            await send({'type': 'done', 'id': correlation_id, 'response': response})
+        except HTTPException as e:
+            await send({'type': 'error', 'id': correlation_id, 'status': e.status_code, 'message': e.detail})
+        except Exception as e:
+            logger.error(f"WebSocket 對話 {correlation_id} 失敗: {str(e)}")
+            await send({'type': 'error', 'id': correlation_id, 'status': 500, 'message': str(e)})
+        finally:
+            # 取消後同一 id 可能已被新的對話復用，只移除自己的登記
+            if streams.get(correlation_id) is asyncio.current_task():
+                del streams[correlation_id]
+    
+    background = [asyncio.create_task(sender()), asyncio.create_task(heartbeat())]
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # 客戶端長時間無消息（包括不回應 ping），視為連接已失效
+                await websocket.close(code=1001)
+                break
+            
+            try:
+                message = json.loads(raw)
+                if not isinstance(message, dict):
+                    raise ValueError
+            except ValueError:
+                await send({'type': 'error', 'id': None, 'status': 400, 'message': '消息必須是 JSON 對象'})
+                continue
+            
+            kind = message.pop('type', None)
+            correlation_id = message.pop('id', None)
+            
+            if kind == 'ping':
+                await send({'type': 'pong'})
+            elif kind == 'pong':
+                continue
+            elif kind == 'cancel':
+                task = streams.pop(correlation_id, None)
+                if task:
+                    task.cancel()
+                    await send({'type': 'cancelled', 'id': correlation_id})
+            elif kind == 'chat':
+                if not correlation_id or correlation_id in streams:
+                    await send({'type': 'error', 'id': correlation_id, 'status': 400, 'message': 'id 缺失或與進行中的對話重複'})
+                    continue
+                if len(streams) >= WS_MAX_INFLIGHT:
+                    await send({'type': 'error', 'id': correlation_id, 'status': 429,
+                                'message': f'同時進行的對話不能超過 {WS_MAX_INFLIGHT} 個'})
+                    continue
+                try:
+                    request = ChatRequest(**message)
+                except ValidationError as e:
+                    await send({'type': 'error', 'id': correlation_id, 'status': 422, 'message': str(e)})
+                    continue
+                streams[correlation_id] = asyncio.create_task(run_stream(correlation_id, request))
+            else:
+                await send({'type': 'error', 'id': correlation_id, 'status': 400, 'message': f'未知的消息類型: {kind}'})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in [*streams.values(), *background]:
+            task.cancel()
+        chunk_store.forget(chunk_scope)
+
+@app.get("/sessions", response_model=SessionListResponse, summary="獲取活躍會話列表")
+async def get_sessions(
+    user_id: Optional[str] = Query(None, description="按用戶 ID 過濾"),
+    dataset_id: Optional[str] = Query(None, description="按數據集 ID 過濾"),
+    last_used_after: Optional[datetime] = Query(None, description="只返回此時間（含）之後使用過的會話"),
+    last_used_before: Optional[datetime] = Query(None, description="只返回此時間之前最後使用的會話"),
+    cursor: Optional[str] = Query(None, description="上一頁返回的 next_cursor"),
+    limit: int = Query(50, ge=1, le=500, description="每頁數量"),
+    accept: Optional[str] = Header(None, description=ACCEPT_DESCRIPTION),
+    if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION)
+):
+    """按最近使用時間倒序分頁獲取活躍會話
+    
+    ETag 由會話存儲的版本號生成，任何會話增刪或使用時間寫回都會使其變化；
+    If-None-Match 命中時返回 304，不查詢和序列化列表。緩存可以保存回應，但每次使用前必須重新驗證。
+    """
+    media_type = negotiate_media_type(accept)
+    # 先讀版本號再讀列表：讀取期間發生變化時 ETag 偏舊，下次請求不會命中，不會把新內容當作未變化
+    headers = {
+        'ETag': make_etag('sessions', session_manager.version, media_type.rsplit('/', 1)[1]),
+        'Cache-Control': 'no-cache'
+    }
+    if etag_matches(if_none_match, headers['ETag']):
+        return not_modified({**headers, 'Vary': 'Accept'})
+    
+    try:
+        page, next_cursor = session_manager.list_sessions(
+            user_id=user_id,
+            dataset_id=dataset_id,
+            last_used_after=to_local_naive(last_used_after),
+            last_used_before=to_local_naive(last_used_before),
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return negotiated_response(SessionListResponse(
+        sessions=[SessionInfo(**session_info) for session_info in page],
+        next_cursor=next_cursor
+    ), media_type, headers=headers)
+
+@app.delete("/sessions", summary="按條件批量刪除會話")
+async def delete_sessions(
+    user_id: Optional[str] = Query(None, description="按用戶 ID 過濾"),
+    dataset_id: Optional[str] = Query(None, description="按數據集 ID 過濾"),
+    last_used_after: Optional[datetime] = Query(None, description="只刪除此時間（含）之後使用過的會話"),
+    last_used_before: Optional[datetime] = Query(None, description="只刪除此時間之前最後使用的會話")
+):
+    """批量刪除符合條件的會話，至少需要一個過濾條件"""
+    if not any([user_id, dataset_id, last_used_after, last_used_before]):
+        raise HTTPException(status_code=400, detail="至少需要提供一個過濾條件")
+    
+    deleted_ids = session_manager.delete_sessions(
+        user_id=user_id,
+        dataset_id=dataset_id,
+        last_used_after=to_local_naive(last_used_after),
+        last_used_before=to_local_naive(last_used_before)
+    )
+    for session_id in deleted_ids:
+        message_log.delete_session(session_id)
+    
+    deleted_count = len(deleted_ids)
+    return {
+        "success": True,
+        "message": f"刪除了 {deleted_count} 個會話",
+        "deleted_count": deleted_count
+    }
+
+@app.get("/sessions/{session_id}/messages", response_model=MessageListResponse, summary="獲取會話消息記錄")
+async def get_session_messages(
+    session_id: str,
+    cursor: int = Query(0, ge=0, description="上一頁返回的 next_cursor"),
+    limit: int = Query(50, ge=1, le=500, description="每頁數量"),
+    x_ragflow_forwarded_by: Optional[str] = Header(None)
+):
+    """按時間順序分頁獲取會話的問答記錄"""
+    if not message_log.has_session(session_id):
+        if (not x_ragflow_forwarded_by and not session_manager.get_session(session_id)
+                and cluster.is_remote(session_id)):
+            return await forward_to_owner(
+                session_id, 'GET', f'/sessions/{session_id}/messages?cursor={cursor}&limit={limit}'
+            )
+        if not session_manager.get_session(session_id):
+            raise HTTPException(status_code=404, detail="會話不存在")
+    
+    messages, next_cursor = await run_in_threadpool(message_log.read, session_id, cursor, limit)
+    return MessageListResponse(
+        session_id=session_id,
+        messages=[ChatMessage(**expand_raw_message(message)) for message in messages],
+        next_cursor=next_cursor
+    )
 
 @app.delete("/sessions/{session_id}", summary="刪除會話")
-async def delete_session(session_id: str):
+async def delete_session(session_id: str,
+                         x_ragflow_forwarded_by: Optional[str] = Header(None)):
     """刪除指定的會話"""
-    if session_id in session_manager.sessions:
-        del session_manager.sessions[session_id]
+    if (not x_ragflow_forwarded_by and not session_manager.get_session(session_id)
+            and cluster.is_remote(session_id)):
+        return await forward_to_owner(session_id, 'DELETE', f'/sessions/{session_id}')
+    
+    if session_manager.delete_session(session_id):
+        message_log.delete_session(session_id)
         return {"success": True, "message": "會話已刪除"}
     else:
         raise HTTPException(status_code=404, detail="會話不存在")
 
+def require_cluster_token(token: Optional[str]):
+    """節點間接口只在啟用集群時存在，且必須攜帶正確的共享密鑰"""
+    if not cluster.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not cluster.verify_token(token):
+        raise HTTPException(status_code=403, detail="無效的集群令牌")
+
+@app.post("/internal/sessions", include_in_schema=False)
+async def import_sessions(sessions: List[SessionRecord],
+                          x_cluster_token: Optional[str] = Header(None)):
+    """接收其他節點移交的會話"""
+    require_cluster_token(x_cluster_token)
+    
+    for session in sessions:
+        session_manager.import_session(session.model_dump())
+    return {
+        "success": True,
+        "message": f"接收了 {len(sessions)} 個會話",
+        "imported_count": len(sessions)
+    }
+
+@app.post("/internal/messages", include_in_schema=False)
+async def import_messages(transcripts: Dict[str, List[Dict[str, Any]]],
+                          x_cluster_token: Optional[str] = Header(None)):
+    """接收其他節點移交的會話消息記錄"""
+    require_cluster_token(x_cluster_token)
+    
+    for session_id, messages in transcripts.items():
+        message_log.import_session(session_id, messages)
+    return {
+        "success": True,
+        "message": f"接收了 {len(transcripts)} 個會話的消息記錄",
+        "imported_count": len(transcripts)
+    }
+
+def expire_sessions(max_age_hours: int) -> int:
+    """清理過期會話及其消息記錄，返回清理的數量"""
+    expired_ids = session_manager.cleanup_old_sessions(max_age_hours)
+    for session_id in expired_ids:
+        message_log.delete_session(session_id)
+    return len(expired_ids)
+
 @app.post("/sessions/cleanup", summary="清理過期會話")
 async def cleanup_sessions(max_age_hours: int = 24):
     """清理過期的會話"""
-    cleaned_count = session_manager.cleanup_old_sessions(max_age_hours)
+    cleaned_count = expire_sessions(max_age_hours)
     return {
         "success": True,
         "message": f"清理了 {cleaned_count} 個過期會話",
@@ -320,14 +2064,17 @@ async def cleanup_sessions(max_age_hours: int = 24):
 async def startup_event():
     """應用啟動時的初始化"""
     logger.info("RAGFlow Chat API 服務啟動")
+    if cluster.enabled and not cluster.secret:
+        logger.warning("已啟用集群但未設置 CLUSTER_SECRET，其他節點移交的會話將被拒絕")
+    await run_in_threadpool(message_log.start)
+    dataset_watcher.restore(*await answer_cache.start())
     
-    # 測試 RAGFlow 連接
+    # 測試 RAGFlow 連接，同時預熱數據集目錄
     try:
-        datasets_result = ragflow_client.list_datasets()
-        if datasets_result['success']:
-            logger.info(f"RAGFlow 連接成功，找到 {len(datasets_result['data'])} 個數據集")
-        else:
-            logger.warning(f"RAGFlow 連接測試失敗: {datasets_result['message']}")
+        datasets = await dataset_catalog.get()
+        logger.info(f"RAGFlow 連接成功，找到 {len(datasets)} 個數據集")
+    except HTTPException as e:
+        logger.warning(f"RAGFlow 連接測試失敗: {e.detail}")
     except Exception as e:
         logger.error(f"RAGFlow 連接測試異常: {str(e)}")
 
@@ -336,16 +2083,64 @@ async def periodic_cleanup():
     while True:
         try:
             await asyncio.sleep(3600)  # 每小時執行一次
-            cleaned_count = session_manager.cleanup_old_sessions(24)
+            cleaned_count = expire_sessions(24)
             if cleaned_count > 0:
                 logger.info(f"定期清理了 {cleaned_count} 個過期會話")
         except Exception as e:
             logger.error(f"定期清理任務異常: {str(e)}")
 
+async def periodic_touch_flush():
+    """定期批量寫回會話使用時間"""
+    while True:
+        try:
+            await asyncio.sleep(SESSION_TOUCH_FLUSH_INTERVAL)
+            session_manager.flush_touches()
+        except Exception as e:
+            logger.error(f"會話使用時間寫回異常: {str(e)}")
+
+async def periodic_cluster_refresh():
+    """定期刷新集群成員，成員變更時移交受影響的會話"""
+    while True:
+        try:
+            await asyncio.sleep(CLUSTER_REFRESH_INTERVAL)
+            if cluster.reload():
+                moved_count = await rebalance_sessions()
+                logger.info(f"集群重新平衡，移交了 {moved_count} 個會話")
+        except Exception as e:
+            logger.error(f"集群成員刷新異常: {str(e)}")
+
+async def warm_answer_cache():
+    """在後台把文件中最常用的回答載入內存，不延遲服務啟動"""
+    try:
+        loaded = await answer_cache.warm(ANSWER_CACHE_WARM_ENTRIES)
+        if loaded:
+            logger.info(f"從緩存文件載入了 {loaded} 個回答")
+    except Exception as e:
+        logger.error(f"回答緩存預熱異常: {str(e)}")
+
 @app.on_event("startup")
 async def start_background_tasks():
     """啟動後台任務"""
     asyncio.create_task(periodic_cleanup())
+    asyncio.create_task(periodic_touch_flush())
+    asyncio.create_task(periodic_cluster_refresh())
+    job_manager.start()
+    dataset_watcher.start()
+    asyncio.create_task(warm_answer_cache())
+    answer_cache.scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """應用關閉時寫回緩衝的數據"""
+    await job_manager.stop()
+    await stream_registry.stop()
+    await dataset_watcher.stop()
+    await answer_cache.scheduler.stop()
+    answer_cache.save_datasets(dataset_watcher.generations, dataset_watcher.signatures)
+    await answer_cache.stop()
+    flushed_count = session_manager.flush_touches()
+    await run_in_threadpool(message_log.stop)
+    logger.info(f"RAGFlow Chat API 服務關閉，寫回 {flushed_count} 個會話使用時間")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+HTTP 條件請求
+按數據的版本號生成 ETag，If-None-Match 命中時直接返回 304，不再構建和序列化回應體
+"""
+
+import uuid
+from typing import Dict, Optional
+
+from fastapi.responses import Response
+
+# 進程啟動時生成：重啟後版本號從頭計數，或請求落到其他節點時，舊的 ETag 不會誤命中
+EPOCH = uuid.uuid4().hex[:8]
+
+def make_etag(*parts) -> str:
+    """生成強 ETag，parts 應包含版本號以及所有影響回應體的因素（如回應格式）"""
+    return '"' + '-'.join(str(part) for part in (EPOCH, *parts)) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """按弱比較判斷 If-None-Match 是否命中
+
+    壓縮後的回應會把 ETag 標記為弱 ETag，客戶端帶回 W/"..." 時同樣視為命中。
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(candidate.strip().removeprefix('W/') == opaque for candidate in if_none_match.split(','))
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    """返回不帶回應體的 304"""
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+冪等鍵支持
+相同 Idempotency-Key 的並發請求共享同一次執行，完成後的回應在有效期內直接重放
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: bytes
+    media_type: str
+    fingerprint: str = ''
+    expires_at: float = 0.0
+
+class IdempotencyConflict(Exception):
+    """同一個冪等鍵被用於不同的請求內容"""
+
+def request_fingerprint(payload: Any) -> str:
+    """計算請求內容的指紋，用於檢測冪等鍵被重用"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class IdempotencyStore:
+    """冪等回應存儲
+
+    已完成的回應按寫入順序保存，過期或總字節數超過上限時從最舊的開始淘汰。
+    """
+
+    def __init__(self, ttl_seconds: float = 600, max_bytes: int = 32 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._completed: 'OrderedDict[str, StoredResponse]' = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._completed:
+            key, stored = next(iter(self._completed.items()))
+            if stored.expires_at > now and self.total_bytes <= self.max_bytes:
+                break
+            del self._completed[key]
+            self.total_bytes -= len(stored.body)
+
+    def _store(self, key: str, stored: StoredResponse):
+        if len(stored.body) > self.max_bytes:
+            return
+        stored.expires_at = time.monotonic() + self.ttl_seconds
+        self._completed[key] = stored
+        self.total_bytes += len(stored.body)
+        self._evict()
+
+    async def _run(self, key: str, fingerprint: str,
+                   handler: Callable[[], Awaitable[StoredResponse]]) -> StoredResponse:
+        try:
+            stored = await handler()
+            stored.fingerprint = fingerprint
+            # 服務端錯誤不保存，讓客戶端重試時重新執行
+            if stored.status_code < 500:
+                self._store(key, stored)
+            return stored
+        finally:
+            self._inflight.pop(key, None)
+
+    async def execute(self, key: str, fingerprint: str,
+                      handler: Callable[[], Awaitable[StoredResponse]]) -> Tuple[StoredResponse, bool]:
+        """執行或重放請求，返回 (回應, 是否為重放)
+
+        執行在獨立任務中進行，原始請求斷開後重試仍可接上同一次執行。
+        """
+        self._evict()
+
+        stored = self._completed.get(key)
+        if stored:
+            if stored.fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            return stored, True
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            inflight_fingerprint, task = inflight
+            if inflight_fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(self._run(key, fingerprint, handler))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = (fingerprint, task)
+        return await asyncio.shield(task), False
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+異步任務隊列
+長時間運行的問答在有界工作池中執行，結果保存一段時間供輪詢或推送
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Job:
+    job_id: str
+    payload: Any
+    status: str = 'queued'  # queued / running / succeeded / failed
+    result: Any = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+class JobQueueFull(Exception):
+    """排隊任務數已達上限"""
+
+class JobManager:
+    """有界工作池
+
+    固定數量的工作協程從隊列中取任務執行；已完成的任務按完成順序保存，
+    超過 result_ttl 秒後清除。
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], workers: int = 4,
+                 max_queued: int = 1000, result_ttl: float = 3600):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.jobs: Dict[str, Job] = {}
+        self._finished: 'OrderedDict[str, float]' = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """啟動工作協程"""
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index)) for index in range(self.workers)
+        ]
+
+    async def stop(self):
+        """停止工作協程，未完成的任務標記為失敗"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        for job in self.jobs.values():
+            if not job.finished:
+                self._finish(job, error='服務關閉，任務未完成')
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._finished:
+            job_id, expires_at = next(iter(self._finished.items()))
+            if expires_at > now:
+                break
+            del self._finished[job_id]
+            self.jobs.pop(job_id, None)
+
+    def submit(self, payload: Any, job_id: str = None) -> Job:
+        """提交任務，隊列已滿時拋出 JobQueueFull"""
+        self._purge_expired()
+        job = Job(job_id=job_id or uuid.uuid4().hex, payload=payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull()
+        self.jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """獲取任務，已過期的任務返回 None"""
+        self._purge_expired()
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> bool:
+        """等待任務完成，超時返回 False"""
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return job.finished
+
+    def _finish(self, job: Job, result: Any = None, error: str = None):
+        job.status = 'failed' if error else 'succeeded'
+        job.result = result
+        job.error = error
+        job.finished_at = datetime.now()
+        job.done.set()
+        self._finished[job.job_id] = time.monotonic() + self.result_ttl
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            job.status = 'running'
+            job.started_at = datetime.now()
+            try:
+                self._finish(job, result=await self.handler(job.payload))
+            except asyncio.CancelledError:
+                self._finish(job, error='服務關閉，任務未完成')
+                raise
+            except Exception as e:
+                detail = getattr(e, 'detail', None) or str(e)
+                logger.error(f"任務 {job.job_id} 執行失敗: {detail}")
+                self._finish(job, error=str(detail))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+會話消息日誌
+以僅追加的分段文件保存問答記錄，並在內存中維護每個會話的偏移索引
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple, Any, Set
+
+from chunk_store import HASH_FIELD, chunk_hash
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class MessageLog:
+    """僅追加的分段消息日誌
+
+    每條記錄是一行 JSON，寫入由後台線程批量完成，append 只做入隊，時間複雜度 O(1)。
+    索引保存 (分段號, 文件偏移)，讀取時直接定位，不掃描文件。
+    引用片段按內容哈希只寫入一次，問答記錄中只保存哈希，讀取時再展開。
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.index: Dict[str, List[Tuple[int, int]]] = {}
+        self.chunks: Dict[str, Tuple[int, int]] = {}
+        self._written_chunks: Set[str] = set()  # 只由寫入線程使用，包括尚未刷盤的片段
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._active_segment = 0
+        self._active_file = None
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'segment-{segment:06d}.log')
+
+    def _list_segments(self) -> List[int]:
+        segments = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith('segment-') and filename.endswith('.log'):
+                segments.append(int(filename[len('segment-'):-len('.log')]))
+        return sorted(segments)
+
+    def start(self):
+        """重建索引並啟動後台寫入線程"""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._list_segments()
+        for segment in segments:
+            self._load_segment(segment)
+
+        self._written_chunks = set(self.chunks)
+        self._active_segment = segments[-1] if segments else 1
+        self._active_file = open(self._segment_path(self._active_segment), 'ab')
+        self._writer = threading.Thread(target=self._run, name='message-log-writer', daemon=True)
+        self._writer.start()
+        logger.info(f"消息日誌已載入: {len(segments)} 個分段, {len(self.index)} 個會話")
+
+    def stop(self):
+        """寫完隊列中的記錄後停止"""
+        if self._writer:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        if self._active_file:
+            self._active_file.close()
+            self._active_file = None
+
+    def _load_segment(self, segment: int):
+        with open(self._segment_path(segment), 'rb') as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"跳過損壞的日誌記錄: 分段 {segment}, 偏移 {offset}")
+                    continue
+                key = record[HASH_FIELD] if record['type'] == 'chunk' else record['session_id']
+                self._apply(record['type'], key, segment, offset)
+
+    def _apply(self, kind: str, key: str, segment: int, offset: int):
+        # key 對 chunk 記錄是片段哈希，其餘為會話 ID
+        if kind == 'message':
+            self.index.setdefault(key, []).append((segment, offset))
+        elif kind == 'delete':
+            self.index.pop(key, None)
+        elif kind == 'chunk':
+            self.chunks[key] = (segment, offset)
+
+    def append(self, session_id: str, message: Dict[str, Any], raw_fields: Dict[str, bytes] = None):
+        """追加一條問答記錄，不等待寫盤
+        
+        raw_fields 的值是已編碼的 JSON，寫入時原樣拼入 message，不經解析和重新序列化。
+        """
+        self._queue.put(('message', session_id, message, raw_fields))
+
+    def append_chunks(self, chunks: List[Dict[str, Any]]):
+        """只寫入片段記錄（已寫過的哈希跳過），用於回應中裁剪過、哈希與原片段不同的片段"""
+        self._queue.put(('chunks', '', {'sources': chunks}, None))
+
+    def delete_session(self, session_id: str):
+        """追加刪除標記，會話的歷史記錄不再可見"""
+        self._queue.put(('delete', session_id, None, None))
+
+    def import_session(self, session_id: str, messages: List[Dict[str, Any]]):
+        """以其他節點移交的記錄替換會話的歷史記錄"""
+        self.delete_session(session_id)
+        for message in messages:
+            self.append(session_id, message)
+
+    def export_session(self, session_id: str) -> List[Dict[str, Any]]:
+        """讀取會話的全部記錄（引用片段已展開），用於移交給其他節點"""
+        with self._lock:
+            total = len(self.index.get(session_id, []))
+        if not total:
+            return []
+        messages, _ = self.read(session_id, 0, total)
+        return messages
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入隊的記錄寫盤並可讀，超時返回 False"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = False
+            written = []
+            flushed = []
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                    continue
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                    continue
+                try:
+                    written.extend(self._write(*item))
+                except Exception as e:
+                    logger.error(f"寫入消息日誌失敗: {str(e)}")
+
+            # 數據刷到文件後再更新索引，保證讀取時記錄完整
+            self._active_file.flush()
+            with self._lock:
+                for kind, key, segment, offset in written:
+                    self._apply(kind, key, segment, offset)
+            for done in flushed:
+                done.set()
+
+            if stopping:
+                return
+
+    def _write(self, kind: str, session_id: str, message: Optional[Dict[str, Any]],
+               raw_fields: Optional[Dict[str, bytes]]) -> List[Tuple[str, str, int, int]]:
+        written = []
+        if kind == 'chunks':
+            self._write_chunks(message['sources'], written)
+            return written
+        if message is not None and isinstance(message.get('sources'), list):
+            message = {**message, 'sources': self._write_chunks(message['sources'], written)}
+        
+        record = {'type': kind, 'session_id': session_id}
+        if message is not None:
+            record['message'] = message
+        line = json.dumps(record, ensure_ascii=False, default=str).encode('utf-8')
+        if raw_fields:
+            # message 是記錄的最後一個字段，在其結尾的 "}}" 前拼入原始字段；
+            # JSON 字符串內的換行必然已轉義，字面換行只可能是空白，替換掉以保持一行一條記錄
+            extra = b''.join(
+                b',' + json.dumps(name).encode('utf-8') + b':' + value.replace(b'\n', b' ').replace(b'\r', b' ')
+                for name, value in raw_fields.items()
+            )
+            line = line[:-2] + extra + b'}}'
+        segment, offset = self._write_line(line + b'\n')
+        written.append((kind, session_id, segment, offset))
+        return written
+
+    def _write_chunks(self, sources: List[Any], written: List[Tuple[str, str, int, int]]) -> List[Any]:
+        """把未寫過的片段寫成 chunk 記錄，返回只含哈希的引用列表"""
+        refs = []
+        for source in sources:
+            if not isinstance(source, dict):
+                refs.append(source)
+                continue
+            digest, encoded = chunk_hash(source)
+            if digest not in self._written_chunks:
+                line = b'{"type":"chunk","' + HASH_FIELD.encode() + b'":"' + digest.encode() + b'","chunk":' + encoded + b'}\n'
+                segment, offset = self._write_line(line)
+                written.append(('chunk', digest, segment, offset))
+                self._written_chunks.add(digest)
+            refs.append({HASH_FIELD: digest})
+        return refs
+
+    def _write_line(self, line: bytes) -> Tuple[int, int]:
+        if self._active_file.tell() > 0 and self._active_file.tell() + len(line) > self.segment_max_bytes:
+            self._active_file.flush()
+            self._active_file.close()
+            self._active_segment += 1
+            self._active_file = open(self._segment_path(self._active_segment), 'ab')
+
+        offset = self._active_file.tell()
+        self._active_file.write(line)
+        return self._active_segment, offset
+
+    def has_session(self, session_id: str) -> bool:
+        """會話是否有歷史記錄"""
+        with self._lock:
+            return session_id in self.index
+
+    def _read_chunk(self, digest: str, handles: Dict[int, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            location = self.chunks.get(digest)
+        if location is None:
+            return None
+        segment, offset = location
+        if segment not in handles:
+            handles[segment] = open(self._segment_path(segment), 'rb')
+        f = handles[segment]
+        f.seek(offset)
+        return json.loads(f.readline())['chunk']
+
+    def read_chunk(self, digest: str) -> Optional[Dict[str, Any]]:
+        """按哈希讀取片段內容，不存在時返回 None"""
+        handles = {}
+        try:
+            return self._read_chunk(digest, handles)
+        finally:
+            for f in handles.values():
+                f.close()
+
+    def read(self, session_id: str, cursor: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """按時間順序分頁讀取會話記錄，返回 (記錄列表, 下一頁游標)"""
+        with self._lock:
+            entries = self.index.get(session_id, [])
+            page = entries[cursor:cursor + limit]
+            total = len(entries)
+
+        messages = []
+        handles = {}
+        try:
+            for segment, offset in page:
+                if segment not in handles:
+                    handles[segment] = open(self._segment_path(segment), 'rb')
+                f = handles[segment]
+                f.seek(offset)
+                messages.append(json.loads(f.readline())['message'])
+            
+            # 展開只保存了哈希的引用片段
+            for message in messages:
+                sources = message.get('sources')
+                if isinstance(sources, list):
+                    message['sources'] = [
+                        self._read_chunk(source[HASH_FIELD], handles) or source
+                        if isinstance(source, dict) and len(source) == 1 and HASH_FIELD in source else source
+                        for source in sources
+                    ]
+        finally:
+            for f in handles.values():
+                f.close()
+
+        next_cursor = cursor + len(page)
+        return messages, (next_cursor if next_cursor < total else None)
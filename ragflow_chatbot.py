@@ -6,14 +6,22 @@ RAGFlow 聊天機器人 - 完整功能版本
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import uuid
 import time
-from typing import Dict, List, Optional, Any
-from config import RAGFLOW_API_URL, RAGFLOW_API_KEY
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Iterator
+from config import RAGFLOW_API_URL, RAGFLOW_API_KEY, DATASET_PAGE_SIZE, DATASET_PAGE_CONCURRENCY
+
+# 分頁拉取數據集共用的線程池，所有調用合計最多 DATASET_PAGE_CONCURRENCY 個頁請求
+_dataset_page_pool = ThreadPoolExecutor(
+    max_workers=max(1, DATASET_PAGE_CONCURRENCY), thread_name_prefix='ragflow-datasets'
+)
 
 class RAGFlowOfficialClient:
-    def __init__(self, api_url: str = None, api_key: str = None):
+    def __init__(self, api_url: str = None, api_key: str = None, pool_size: int = 10):
         self.api_url = (api_url or RAGFLOW_API_URL).rstrip('/')
         self.api_key = api_key or RAGFLOW_API_KEY
         self.headers = {
@@ -22,32 +30,82 @@ class RAGFlowOfficialClient:
         }
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        # 連接池大小與並發調用數保持一致，並發時可復用連接
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
-    def list_datasets(self) -> Dict[str, Any]:
-        """列出所有數據集/知識庫"""
+    def list_datasets(self, page_size: int = DATASET_PAGE_SIZE,
+                      concurrency: int = DATASET_PAGE_CONCURRENCY) -> Dict[str, Any]:
+        """列出所有數據集/知識庫，逐頁拉取直到取完"""
         try:
-            response = self.session.get(f'{self.api_url}/api/v1/datasets')
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    'success': True,
-                    'data': result.get('data', []),
-                    'message': '成功獲取數據集列表'
-                }
-            else:
-                return {
-                    'success': False,
-                    'data': [],
-                    'message': f'HTTP {response.status_code}: {response.text}'
-                }
+            datasets = []
+            for page in self.iter_dataset_pages(page_size, concurrency):
+                datasets.extend(page)
+            return {
+                'success': True,
+                'data': datasets,
+                'message': '成功獲取數據集列表'
+            }
         except Exception as e:
             return {
                 'success': False,
                 'data': [],
-                'message': f'請求失敗: {str(e)}'
+                'message': str(e)
             }
     
+    def list_datasets_page(self, page: int = 1, page_size: int = DATASET_PAGE_SIZE, desc: bool = True) -> Dict[str, Any]:
+        """獲取一頁數據集，失敗時拋出 RuntimeError
+        
+        返回 {'data': [...], 'total': 總數或 None}，上游未返回總數時 total 為 None。
+        默認按創建時間從新到舊；desc 為 False 時從舊到新，新建的數據集只出現在最後一頁，已有數據集所在的頁不變。
+        """
+        try:
+            response = self.session.get(
+                f'{self.api_url}/api/v1/datasets',
+                params={'page': page, 'page_size': page_size, 'orderby': 'create_time', 'desc': 'true' if desc else 'false'}
+            )
+        except requests.RequestException as e:
+            raise RuntimeError(f'請求失敗: {str(e)}')
+        
+        if response.status_code != 200:
+            raise RuntimeError(f'HTTP {response.status_code}: {response.text}')
+        result = response.json()
+        if result.get('code', 0) != 0:
+            raise RuntimeError(result.get('message', '獲取數據集列表失敗'))
+        return {'data': result.get('data') or [], 'total': result.get('total')}
+    
+    def iter_dataset_pages(self, page_size: int = DATASET_PAGE_SIZE,
+                           concurrency: int = DATASET_PAGE_CONCURRENCY) -> Iterator[List[Dict[str, Any]]]:
+        """按頁序逐頁返回全部數據集，同時最多有 concurrency 個頁請求在進行（頁請求在模塊共用的線程池中執行）
+        
+        第一頁返回總數時只請求需要的頁；否則向後預取，遇到不滿一頁的結果即停止，
+        最多多發 concurrency - 1 個空頁請求。任何一頁失敗時拋出 RuntimeError。
+        """
+        first = self.list_datasets_page(1, page_size)
+        yield first['data']
+        if len(first['data']) < page_size:
+            return
+        
+        last_page = -(-first['total'] // page_size) if first['total'] is not None else None
+        next_page = 2
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < concurrency and (last_page is None or next_page <= last_page):
+                    pending.append(_dataset_page_pool.submit(self.list_datasets_page, next_page, page_size))
+                    next_page += 1
+                if not pending:
+                    return
+                page = pending.popleft().result()['data']
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    return
+        finally:
+            for future in pending:
+                future.cancel()
+    
     def create_chat(self, name: str, dataset_ids: List[str], **kwargs) -> Dict[str, Any]:
         """創建聊天助手會話
         
@@ -164,6 +222,46 @@ class RAGFlowOfficialClient:
                 'message': f'請求失敗: {str(e)}'
             }
     
+    def delete_sessions(self, chat_id: str, session_ids: List[str]) -> Dict[str, Any]:
+        """刪除聊天助手下的會話
+        
+        Args:
+            chat_id: 聊天助手 ID
+            session_ids: 要刪除的會話 ID 列表
+        """
+        try:
+            response = self.session.delete(
+                f'{self.api_url}/api/v1/chats/{chat_id}/sessions',
+                json={'ids': session_ids}
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('code') == 0:
+                    return {
+                        'success': True,
+                        'data': None,
+                        'message': '成功刪除會話'
+                    }
+                else:
+                    return {
+                        'success': False,
+                        'data': None,
+                        'message': result.get('message', '刪除會話失敗')
+                    }
+            else:
+                return {
+                    'success': False,
+                    'data': None,
+                    'message': f'HTTP {response.status_code}: {response.text}'
+                }
+        except Exception as e:
+            return {
+                'success': False,
+                'data': None,
+                'message': f'請求失敗: {str(e)}'
+            }
+    
     def chat_completion(self, chat_id: str, session_id: str, question: str, 
                        quote: bool = True, stream: bool = False) -> Dict[str, Any]:
         """發送聊天完成請求
@@ -215,6 +313,132 @@ class RAGFlowOfficialClient:
                 'message': f'請求失敗: {str(e)}'
             }
 
+    def chat_completion_stream(self, chat_id: str, session_id: str, question: str,
+                               quote: bool = True) -> Iterator[Dict[str, Any]]:
+        """流式聊天完成請求，逐條返回上游推送的數據
+        
+        每條數據中的 answer 是截至當前的完整回答；請求失敗時拋出 RuntimeError。
+        
+        Args:
+            chat_id: 聊天助手 ID
+            session_id: 會話 ID
+            question: 問題
+            quote: 是否顯示引用
+        """
+        completion_data = {
+            'question': question,
+            'quote': quote,
+            'stream': True,
+            'session_id': session_id
+        }
+        
+        with self.session.post(
+            f'{self.api_url}/api/v1/chats/{chat_id}/completions',
+            json=completion_data,
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f'HTTP {response.status_code}: {response.text}')
+            
+            for line in response.iter_lines():
+                # 上游以 SSE 格式推送，每條數據一行 "data:{...}"
+                if not line.startswith(b'data:'):
+                    continue
+                result = json.loads(line[5:].decode('utf-8'))
+                if result.get('code') != 0:
+                    raise RuntimeError(result.get('message', '獲取回答失敗'))
+                data = result.get('data')
+                # data 為 true 表示回答結束
+                if data is True:
+                    return
+                if isinstance(data, dict):
+                    yield data
+
+    def chat_completion_raw(self, chat_id: str, session_id: str, question: str,
+                            quote: bool = True, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """聊天完成請求，逐塊返回 RAGFlow 的原始回應體，不做 JSON 解析
+        
+        HTTP 狀態不是 200 時拋出 RuntimeError；業務錯誤（code 不為 0）由調用方判斷。
+        """
+        completion_data = {
+            'question': question,
+            'quote': quote,
+            'stream': False,
+            'session_id': session_id
+        }
+        
+        with self.session.post(
+            f'{self.api_url}/api/v1/chats/{chat_id}/completions',
+            json=completion_data,
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f'HTTP {response.status_code}: {response.text}')
+            yield from response.iter_content(chunk_size=chunk_size)
+
+    def retrieve_chunks(self, question: str, dataset_ids: List[str], document_ids: List[str] = None,
+                        page: int = 1, page_size: int = 30, similarity_threshold: float = 0.2,
+                        vector_similarity_weight: float = 0.3, top_k: int = 1024,
+                        keyword: bool = False) -> Dict[str, Any]:
+        """檢索相關片段，不經過 LLM 生成
+        
+        Args:
+            question: 查詢內容
+            dataset_ids: 數據集 ID 列表
+            document_ids: 只在這些文檔中檢索 (可選)
+            page: 頁碼
+            page_size: 每頁返回的片段數
+            similarity_threshold: 最低相似度
+            vector_similarity_weight: 向量相似度權重，其餘為關鍵詞相似度
+            top_k: 參與向量計算的候選片段數
+            keyword: 是否啟用關鍵詞擴展
+        """
+        retrieval_data = {
+            'question': question,
+            'dataset_ids': dataset_ids,
+            'page': page,
+            'page_size': page_size,
+            'similarity_threshold': similarity_threshold,
+            'vector_similarity_weight': vector_similarity_weight,
+            'top_k': top_k,
+            'keyword': keyword
+        }
+        if document_ids:
+            retrieval_data['document_ids'] = document_ids
+        
+        try:
+            response = self.session.post(
+                f'{self.api_url}/api/v1/retrieval',
+                json=retrieval_data
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('code') == 0:
+                    return {
+                        'success': True,
+                        'data': result.get('data'),
+                        'message': '成功檢索片段'
+                    }
+                else:
+                    return {
+                        'success': False,
+                        'data': None,
+                        'message': result.get('message', '檢索片段失敗')
+                    }
+            else:
+                return {
+                    'success': False,
+                    'data': None,
+                    'message': f'HTTP {response.status_code}: {response.text}'
+                }
+        except Exception as e:
+            return {
+                'success': False,
+                'data': None,
+                'message': f'請求失敗: {str(e)}'
+            }
+
 class RAGFlowChatbot:
     def __init__(self):
         self.client = RAGFlowOfficialClient()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+回答緩存提前刷新
+記錄每條緩存回答在本緩存週期內的命中次數，熱門且即將過期的回答在後台重新生成，
+避免熱門問題同時過期後的一批請求都要等待 LLM。刷新受每分鐘次數限制，且只在上游空閒時進行。
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class RefreshEntry:
+    dataset_id: str
+    question: str
+    quote: bool
+    chat_id: str
+    expires_at: float  # time.monotonic()
+    hits: int = 0  # 本緩存週期內的命中次數，重新寫入緩存時歸零
+
+class RefreshAheadScheduler:
+    """提前刷新熱門回答
+
+    - 命中次數達到 min_hits 且剩餘時間少於 ahead_seconds 的回答按命中次數從多到少刷新
+    - 刷新逐條串行執行，每分鐘最多 per_minute 次
+    - is_idle() 為 False（實時請求佔用上游）時本輪不刷新
+    刷新失敗的回答命中次數歸零，需要重新變熱才會再次刷新。
+    """
+
+    def __init__(self, refresh: Callable[[RefreshEntry], Awaitable[None]], is_idle: Callable[[], bool],
+                 ahead_seconds: float = 300, min_hits: int = 3, per_minute: int = 10,
+                 interval: float = 10, max_entries: int = 10000):
+        self.refresh = refresh
+        self.is_idle = is_idle
+        self.ahead_seconds = ahead_seconds
+        self.min_hits = min_hits
+        self.per_minute = per_minute
+        self.interval = interval
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[bytes, RefreshEntry]' = OrderedDict()
+        self.refreshed = 0
+        self.failed = 0
+        self.deferred = 0  # 因上游繁忙或超出預算而推遲的輪數
+        self._recent: Deque[float] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ahead_seconds > 0
+
+    def track(self, key: bytes, dataset_id: str, question: str, quote: bool, chat_id: str, ttl_seconds: float):
+        """回答寫入緩存時登記，重新計算過期時間和命中次數"""
+        if not self.enabled:
+            return
+        self.entries[key] = RefreshEntry(dataset_id, question, quote, chat_id, time.monotonic() + ttl_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def hit(self, key: bytes):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.hits += 1
+            self.entries.move_to_end(key)
+
+    def due(self) -> List[Tuple[bytes, RefreshEntry]]:
+        """返回需要刷新的回答，並清除已過期的條目"""
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self.entries[key]
+        candidates = [
+            (key, entry) for key, entry in self.entries.items()
+            if entry.hits >= self.min_hits and entry.expires_at - now <= self.ahead_seconds
+        ]
+        candidates.sort(key=lambda item: item[1].hits, reverse=True)
+        return candidates
+
+    def _budget_left(self) -> int:
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now - 60:
+            self._recent.popleft()
+        return self.per_minute - len(self._recent)
+
+    async def run_once(self) -> int:
+        """刷新一輪，返回成功刷新的條數"""
+        refreshed = 0
+        for key, entry in self.due():
+            if self._budget_left() <= 0 or not self.is_idle():
+                self.deferred += 1
+                break
+            self._recent.append(time.monotonic())
+            try:
+                await self.refresh(entry)
+                refreshed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                entry.hits = 0
+                logger.warning(f"提前刷新回答失敗: {str(e)}")
+        self.refreshed += refreshed
+        return refreshed
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                refreshed = await self.run_once()
+                if refreshed:
+                    logger.info(f"提前刷新了 {refreshed} 個熱門回答")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"提前刷新任務異常: {str(e)}")
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
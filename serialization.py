@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+快速序列化
+服務端自己構建的回應數據不需要再經過 FastAPI 的 response_model 校驗和通用編碼，直接編碼為 JSON；
+機器客戶端可以通過 Accept / Content-Type 改用 MessagePack 或 CBOR
+"""
+
+from datetime import date, datetime
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+import pydantic_core
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.datastructures import MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時使用 pydantic-core 的編碼器
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # 未安裝時不提供 MessagePack
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # 未安裝時不提供 CBOR
+    cbor2 = None
+
+JSON_MEDIA_TYPE = 'application/json'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+CBOR_MEDIA_TYPE = 'application/cbor'
+
+# 常見別名統一為標準媒體類型
+MEDIA_TYPE_ALIASES = {
+    'application/x-msgpack': MSGPACK_MEDIA_TYPE,
+    'application/vnd.msgpack': MSGPACK_MEDIA_TYPE,
+}
+
+BINARY_MEDIA_TYPES = [
+    media_type for media_type, available in ((MSGPACK_MEDIA_TYPE, msgpack), (CBOR_MEDIA_TYPE, cbor2)) if available
+]
+
+# 逐條輸出的流式回應使用的媒體類型：JSON 為 NDJSON，MessagePack 對象直接拼接，CBOR 為 CBOR Sequence（RFC 8742）
+SEQUENCE_MEDIA_TYPES = {
+    JSON_MEDIA_TYPE: NDJSON_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE: MSGPACK_MEDIA_TYPE,
+    CBOR_MEDIA_TYPE: 'application/cbor-seq',
+}
+
+def _encode_default(value: Any) -> Any:
+    # orjson 不認識 Pydantic 模型，按字段淺拷貝為字典，嵌套的模型會再次回到這裡
+    if isinstance(value, BaseModel):
+        return dict(value)
+    raise TypeError(f'無法序列化類型 {type(value).__name__}')
+
+def dump_json(content: Any) -> bytes:
+    """把字典、列表、Pydantic 模型和 datetime 等編碼為 UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_encode_default)
+    return pydantic_core.to_json(content)
+
+def _encode_msgpack_default(value: Any) -> Any:
+    # 時間與 JSON 回應一致，編碼為 ISO 8601 字符串
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return _encode_default(value)
+
+def _encode_cbor_datetime(encoder, value):
+    encoder.encode(value.isoformat())
+
+def _encode_cbor_default(encoder, value):
+    encoder.encode(_encode_default(value))
+
+# CBOR 原生的時間標籤不接受無時區時間，也與 JSON 的形狀不同，統一改為字符串
+CBOR_ENCODERS = {datetime: _encode_cbor_datetime, date: _encode_cbor_datetime}
+
+def dump(content: Any, media_type: str = JSON_MEDIA_TYPE) -> bytes:
+    """按媒體類型編碼，各格式解碼後的結構與 JSON 回應相同；NDJSON 時 content 為列表，每項一行"""
+    if media_type == NDJSON_MEDIA_TYPE:
+        return b''.join(dump_record(item) for item in content)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(content, default=_encode_msgpack_default)
+    if media_type == CBOR_MEDIA_TYPE:
+        return cbor2.dumps(content, encoders=CBOR_ENCODERS, default=_encode_cbor_default)
+    return dump_json(content)
+
+def dump_record(content: Any, media_type: str = JSON_MEDIA_TYPE) -> bytes:
+    """編碼流式回應中的一條記錄，JSON 每條後加換行"""
+    if media_type == JSON_MEDIA_TYPE:
+        return dump_json(content) + b'\n'
+    return dump(content, media_type)
+
+def load(body: bytes, media_type: str) -> Any:
+    """解碼 MessagePack 或 CBOR 請求體"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.unpackb(body)
+    return cbor2.loads(body)
+
+def _parse_media_type(value: str) -> str:
+    media_type = value.split(';', 1)[0].strip().lower()
+    return MEDIA_TYPE_ALIASES.get(media_type, media_type)
+
+def _preference(weights: Dict[str, float], media_type: str) -> Tuple[float, int]:
+    """媒體類型的 (權重, 具體程度)，權重取最具體的匹配範圍（RFC 9110）：完整類型 > type/* > */*"""
+    ranges = (media_type, media_type.split('/', 1)[0] + '/*', '*/*')
+    for specificity, media_range in zip((2, 1, 0), ranges):
+        if media_range in weights:
+            return weights[media_range], specificity
+    return 0.0, -1
+
+def negotiate_media_type(accept: Optional[str], candidates: List[str] = None) -> str:
+    """按 Accept 選擇回應格式
+
+    candidates 為 JSON 以外可選的格式，默認為可用的二進制格式；權重高於 JSON，或權重相同但
+    匹配的範圍更具體（例如 application/msgpack, */*）時才使用，未攜帶 Accept 或 */* 時返回 JSON。
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    weights: Dict[str, float] = {}
+    for item in accept.split(','):
+        media_type = _parse_media_type(item)
+        weight = 1.0
+        for param in item.split(';')[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[media_type] = max(weight, weights.get(media_type, 0.0))
+
+    best = JSON_MEDIA_TYPE
+    best_preference = _preference(weights, JSON_MEDIA_TYPE)
+    for media_type in BINARY_MEDIA_TYPES if candidates is None else candidates:
+        preference = _preference(weights, media_type)
+        if preference[0] > 0 and preference > best_preference:
+            best, best_preference = media_type, preference
+    return best
+
+class FastJSONResponse(JSONResponse):
+    """用 dump_json 編碼的 JSON 回應，跳過 jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+def negotiated_response(content: Any, media_type: str, status_code: int = 200,
+                        headers: Dict[str, str] = None) -> Response:
+    """按協商的媒體類型返回回應，並標記 Vary: Accept 供緩存區分"""
+    headers = {**(headers or {}), 'Vary': 'Accept'}
+    if media_type == JSON_MEDIA_TYPE:
+        return FastJSONResponse(content, status_code=status_code, headers=headers)
+    return Response(dump(content, media_type), status_code=status_code, headers=headers, media_type=media_type)
+
+class BinaryBodyRequest(Request):
+    """把 MessagePack / CBOR 請求體交給 FastAPI 當作已解析的 JSON 使用"""
+
+    def __init__(self, scope, receive, body_media_type: str):
+        super().__init__(scope, receive)
+        self.body_media_type = body_media_type
+        # FastAPI 只對 JSON 類型的請求體調用 json()，這裡對外報告為 JSON，解碼仍按原格式
+        headers = MutableHeaders(raw=list(scope['headers']))
+        headers['content-type'] = JSON_MEDIA_TYPE
+        self._headers = headers
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            self._json = load(await self.body(), self.body_media_type)
+        return self._json
+
+class BinaryBodyRoute(APIRoute):
+    """接受 MessagePack / CBOR 請求體的路由，解碼失敗時返回 400"""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def binary_body_handler(request: Request) -> Response:
+            body_media_type = _parse_media_type(request.headers.get('content-type', ''))
+            if body_media_type in BINARY_MEDIA_TYPES:
+                request = BinaryBodyRequest(request.scope, request.receive, body_media_type)
+            return await handler(request)
+
+        return binary_body_handler
@@ -9,7 +9,7 @@ import requests
 import json
 import time
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import uuid
 
 # 配置頁面
@@ -88,6 +88,22 @@ class StreamlitRAGClient:
     def __init__(self, api_base_url: str = "http://localhost:8000"):
         self.api_url = api_base_url.rstrip('/')
         self.session = requests.Session()
+        # 條件請求緩存：(路徑, 參數) -> (ETag, 數據)，頁面重跑時數據未變化則服務端只返回 304
+        self.validators: Dict[Tuple, Tuple[str, Any]] = {}
+    
+    def _get_cached(self, path: str, params: Optional[Dict] = None, timeout: float = 10) -> Any:
+        """帶 If-None-Match 的 GET，304 時使用上次保存的數據"""
+        key = (path, tuple(sorted((params or {}).items())))
+        cached = self.validators.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        response = self.session.get(f"{self.api_url}{path}", params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        response.raise_for_status()
+        data = response.json()
+        if response.headers.get('ETag'):
+            self.validators[key] = (response.headers['ETag'], data)
+        return data
     
     def check_api_health(self) -> Dict:
         """檢查 API 健康狀態"""
@@ -112,11 +128,9 @@ class StreamlitRAGClient:
     def get_datasets(self) -> Dict:
         """獲取數據集列表"""
         try:
-            response = self.session.get(f"{self.api_url}/datasets", timeout=10)
-            response.raise_for_status()
             return {
                 'success': True,
-                'data': response.json()
+                'data': self._get_cached("/datasets")
             }
         except Exception as e:
             return {
@@ -126,13 +140,20 @@ class StreamlitRAGClient:
     
     def send_chat_message(self, question: str, dataset_id: str, 
                          session_id: Optional[str] = None, 
-                         user_id: Optional[str] = None) -> Dict:
-        """發送聊天消息"""
+                         user_id: Optional[str] = None,
+                         max_wait: float = 600) -> Dict:
+        """發送聊天消息
+        
+        通過異步任務接口提交問題，再用長輪詢等待結果，回答時間不受單個 HTTP 請求超時的限制。
+        """
         try:
             payload = {
                 'question': question,
                 'dataset_id': dataset_id,
-                'quote': True
+                'quote': True,
+                # 頁面只顯示文檔名和前 200 個字符，多取一個字符用於判斷是否顯示省略號
+                'source_fields': ['doc_name', 'content'],
+                'max_source_chars': 201
             }
             
             if session_id:
@@ -140,16 +161,51 @@ class StreamlitRAGClient:
             if user_id:
                 payload['user_id'] = user_id
             
-            response = self.session.post(
-                f"{self.api_url}/chat",
-                json=payload,
-                timeout=30
-            )
+            response = self.session.post(f"{self.api_url}/jobs", json=payload, timeout=10)
             response.raise_for_status()
+            job = response.json()
+            
+            deadline = time.time() + max_wait
+            while job['status'] not in ('succeeded', 'failed'):
+                if time.time() > deadline:
+                    raise TimeoutError(f"等待回答超過 {max_wait} 秒")
+                response = self.session.get(
+                    f"{self.api_url}/jobs/{job['job_id']}",
+                    params={'wait': 25},
+                    timeout=35
+                )
+                response.raise_for_status()
+                job = response.json()
+            
+            if job['status'] == 'failed':
+                return {
+                    'success': False,
+                    'error': job['error']
+                }
             
             return {
                 'success': True,
-                'data': response.json()
+                'data': job['result']
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def get_sessions(self, user_id: Optional[str] = None, cursor: Optional[str] = None,
+                     limit: int = 20) -> Dict:
+        """分頁獲取活躍會話列表"""
+        try:
+            params = {'limit': limit}
+            if user_id:
+                params['user_id'] = user_id
+            if cursor:
+                params['cursor'] = cursor
+            
+            return {
+                'success': True,
+                'data': self._get_cached("/sessions", params)
             }
         except Exception as e:
             return {
@@ -157,10 +213,14 @@ class StreamlitRAGClient:
                 'error': str(e)
             }
     
-    def get_sessions(self) -> Dict:
-        """獲取活躍會話列表"""
+    def get_messages(self, session_id: str, cursor: int = 0, limit: int = 200) -> Dict:
+        """分頁獲取會話的問答記錄"""
         try:
-            response = self.session.get(f"{self.api_url}/sessions", timeout=10)
+            response = self.session.get(
+                f"{self.api_url}/sessions/{session_id}/messages",
+                params={'cursor': cursor, 'limit': limit},
+                timeout=10
+            )
             response.raise_for_status()
             return {
                 'success': True,
@@ -196,7 +256,8 @@ def initialize_session_state():
         st.session_state.chat_history = []
     
     if 'current_session_id' not in st.session_state:
-        st.session_state.current_session_id = None
+        # 會話 ID 保存在網址參數中，瀏覽器刷新後可從服務端恢復聊天歷史
+        st.session_state.current_session_id = st.query_params.get('session_id')
     
     if 'selected_dataset' not in st.session_state:
         st.session_state.selected_dataset = None
@@ -207,6 +268,48 @@ def initialize_session_state():
     if 'api_connected' not in st.session_state:
         st.session_state.api_connected = False
 
+def remember_session(session_id: Optional[str]):
+    """記錄當前會話 ID 並同步到網址參數"""
+    st.session_state.current_session_id = session_id
+    if session_id:
+        st.query_params['session_id'] = session_id
+    elif 'session_id' in st.query_params:
+        del st.query_params['session_id']
+
+def restore_chat_history():
+    """從服務端消息記錄恢復當前會話的聊天歷史（每個瀏覽器會話只恢復一次）"""
+    if st.session_state.get('history_restored'):
+        return
+    st.session_state.history_restored = True
+    
+    session_id = st.session_state.current_session_id
+    if not session_id or st.session_state.chat_history:
+        return
+    
+    history = []
+    cursor = 0
+    while cursor is not None:
+        messages_result = st.session_state.client.get_messages(session_id, cursor=cursor)
+        if not messages_result['success']:
+            st.warning(f"恢復聊天歷史失敗: {messages_result['error']}")
+            return
+        
+        for message in messages_result['data']['messages']:
+            history.append({
+                'role': 'user',
+                'content': message['question'],
+                'timestamp': message['created_at']
+            })
+            history.append({
+                'role': 'bot',
+                'content': message['answer'],
+                'sources': message.get('sources', []),
+                'timestamp': message['created_at']
+            })
+        cursor = messages_result['data'].get('next_cursor')
+    
+    st.session_state.chat_history = history
+
 def check_api_connection():
     """檢查 API 連接狀態"""
     with st.spinner("檢查 API 連接..."):
@@ -353,7 +456,7 @@ def main():
         
         with col1:
             if st.button("🆕 新會話"):
-                st.session_state.current_session_id = None
+                remember_session(None)
                 st.session_state.chat_history = []
                 st.success("已開始新會話")
                 st.rerun()
@@ -366,13 +469,25 @@ def main():
         
         # 顯示活躍會話
         if st.button("📊 查看活躍會話"):
-            sessions_result = st.session_state.client.get_sessions()
+            st.session_state.sessions_cursor = None
+            st.session_state.show_sessions = True
+        
+        if st.session_state.get('show_sessions'):
+            sessions_result = st.session_state.client.get_sessions(
+                user_id=st.session_state.user_id,
+                cursor=st.session_state.get('sessions_cursor')
+            )
             if sessions_result['success']:
-                sessions = sessions_result['data']
+                sessions = sessions_result['data']['sessions']
                 if sessions:
-                    st.write(f"找到 {len(sessions)} 個活躍會話:")
-                    for session in sessions[:5]:  # 只顯示前5個
+                    st.write(f"本頁 {len(sessions)} 個活躍會話:")
+                    for session in sessions:
                         st.text(f"• {session['session_id'][:16]}... ({session['dataset_name']})")
+                    
+                    next_cursor = sessions_result['data'].get('next_cursor')
+                    if next_cursor and st.button("下一頁"):
+                        st.session_state.sessions_cursor = next_cursor
+                        st.rerun()
                 else:
                     st.info("沒有活躍會話")
             else:
@@ -381,6 +496,8 @@ def main():
     # 主聊天界面
     st.header("💬 聊天對話")
     
+    restore_chat_history()
+    
     # 顯示聊天歷史
     chat_container = st.container()
     
@@ -438,7 +555,7 @@ def main():
             response_data = chat_result['data']
             
             # 更新會話 ID
-            st.session_state.current_session_id = response_data['session_id']
+            remember_session(response_data['session_id'])
             
             # 添加機器人回應到歷史
             bot_message = {
@@ -498,7 +615,7 @@ def main():
             
             if chat_result['success']:
                 response_data = chat_result['data']
-                st.session_state.current_session_id = response_data['session_id']
+                remember_session(response_data['session_id'])
                 
                 bot_message = {
                     'role': 'bot',
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+可續傳的流式回答
+每個流式回答在獨立任務中生成，事件保存在有界的重放緩衝中，斷線重連時按 Last-Event-ID 補發
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StreamEvent:
+    seq: int
+    event: str
+    data: str  # 已編碼的 JSON
+
+class AnswerStream:
+    """一個流式回答的事件序列
+
+    事件按序號遞增保存，總字節數超過 max_bytes 時丟棄最舊的事件。
+    delta 以外的事件（done / error）表示流已結束。
+    """
+
+    def __init__(self, stream_id: str, max_bytes: int):
+        self.stream_id = stream_id
+        self.max_bytes = max_bytes
+        self.events: Deque[StreamEvent] = deque()
+        self.buffered_bytes = 0
+        self.next_seq = 1
+        self.finished = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, event: str, payload: Any):
+        """追加一個事件並喚醒所有訂閱者"""
+        if self.finished:
+            return
+        data = json.dumps(payload, ensure_ascii=False)
+        self.events.append(StreamEvent(self.next_seq, event, data))
+        self.next_seq += 1
+        self.buffered_bytes += len(data)
+        while self.buffered_bytes > self.max_bytes and len(self.events) > 1:
+            self.buffered_bytes -= len(self.events.popleft().data)
+
+        if event != 'delta':
+            self.finished = True
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, last_seq: int) -> bool:
+        """last_seq 之後的事件是否都還在緩衝中"""
+        return not self.events or self.events[0].seq <= last_seq + 1
+
+    async def follow(self, last_seq: int = 0) -> AsyncIterator[StreamEvent]:
+        """先補發 last_seq 之後的事件，再跟隨後續事件直到流結束"""
+        while True:
+            changed = self._changed
+            for event in list(self.events):
+                if event.seq > last_seq:
+                    last_seq = event.seq
+                    yield event
+            if self.finished:
+                return
+            await changed.wait()
+
+def parse_last_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """解析 Last-Event-ID（格式為 "流 ID:序號"），格式不符時返回 None"""
+    if not value:
+        return None
+    stream_id, _, seq = value.rpartition(':')
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+class StreamRegistry:
+    """流式回答登記表
+
+    生成任務不隨客戶端連接結束：最後一個訂閱者斷開後再等 grace_seconds，
+    期間沒有重連才取消生成。已結束的流保留 ttl_seconds 供補發。
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 1024, ttl_seconds: float = 60,
+                 grace_seconds: float = 30):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self.streams: Dict[str, AnswerStream] = {}
+        self._finished: 'OrderedDict[str, float]' = OrderedDict()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._finished:
+            stream_id, expires_at = next(iter(self._finished.items()))
+            if expires_at > now:
+                break
+            del self._finished[stream_id]
+            self.streams.pop(stream_id, None)
+
+    def create(self, stream_id: str, producer: Callable[[AnswerStream], Awaitable[None]]) -> AnswerStream:
+        """登記新的流並在獨立任務中開始生成"""
+        self._purge_expired()
+        stream = AnswerStream(stream_id, self.max_bytes)
+        self.streams[stream_id] = stream
+        stream.task = asyncio.create_task(producer(stream))
+        stream.task.add_done_callback(lambda task: self._finish(stream))
+        return stream
+
+    def get(self, stream_id: str) -> Optional[AnswerStream]:
+        """獲取流，已過期的流返回 None"""
+        self._purge_expired()
+        return self.streams.get(stream_id)
+
+    def attach(self, stream: AnswerStream):
+        """訂閱者接入，取消等待中的寬限期"""
+        stream.subscribers += 1
+        if stream._grace_handle:
+            stream._grace_handle.cancel()
+            stream._grace_handle = None
+
+    def detach(self, stream: AnswerStream):
+        """訂閱者斷開，沒有訂閱者時開始計算寬限期"""
+        stream.subscribers -= 1
+        if stream.subscribers == 0 and not stream.finished:
+            loop = asyncio.get_running_loop()
+            stream._grace_handle = loop.call_later(self.grace_seconds, self._abandon, stream)
+
+    def _abandon(self, stream: AnswerStream):
+        stream._grace_handle = None
+        if stream.subscribers or stream.finished:
+            return
+        logger.info(f"流式回答 {stream.stream_id} 在寬限期內沒有重連，取消生成")
+        stream.task.cancel()
+        stream.publish('error', {'status': 408, 'message': '客戶端斷開超過寬限期，回答已取消'})
+
+    def _finish(self, stream: AnswerStream):
+        if not stream.finished:
+            stream.publish('error', {'status': 500, 'message': '回答生成意外結束'})
+        self._finished[stream.stream_id] = time.monotonic() + self.ttl_seconds
+
+    async def stop(self):
+        """取消所有進行中的生成任務"""
+        tasks = [stream.task for stream in self.streams.values() if stream.task and not stream.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -6,12 +6,40 @@ RAGFlow FastAPI 客戶端示例
 
 import requests
 import json
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # 只有使用二進制格式時才需要
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
 
 class RAGFlowAPIClient:
-    def __init__(self, base_url: str = "http://localhost:8000"):
+    def __init__(self, base_url: str = "http://localhost:8000", binary: bool = False):
+        """binary 為 True 時請求體和回應都使用 MessagePack，省去 JSON 編解碼（需要安裝 msgpack）"""
+        if binary and msgpack is None:
+            raise RuntimeError("使用二進制格式需要安裝 msgpack")
         self.base_url = base_url.rstrip('/')
+        self.binary = binary
         self.session = requests.Session()
+        if binary:
+            self.session.headers['Accept'] = MSGPACK_MEDIA_TYPE
+    
+    def _post(self, path: str, payload: Dict, headers: Optional[Dict[str, str]] = None,
+              **kwargs) -> requests.Response:
+        """按客戶端格式編碼請求體並發送 POST 請求"""
+        if not self.binary:
+            return self.session.post(f"{self.base_url}{path}", json=payload, headers=headers, **kwargs)
+        headers = {**(headers or {}), 'Content-Type': MSGPACK_MEDIA_TYPE}
+        return self.session.post(f"{self.base_url}{path}", data=msgpack.packb(payload), headers=headers, **kwargs)
+    
+    @staticmethod
+    def _decode(response: requests.Response) -> Any:
+        """按回應的 Content-Type 解碼，錯誤回應始終是 JSON"""
+        if response.headers.get('content-type', '').startswith(MSGPACK_MEDIA_TYPE):
+            return msgpack.unpackb(response.content)
+        return response.json()
     
     def get_datasets(self) -> Dict:
         """獲取數據集列表"""
@@ -20,7 +48,7 @@ class RAGFlowAPIClient:
             response.raise_for_status()
             return {
                 'success': True,
-                'data': response.json()
+                'data': self._decode(response)
             }
         except Exception as e:
             return {
@@ -28,9 +56,30 @@ class RAGFlowAPIClient:
                 'error': str(e)
             }
     
+    def iter_datasets(self):
+        """以 NDJSON 流式獲取數據集，數據集很多時可以邊接收邊處理"""
+        response = self.session.get(
+            f"{self.base_url}/datasets",
+            headers={'Accept': 'application/x-ndjson'},
+            stream=True
+        )
+        response.raise_for_status()
+        
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+    
     def chat(self, question: str, dataset_id: str, session_id: Optional[str] = None, 
-             user_id: Optional[str] = None, quote: bool = True) -> Dict:
-        """發送聊天消息"""
+             user_id: Optional[str] = None, quote: bool = True,
+             idempotency_key: Optional[str] = None,
+             source_fields: Optional[List[str]] = None,
+             max_source_chars: Optional[int] = None,
+             max_sources: Optional[int] = None) -> Dict:
+        """發送聊天消息
+        
+        重試同一個問題時傳入相同的 idempotency_key，服務端不會重複生成回答。
+        source_fields / max_source_chars / max_sources 用於裁剪返回的引用片段。
+        """
         try:
             payload = {
                 'question': question,
@@ -42,14 +91,18 @@ class RAGFlowAPIClient:
                 payload['session_id'] = session_id
             if user_id:
                 payload['user_id'] = user_id
+            if source_fields is not None:
+                payload['source_fields'] = source_fields
+            if max_source_chars is not None:
+                payload['max_source_chars'] = max_source_chars
+            if max_sources is not None:
+                payload['max_sources'] = max_sources
             
-            response = self.session.post(
-                f"{self.base_url}/chat",
-                json=payload
-            )
+            headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+            response = self._post("/chat", payload, headers=headers)
             response.raise_for_status()
             
-            result = response.json()
+            result = self._decode(response)
             return {
                 'success': True,
                 'data': result
@@ -60,10 +113,41 @@ class RAGFlowAPIClient:
                 'error': str(e)
             }
     
-    def get_sessions(self) -> Dict:
-        """獲取活躍會話列表"""
+    def submit_job(self, question: str, dataset_id: str, session_id: Optional[str] = None,
+                   user_id: Optional[str] = None) -> Dict:
+        """提交異步聊天任務，立即返回任務 ID"""
+        payload = {
+            'question': question,
+            'dataset_id': dataset_id
+        }
+        if session_id:
+            payload['session_id'] = session_id
+        if user_id:
+            payload['user_id'] = user_id
+        
+        response = self._post("/jobs", payload)
+        response.raise_for_status()
+        return response.json()
+    
+    def wait_for_job(self, job_id: str, poll_wait: float = 25) -> Dict:
+        """長輪詢等待任務完成"""
+        while True:
+            response = self.session.get(f"{self.base_url}/jobs/{job_id}", params={'wait': poll_wait})
+            response.raise_for_status()
+            job = response.json()
+            if job['status'] in ('succeeded', 'failed'):
+                return job
+    
+    def search(self, question: str, dataset_ids: List[str], top_k: int = 10,
+               similarity_threshold: float = 0.2) -> Dict:
+        """只檢索相關片段，不生成回答"""
         try:
-            response = self.session.get(f"{self.base_url}/sessions")
+            response = self._post("/search", {
+                'question': question,
+                'dataset_ids': dataset_ids,
+                'top_k': top_k,
+                'similarity_threshold': similarity_threshold
+            })
             response.raise_for_status()
             return {
                 'success': True,
@@ -75,6 +159,52 @@ class RAGFlowAPIClient:
                 'error': str(e)
             }
     
+    def chat_batch(self, requests_payload: List[Dict], concurrency: int = 8,
+                   share_session: bool = False):
+        """批量發送聊天消息，按完成順序逐個產出結果"""
+        response = self._post("/chat/batch", {
+            'requests': requests_payload,
+            'concurrency': concurrency,
+            'share_session': share_session
+        }, stream=True)
+        response.raise_for_status()
+        
+        if self.binary:
+            # MessagePack 對象直接拼接，邊接收邊解碼
+            unpacker = msgpack.Unpacker()
+            for chunk in response.iter_content(chunk_size=None):
+                unpacker.feed(chunk)
+                yield from unpacker
+            return
+        
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+    
+    def get_sessions(self, user_id: Optional[str] = None, dataset_id: Optional[str] = None,
+                     cursor: Optional[str] = None, limit: int = 50) -> Dict:
+        """分頁獲取活躍會話列表"""
+        try:
+            params = {'limit': limit}
+            if user_id:
+                params['user_id'] = user_id
+            if dataset_id:
+                params['dataset_id'] = dataset_id
+            if cursor:
+                params['cursor'] = cursor
+            
+            response = self.session.get(f"{self.base_url}/sessions", params=params)
+            response.raise_for_status()
+            return {
+                'success': True,
+                'data': self._decode(response)
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
     def delete_session(self, session_id: str) -> Dict:
         """刪除會話"""
         try:
@@ -173,10 +303,10 @@ def demo_chat_agent():
     
     # 3. 查看活躍會話
     print(f"\n📊 查看活躍會話...")
-    sessions_result = client.get_sessions()
+    sessions_result = client.get_sessions(user_id=user_id)
     
     if sessions_result['success']:
-        sessions = sessions_result['data']
+        sessions = sessions_result['data']['sessions']
         print(f"✅ 找到 {len(sessions)} 個活躍會話:")
         for session in sessions:
             print(f"  - 會話 ID: {session['session_id']}")
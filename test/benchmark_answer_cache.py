@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+回答緩存內存佔用基準測試
+比較回答以 Python 對象、MessagePack/JSON 字節、普通壓縮和共享字典壓縮保存時，
+每條佔用的內存、每 GB 可容納的條數，以及命中時讀取並解碼一條的耗時。
+
+用法: python test/benchmark_answer_cache.py [--entries 2000] [--chunks 8] [--chunk-size 400] [--samples 200]
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from benchmark_utils import make_chunks
+
+from cache import SizedTTLCache
+from compression import DictionaryCompressor
+from answer_cache import RECORD_MEDIA_TYPE, decode_record, encode_record
+
+# 用於生成內容不完全重複的法律文本
+TOPICS = ['憲法', '行政法', '民法', '刑法', '訴訟法', '勞動法', '公司法', '稅法']
+PHRASES = [
+    '依本法規定', '主管機關應', '於法定期間內', '得向法院提起', '人民之權利', '不得違反',
+    '經審議後', '應予保障', '除法律另有規定外', '適用前項規定', '其程序準用', '應依職權調查',
+    '當事人得聲明不服', '自公布日施行', '前條所定', '不在此限', '以書面為之', '逾期不為者'
+]
+
+def make_text(rng: random.Random, size: int) -> str:
+    parts, length = [], 0
+    while length < size:
+        sentence = f"{rng.choice(TOPICS)}第{rng.randint(1, 300)}條：{''.join(rng.sample(PHRASES, 4))}。"
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)[:size]
+
+def make_answers(count: int, chunks: int, chunk_size: int) -> List[Dict[str, Any]]:
+    rng = random.Random(42)
+    answers = []
+    for index in range(count):
+        references = make_chunks(chunks, chunk_size)
+        for reference in references:
+            reference['id'] = f'{index:06d}-{reference["id"]}'
+            reference['content'] = make_text(rng, chunk_size)
+            reference['similarity'] = rng.random()
+        answers.append({
+            'answer': make_text(rng, 600),
+            'reference': {'total': chunks, 'chunks': references, 'doc_aggs': []}
+        })
+    return answers
+
+def measure_objects(answers: List[Dict[str, Any]]) -> int:
+    """以 tracemalloc 測量保存 Python 對象的內存"""
+    gc.collect()
+    tracemalloc.start()
+    stored = {index: decode_record(*encode_record(answer)) for index, answer in enumerate(answers)}
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del stored
+    return used
+
+def hit_latency_us(get: Callable[[int], Any], count: int, iterations: int = 2000) -> float:
+    started = time.perf_counter()
+    for index in range(iterations):
+        get(index % count)
+    return (time.perf_counter() - started) * 1e6 / iterations
+
+def report(label: str, bytes_per_entry: float, latency_us: float, baseline: float):
+    print(f"{label:<24} {bytes_per_entry / 1024:8.1f} KB/條  {(1 << 30) / bytes_per_entry:10,.0f} 條/GB  "
+          f"{baseline / bytes_per_entry:5.1f}x  命中 {latency_us:7.1f} µs")
+
+def main():
+    parser = argparse.ArgumentParser(description='回答緩存內存佔用基準測試')
+    parser.add_argument('--entries', type=int, default=2000, help='回答數')
+    parser.add_argument('--chunks', type=int, default=8, help='每個回答的引用片段數')
+    parser.add_argument('--chunk-size', type=int, default=400, help='每個片段的內容長度')
+    parser.add_argument('--samples', type=int, default=200, help='訓練共享字典的樣本數')
+    args = parser.parse_args()
+
+    answers = make_answers(args.entries, args.chunks, args.chunk_size)
+    records = [encode_record(answer)[1] for answer in answers]
+    print(f"{args.entries} 個回答，每個 {args.chunks} 個 {args.chunk_size} 字的引用片段，記錄格式 {RECORD_MEDIA_TYPE}")
+
+    object_bytes = measure_objects(answers) / len(answers)
+    objects = [decode_record(RECORD_MEDIA_TYPE, record) for record in records]
+    report('Python 對象', object_bytes, hit_latency_us(lambda index: objects[index], len(objects)), object_bytes)
+
+    variants = [('序列化字節', None), ('壓縮（無字典）', DictionaryCompressor()), ('壓縮（共享字典）', DictionaryCompressor())]
+    variants[2][1].train(records[:args.samples])
+    for label, compressor in variants:
+        cache = SizedTTLCache(1 << 40, 3600)
+        for index, record in enumerate(records):
+            cache.set(index, compressor.compress(record) if compressor else record)
+        if compressor:
+            unpack = lambda index: decode_record(RECORD_MEDIA_TYPE, compressor.decompress(cache.get(index)))
+        else:
+            unpack = lambda index: decode_record(RECORD_MEDIA_TYPE, cache.get(index))
+        report(label, cache.nbytes / len(records), hit_latency_us(unpack, len(records)), object_bytes)
+
+    if variants[2][1].dictionary:
+        print(f"\n共享字典 {len(variants[2][1].dictionary) / 1024:.0f} KB，用 {args.samples} 條回答訓練")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+回應壓縮基準測試
+對每種壓縮算法比較回應字節數與每次請求多花的 CPU 時間：
+- 1000 個數據集的 /datasets 列表
+- 帶 50 個大引用片段的 /chat 回應
+- 逐事件壓縮並刷新的 SSE 流（模擬流式回答的增量事件）
+
+用法: python test/benchmark_compression.py [--iterations 100] [--datasets 1000] [--chunks 50] [--events 200]
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body, measure
+from benchmark_serialization import make_datasets
+
+import fastapi_server
+from compression import STREAM_LEVELS, SUPPORTED_ENCODINGS, stream_compressor
+from message_log import MessageLog
+
+def compare_encodings(title: str, iterations: int, request_once):
+    """request_once(accept_encoding) 返回 (回應頭, 回應體)"""
+    print(f"\n{title}")
+    headers, identity_body = request_once('identity')
+    baseline = measure('identity', iterations, lambda: request_once('identity'))
+    for encoding in SUPPORTED_ENCODINGS:
+        headers, body = request_once(encoding)
+        assert headers.get('content-encoding') == encoding, headers
+        result = measure(encoding, iterations, lambda: request_once(encoding))
+        print(f"{'':<32} {len(identity_body) / 1024:.1f} KB -> {len(body) / 1024:.1f} KB，"
+              f"節省 {(1 - len(body) / len(identity_body)) * 100:.0f}%，"
+              f"CPU 增加 {result['cpu_ms'] - baseline['cpu_ms']:.3f} ms/次")
+
+def bench_sse(events: int):
+    """逐事件壓縮並刷新，統計總字節數和每個事件的 CPU 時間"""
+    payloads = [
+        f'id: bench:{seq}\nevent: delta\ndata: {json.dumps({"text": "根據資料，第" + str(seq) + "段的說明如下。"}, ensure_ascii=False)}\n\n'.encode('utf-8')
+        for seq in range(events)
+    ]
+    identity_bytes = sum(len(payload) for payload in payloads)
+    print(f"\nSSE 流（{events} 個增量事件，共 {identity_bytes / 1024:.1f} KB，每個事件單獨刷新）")
+    for encoding in SUPPORTED_ENCODINGS:
+        started = time.process_time()
+        compress_chunk, finish = stream_compressor(encoding, STREAM_LEVELS[encoding])
+        total = sum(len(compress_chunk(payload)) for payload in payloads) + len(finish())
+        cpu_us = (time.process_time() - started) * 1e6 / events
+        print(f"{encoding:<32} {total / 1024:.1f} KB，節省 {(1 - total / identity_bytes) * 100:.0f}%，"
+              f"CPU {cpu_us:.1f} µs/事件")
+
+def main():
+    parser = argparse.ArgumentParser(description='回應壓縮基準測試')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--datasets', type=int, default=1000, help='數據集數量')
+    parser.add_argument('--chunks', type=int, default=50, help='每個回答的引用片段數')
+    parser.add_argument('--chunk-size', type=int, default=4000, help='每個片段的內容長度')
+    parser.add_argument('--events', type=int, default=200, help='SSE 增量事件數')
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks, args.chunk_size)
+    fastapi_server.ragflow_client = CannedRAGFlowClient(make_completion_body(chunks), make_datasets(args.datasets))
+    loop = asyncio.new_event_loop()
+
+    def call(method: str, path: str, accept_encoding: str, body=None):
+        status, headers, content = loop.run_until_complete(asgi_request(
+            fastapi_server.app, method, path, body, headers={'accept-encoding': accept_encoding}
+        ))
+        assert status == 200, content[:200]
+        return headers, content
+
+    print(f"可用算法: {', '.join(SUPPORTED_ENCODINGS)}，每項 {args.iterations} 次")
+    compare_encodings(f"/datasets（{args.datasets} 個數據集）", args.iterations,
+                      lambda encoding: call('GET', '/datasets', encoding))
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '基準測試', chat_id='bench-chat'
+        )['session_id']
+        body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': session_id}
+        compare_encodings(f"/chat（{args.chunks} 個 {args.chunk_size} 字的引用片段）", args.iterations,
+                          lambda encoding: call('POST', '/chat', encoding, body))
+        fastapi_server.message_log.stop()
+
+    bench_sse(args.events)
+    loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+透傳模式基準測試
+比較 /chat 默認模式（解析、重組、重新序列化）與 raw 透傳模式每次請求的 CPU 時間
+
+用法: python test/benchmark_passthrough.py [--iterations 200] [--chunks 50] [--chunk-size 4000]
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body, measure
+
+import fastapi_server
+from message_log import MessageLog
+
+def main():
+    parser = argparse.ArgumentParser(description='透傳模式基準測試')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=50, help='每個回答的引用片段數')
+    parser.add_argument('--chunk-size', type=int, default=4000, help='每個片段的內容長度')
+    args = parser.parse_args()
+
+    completion_body = make_completion_body(make_chunks(args.chunks, args.chunk_size))
+    fastapi_server.ragflow_client = CannedRAGFlowClient(completion_body)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        # 消息日誌在後台線程寫入，CPU 時間也計入統計
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+
+        loop = asyncio.new_event_loop()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '基準測試', chat_id='bench-chat'
+        )['session_id']
+        body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': session_id}
+
+        def chat(query: str = ''):
+            status, _, content = loop.run_until_complete(
+                asgi_request(fastapi_server.app, 'POST', '/chat', body, query=query)
+            )
+            assert status == 200, content[:200]
+            return content
+
+        default_body = chat()
+        raw_body = chat('raw=true')
+        assert json.loads(raw_body)['ragflow']['data']['answer'] == json.loads(default_body)['answer']
+
+        print(f"上游回應體 {len(completion_body) / 1024:.1f} KB，{args.chunks} 個片段，{args.iterations} 次請求")
+        print(f"默認模式回應 {len(default_body) / 1024:.1f} KB，透傳模式回應 {len(raw_body) / 1024:.1f} KB")
+        default = measure('默認模式 POST /chat', args.iterations, chat)
+        raw = measure('透傳模式 POST /chat?raw=true', args.iterations, lambda: chat('raw=true'))
+        print(f"透傳模式 CPU 時間為默認模式的 {raw['cpu_ms'] / default['cpu_ms'] * 100:.0f}%")
+
+        fastapi_server.message_log.stop()
+        loop.close()
+
+if __name__ == "__main__":
+    main()
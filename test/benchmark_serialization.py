@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+回應序列化基準測試
+比較 FastAPI response_model 校驗加通用編碼（改動前）與跳過校驗、直接快速編碼（改動後）的開銷：
+- 1000 個數據集的 /datasets 列表
+- 帶 50 個大引用片段的 /chat 回應
+
+用法: python test/benchmark_serialization.py [--iterations 200] [--datasets 1000] [--chunks 50]
+"""
+
+import argparse
+import asyncio
+import tempfile
+from datetime import datetime
+from typing import List
+
+from fastapi import FastAPI
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body, measure
+
+import fastapi_server
+from fastapi_server import ChatResponse, DatasetInfo
+from message_log import MessageLog
+from serialization import FastJSONResponse, orjson
+
+def make_datasets(count: int):
+    return [
+        {
+            'id': f'dataset-{index:05d}',
+            'name': f'資料集 {index}',
+            'description': '法規與判例彙編' * 5,
+            'document_count': index % 300,
+            'create_time': 1722580000000 + index
+        }
+        for index in range(count)
+    ]
+
+def build_bench_app(datasets, chunks) -> FastAPI:
+    """同一份數據分別走改動前和改動後的回應路徑"""
+    app = FastAPI()
+    answer = '根據資料，' * 400
+
+    @app.get('/before/datasets', response_model=List[DatasetInfo])
+    async def before_datasets():
+        return [
+            DatasetInfo(
+                id=dataset.get('id', ''),
+                name=dataset.get('name', 'Unknown'),
+                description=dataset.get('description'),
+                document_count=dataset.get('document_count', 0),
+                create_time=dataset.get('create_time')
+            )
+            for dataset in datasets
+        ]
+
+    @app.get('/after/datasets', response_model=List[DatasetInfo])
+    async def after_datasets():
+        return FastJSONResponse([
+            {
+                'id': dataset.get('id', ''),
+                'name': dataset.get('name', 'Unknown'),
+                'description': dataset.get('description'),
+                'document_count': dataset.get('document_count') or 0,
+                'create_time': dataset.get('create_time')
+            }
+            for dataset in datasets
+        ])
+
+    def chat_fields():
+        return dict(success=True, answer=answer, sources=chunks, session_id='bench-session',
+                    chat_id='bench-chat', message='回答成功', timestamp=datetime.now())
+
+    @app.post('/before/chat', response_model=ChatResponse)
+    async def before_chat():
+        return ChatResponse(**chat_fields())
+
+    @app.post('/after/chat', response_model=ChatResponse)
+    async def after_chat():
+        return FastJSONResponse(ChatResponse.model_construct(**chat_fields()))
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='回應序列化基準測試')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--datasets', type=int, default=1000, help='數據集數量')
+    parser.add_argument('--chunks', type=int, default=50, help='每個回答的引用片段數')
+    parser.add_argument('--chunk-size', type=int, default=4000, help='每個片段的內容長度')
+    args = parser.parse_args()
+
+    datasets = make_datasets(args.datasets)
+    chunks = make_chunks(args.chunks, args.chunk_size)
+    bench_app = build_bench_app(datasets, chunks)
+    loop = asyncio.new_event_loop()
+
+    def call(app, method: str, path: str, body=None):
+        status, _, content = loop.run_until_complete(asgi_request(app, method, path, body))
+        assert status == 200, content[:200]
+        return content
+
+    print(f"JSON 編碼器: {'orjson' if orjson else 'pydantic-core'}，每項 {args.iterations} 次")
+    print(f"\n/datasets（{args.datasets} 個數據集）")
+    before = measure('改動前 response_model 校驗', args.iterations, lambda: call(bench_app, 'GET', '/before/datasets'))
+    after = measure('改動後 直接編碼', args.iterations, lambda: call(bench_app, 'GET', '/after/datasets'))
+    print(f"CPU 時間降低 {(1 - after['cpu_ms'] / before['cpu_ms']) * 100:.0f}%")
+
+    print(f"\n/chat（{args.chunks} 個 {args.chunk_size} 字的引用片段）")
+    before = measure('改動前 response_model 校驗', args.iterations, lambda: call(bench_app, 'POST', '/before/chat'))
+    after = measure('改動後 直接編碼', args.iterations, lambda: call(bench_app, 'POST', '/after/chat'))
+    print(f"CPU 時間降低 {(1 - after['cpu_ms'] / before['cpu_ms']) * 100:.0f}%")
+
+    # 實際接口的端到端開銷（包含上游回應解析、會話和消息日誌），供參考
+    fastapi_server.ragflow_client = CannedRAGFlowClient(make_completion_body(chunks), datasets)
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '基準測試', chat_id='bench-chat'
+        )['session_id']
+        body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': session_id}
+
+        print("\n實際接口（端到端）")
+        measure('GET /datasets', args.iterations, lambda: call(fastapi_server.app, 'GET', '/datasets'))
+        measure('POST /chat', args.iterations, lambda: call(fastapi_server.app, 'POST', '/chat', body))
+        fastapi_server.message_log.stop()
+
+    loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+基準測試共用工具
+在進程內直接調用 ASGI 應用，並用固定回應代替 RAGFlow，只測量本服務自身的開銷
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def make_chunks(count: int = 50, content_size: int = 4000) -> List[Dict[str, Any]]:
+    """生成 count 個內容長度為 content_size 的引用片段"""
+    return [
+        {
+            'id': f'chunk-{index}',
+            'content': ('憲法第' + str(index) + '條相關內容。') * (content_size // 12),
+            'document_id': f'doc-{index % 5}',
+            'document_name': f'文件{index % 5}.pdf',
+            'dataset_id': 'bench-dataset',
+            'image_id': '',
+            'positions': [[index, 100, 500, 200, 300]],
+            'similarity': 0.9 - index * 0.001,
+            'vector_similarity': 0.8,
+            'term_similarity': 0.7
+        }
+        for index in range(count)
+    ]
+
+def make_completion_body(chunks: List[Dict[str, Any]], answer_size: int = 2000) -> bytes:
+    """構建與 RAGFlow 聊天完成接口格式相同的回應體"""
+    return json.dumps({
+        'code': 0,
+        'message': '',
+        'data': {
+            'answer': '根據資料，' * (answer_size // 5),
+            'reference': {'total': len(chunks), 'chunks': chunks, 'doc_aggs': []},
+            'id': 'bench-answer',
+            'session_id': 'bench-session'
+        }
+    }, ensure_ascii=False).encode('utf-8')
+
+class CannedRAGFlowClient:
+    """返回固定內容的 RAGFlow 客戶端，解析開銷與真實客戶端一致"""
+
+    def __init__(self, completion_body: bytes, datasets: Optional[List[Dict[str, Any]]] = None):
+        self.completion_body = completion_body
+        self.datasets = datasets or []
+
+    def list_datasets(self, *args, **kwargs) -> Dict[str, Any]:
+        return {'success': True, 'data': self.datasets, 'message': '成功獲取數據集列表'}
+
+    def list_datasets_page(self, page: int = 1, page_size: int = 100, desc: bool = True) -> Dict[str, Any]:
+        # datasets 按默認的從新到舊排列
+        datasets = self.datasets if desc else self.datasets[::-1]
+        return {'data': datasets[(page - 1) * page_size:page * page_size], 'total': len(datasets)}
+
+    def create_chat(self, name: str, dataset_ids: List[str], **kwargs) -> Dict[str, Any]:
+        return {'success': True, 'data': {'id': 'bench-chat'}, 'message': '成功創建聊天會話'}
+
+    def create_session(self, chat_id: str, user_id: str = None) -> Dict[str, Any]:
+        return {'success': True, 'data': {'id': f'bench-session-{time.perf_counter_ns()}'}, 'message': '成功創建會話'}
+
+    def delete_sessions(self, chat_id: str, session_ids: List[str]) -> Dict[str, Any]:
+        return {'success': True, 'data': None, 'message': '成功刪除會話'}
+
+    def chat_completion(self, chat_id: str, session_id: str, question: str,
+                        quote: bool = True, stream: bool = False) -> Dict[str, Any]:
+        result = json.loads(self.completion_body)
+        return {'success': True, 'data': result['data'], 'message': '成功獲取回答'}
+
+    def chat_completion_raw(self, chat_id: str, session_id: str, question: str,
+                            quote: bool = True, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        for offset in range(0, len(self.completion_body), chunk_size):
+            yield self.completion_body[offset:offset + chunk_size]
+
+def cumulative(text: str) -> List[str]:
+    """RAGFlow 流式推送的累積回答：每條比上一條多一個字"""
+    return [text[:end] for end in range(1, len(text) + 1)]
+
+class ScriptedStreamClient(CannedRAGFlowClient):
+    """按腳本流式推送累積回答的固定回應客戶端
+
+    腳本項為文字（推送一條）、浮點數（停頓秒數）或 threading.Event（等到被設置）；
+    scripts 中有對應問題的腳本時使用它，否則使用 script。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.script: List[Any] = []
+        self.scripts: Dict[str, List[Any]] = {}
+        self.reference = json.loads(self.completion_body)['data']['reference']
+
+    def chat_completion_stream(self, chat_id: str, session_id: str, question: str,
+                               quote: bool = True) -> Iterator[Dict[str, Any]]:
+        for step in self.scripts.get(question, self.script):
+            if isinstance(step, float):
+                time.sleep(step)
+            elif isinstance(step, threading.Event):
+                step.wait(5)
+            else:
+                yield {'answer': step, 'reference': self.reference}
+
+async def asgi_request(app, method: str, path: str, body: Any = None, query: str = '',
+                       headers: Dict[str, str] = None) -> Tuple[int, Dict[str, str], bytes]:
+    """不經網絡直接調用 ASGI 應用，返回 (狀態碼, 回應頭, 回應體)
+
+    body 為 bytes 時原樣發送，需在 headers 中指定 Content-Type；其餘按 JSON 編碼。
+    """
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    if isinstance(body, bytes):
+        payload = body
+    else:
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        headers.setdefault('content-type', 'application/json')
+    request_headers = [(b'host', b'bench')]
+    request_headers += [(key.encode(), value.encode()) for key, value in headers.items()]
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': request_headers,
+        'client': ('127.0.0.1', 50000),
+        'server': ('bench', 80)
+    }
+    messages = [{'type': 'http.request', 'body': payload, 'more_body': False}]
+    status = 0
+    response_headers: Dict[str, str] = {}
+    parts: List[bytes] = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # 請求體已發送完，之後一直等待直到回應結束
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            response_headers.update((key.decode(), value.decode()) for key, value in message['headers'])
+        elif message['type'] == 'http.response.body':
+            parts.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return status, response_headers, b''.join(parts)
+
+class ASGIWebSocket:
+    """不經網絡連接 ASGI 應用的 WebSocket 端點
+
+    用法: async with ASGIWebSocket(app, '/ws/chat') as ws: await ws.send_json(...); await ws.receive_json()
+    """
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+        self.incoming: asyncio.Queue = asyncio.Queue()  # 客戶端發給應用的消息
+        self.outgoing: asyncio.Queue = asyncio.Queue()  # 應用發給客戶端的消息
+        self.task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> 'ASGIWebSocket':
+        scope = {
+            'type': 'websocket',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'scheme': 'ws',
+            'path': self.path,
+            'raw_path': self.path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'bench')],
+            'client': ('127.0.0.1', 50000),
+            'server': ('bench', 80),
+            'subprotocols': []
+        }
+        await self.incoming.put({'type': 'websocket.connect'})
+        self.task = asyncio.create_task(self.app(scope, self.incoming.get, self.outgoing.put))
+        message = await asyncio.wait_for(self.outgoing.get(), 5)
+        if message['type'] != 'websocket.accept':
+            raise ConnectionError(f'連接被拒絕: {message}')
+        return self
+
+    async def send_json(self, payload: Any):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(payload, ensure_ascii=False)})
+
+    async def send_text(self, text: str):
+        await self.incoming.put({'type': 'websocket.receive', 'text': text})
+
+    async def receive_json(self, timeout: float = 5) -> Any:
+        message = await asyncio.wait_for(self.outgoing.get(), timeout)
+        if message['type'] == 'websocket.close':
+            raise ConnectionError(f"連接已關閉: {message.get('code')}")
+        return json.loads(message['text'])
+
+    async def __aexit__(self, *exc_info):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 5)
+
+def measure(label: str, iterations: int, run_once: Callable[[], Any]) -> Dict[str, float]:
+    """執行 run_once 多次，統計每次的 CPU 時間和耗時（毫秒）"""
+    run_once()  # 預熱
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for _ in range(iterations):
+        run_once()
+    cpu_ms = (time.process_time() - cpu_started) * 1000 / iterations
+    wall_ms = (time.perf_counter() - wall_started) * 1000 / iterations
+    print(f"{label:<32} CPU {cpu_ms:8.3f} ms/次   耗時 {wall_ms:8.3f} ms/次")
+    return {'cpu_ms': cpu_ms, 'wall_ms': wall_ms}
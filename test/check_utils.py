@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+腳本式測試共用工具
+逐項運行檢查並打印 ✅ / ❌，最後匯總通過數量並給出腳本的退出碼
+"""
+
+from typing import Any, Callable, Dict, List
+
+def print_header(title: str):
+    """打印測試標題"""
+    print(f"🧪 {title}")
+    print("=" * 40)
+
+class ScriptTester:
+    """腳本式測試的基類，子類的檢查方法失敗時拋出異常（通常是 AssertionError）"""
+
+    def __init__(self):
+        self.results: List[Dict[str, Any]] = []
+
+    def check(self, name: str, run: Callable[[], None]):
+        try:
+            run()
+            self.results.append({'name': name, 'success': True})
+            print(f"✅ {name}")
+        except Exception as e:
+            self.results.append({'name': name, 'success': False, 'error': repr(e)})
+            print(f"❌ {name}: {e!r}")
+
+    def summary(self) -> int:
+        """打印通過數量，有失敗項時返回 1"""
+        failed = [result for result in self.results if not result['success']]
+        print(f"\n📊 {len(self.results) - len(failed)}/{len(self.results)} 項通過")
+        return 1 if failed else 0
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+回答緩存會話測試
+檢查不帶 session_id 的首輪問題命中回答緩存時不調用 RAGFlow（不創建聊天助手和會話），
+以及客戶端在返回的會話中追問時，RAGFlow 會話在第一次追問時補建並帶有首輪問答。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_answer_cache.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from answer_cache import AnswerCache
+from message_log import MessageLog
+
+QUESTION = '什麼是憲法？'
+
+class RecordingRAGFlowClient(CannedRAGFlowClient):
+    """記錄每次上游調用的固定回應客戶端"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls: List[tuple] = []
+        self.session_count = 0
+
+    def create_chat(self, name: str, dataset_ids: List[str], **kwargs) -> Dict[str, Any]:
+        self.calls.append(('create_chat', name))
+        return {'success': True, 'data': {'id': 'bench-chat'}, 'message': '成功'}
+
+    def create_session(self, chat_id: str, user_id: str = None) -> Dict[str, Any]:
+        self.session_count += 1
+        session_id = f'ragflow-session-{self.session_count}'
+        self.calls.append(('create_session', chat_id, session_id))
+        return {'success': True, 'data': {'id': session_id}, 'message': '會話創建成功'}
+
+    def chat_completion(self, chat_id: str, session_id: str, question: str,
+                        quote: bool = True, stream: bool = False) -> Dict[str, Any]:
+        self.calls.append(('chat_completion', session_id, question))
+        return super().chat_completion(chat_id, session_id, question, quote, stream)
+
+    def take(self) -> List[tuple]:
+        calls, self.calls = self.calls, []
+        return calls
+
+class AnswerCacheTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: RecordingRAGFlowClient):
+        super().__init__()
+        self.loop = loop
+        self.client = client
+
+    def request(self, method: str, path: str, body: Any = None):
+        return self.loop.run_until_complete(asgi_request(fastapi_server.app, method, path, body))
+
+    def chat(self, question: str, session_id: str = None) -> Dict[str, Any]:
+        body = {'question': question, 'dataset_id': 'bench-dataset'}
+        if session_id:
+            body['session_id'] = session_id
+        status, _, response = self.request('POST', '/chat', body)
+        assert status == 200, response[:200]
+        return json.loads(response)
+
+    def test_miss_then_hit(self):
+        fastapi_server.answer_cache.memory.clear()
+        self.client.take()
+        first = self.chat(QUESTION)
+        assert not first['cached']
+        assert [call[0] for call in self.client.take()] == ['create_chat', 'create_session', 'chat_completion']
+
+        second = self.chat(QUESTION)
+        assert second['cached'] and second['answer'] == first['answer']
+        assert self.client.take() == [], '命中緩存時不應調用 RAGFlow'
+        assert second['session_id'] != first['session_id']
+
+    def test_follow_up_after_hit(self):
+        hit = self.chat(QUESTION)
+        assert hit['cached']
+        session_id = hit['session_id']
+        self.client.take()
+
+        follow_up = self.chat('憲法第一條是什麼？', session_id)
+        assert follow_up['session_id'] == session_id and not follow_up['cached']
+        calls = self.client.take()
+        # 補建 RAGFlow 會話，先重新提問首輪問題，再在同一會話中回答追問
+        assert [call[0] for call in calls] == ['create_session', 'chat_completion', 'chat_completion'], calls
+        ragflow_session_id = calls[0][2]
+        assert calls[1] == ('chat_completion', ragflow_session_id, QUESTION), calls[1]
+        assert calls[2] == ('chat_completion', ragflow_session_id, '憲法第一條是什麼？'), calls[2]
+
+        # 之後的追問直接使用已補建的會話
+        self.chat('憲法第二條是什麼？', session_id)
+        assert self.client.take() == [('chat_completion', ragflow_session_id, '憲法第二條是什麼？')]
+
+        # 消息記錄中保存了首輪（緩存）回答和兩次追問
+        fastapi_server.message_log.flush()
+        status, _, response = self.request('GET', f'/sessions/{session_id}/messages')
+        assert status == 200, response[:200]
+        questions = [message['question'] for message in json.loads(response)['messages']]
+        assert questions == [QUESTION, '憲法第一條是什麼？', '憲法第二條是什麼？'], questions
+
+    def test_concurrent_follow_ups(self):
+        session_id = self.chat(QUESTION)['session_id']
+        self.client.take()
+
+        async def follow_ups():
+            body = {'question': '憲法第三條是什麼？', 'dataset_id': 'bench-dataset', 'session_id': session_id}
+            return await asyncio.gather(*(asgi_request(fastapi_server.app, 'POST', '/chat', body) for _ in range(4)))
+
+        responses = self.loop.run_until_complete(follow_ups())
+        assert all(status == 200 for status, _, _ in responses)
+        calls = self.client.take()
+        assert [call[0] for call in calls].count('create_session') == 1, calls
+        assert [call[2] for call in calls].count(QUESTION) == 1, '首輪問題應只重新提問一次'
+
+def main() -> int:
+    client = RecordingRAGFlowClient(make_completion_body(make_chunks(3, 200)))
+    fastapi_server.ragflow_client = client
+    fastapi_server.answer_cache = AnswerCache(fastapi_server.dataset_watcher.generation, ttl_seconds=3600)
+    loop = asyncio.new_event_loop()
+    tester = AnswerCacheTester(loop, client)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+
+        print_header("回答緩存會話測試")
+        tester.check("首輪未命中時創建會話，命中時不調用 RAGFlow", tester.test_miss_then_hit)
+        tester.check("命中後追問時補建會話並帶上首輪問答", tester.test_follow_up_after_hit)
+        tester.check("並發追問只補建一次會話", tester.test_concurrent_follow_ups)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
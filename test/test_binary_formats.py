@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+二進制格式一致性測試
+檢查 /chat、/chat/batch、/datasets、/sessions 以 MessagePack / CBOR 返回的結構與 JSON 回應一致，
+以及二進制請求體與 JSON 請求體的處理結果一致。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_binary_formats.py
+"""
+
+import asyncio
+import io
+import json
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from message_log import MessageLog
+from serialization import BINARY_MEDIA_TYPES, MSGPACK_MEDIA_TYPE, SEQUENCE_MEDIA_TYPES, dump, negotiate_media_type
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# 每次請求都會變化的字段，只比較類型不比較值
+VOLATILE_FIELDS = {'timestamp', 'elapsed_ms'}
+
+def shape(value: Any) -> Any:
+    """把數據轉為只包含字段名和類型的結構"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(item) for item in value]
+    return type(value).__name__
+
+def strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: strip_volatile(item) for key, item in value.items() if key not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [strip_volatile(item) for item in value]
+    return value
+
+def decode(body: bytes, media_type: str) -> Any:
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.unpackb(body)
+    return cbor2.loads(body)
+
+def decode_records(body: bytes, media_type: str) -> List[Any]:
+    """解碼逐條輸出的流式回應"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return list(msgpack.Unpacker(io.BytesIO(body)))
+    stream, records = io.BytesIO(body), []
+    while stream.tell() < len(body):
+        records.append(cbor2.load(stream))
+    return records
+
+class BinaryFormatTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.loop = loop
+
+    def request(self, method: str, path: str, body: Any = None, headers: Dict[str, str] = None):
+        return self.loop.run_until_complete(asgi_request(fastapi_server.app, method, path, body, headers=headers))
+
+    def assert_parity(self, binary: Any, expected: Any):
+        assert shape(binary) == shape(expected), '字段或類型與 JSON 不一致'
+        assert strip_volatile(binary) == strip_volatile(expected), '字段值與 JSON 不一致'
+
+    def test_datasets(self, media_type: str):
+        status, _, json_body = self.request('GET', '/datasets')
+        assert status == 200
+        status, headers, body = self.request('GET', '/datasets', headers={'Accept': media_type})
+        assert status == 200 and headers['content-type'] == media_type, headers
+        self.assert_parity(decode(body, media_type), json.loads(json_body))
+
+    def test_chat(self, media_type: str, chat_body: Dict[str, Any]):
+        status, _, json_body = self.request('POST', '/chat', chat_body)
+        assert status == 200, json_body[:200]
+        expected = json.loads(json_body)
+
+        # 二進制回應
+        status, headers, body = self.request('POST', '/chat', chat_body, headers={'Accept': media_type})
+        assert status == 200 and headers['content-type'] == media_type, headers
+        self.assert_parity(decode(body, media_type), expected)
+
+        # 二進制請求體、JSON 回應
+        status, _, body = self.request('POST', '/chat', dump(chat_body, media_type),
+                                       headers={'Content-Type': media_type})
+        assert status == 200, body[:200]
+        self.assert_parity(json.loads(body), expected)
+
+    def test_chat_batch(self, media_type: str, chat_body: Dict[str, Any]):
+        batch = {'requests': [chat_body, {**chat_body, 'question': '什麼是法律？'}], 'concurrency': 2}
+        status, _, json_body = self.request('POST', '/chat/batch', batch)
+        assert status == 200
+        expected = sorted((json.loads(line) for line in json_body.splitlines()), key=lambda r: r.get('index', -1))
+
+        status, headers, body = self.request('POST', '/chat/batch', dump(batch, media_type),
+                                             headers={'Content-Type': media_type, 'Accept': media_type})
+        assert status == 200 and headers['content-type'] == SEQUENCE_MEDIA_TYPES[media_type], headers
+        records = sorted(decode_records(body, media_type), key=lambda r: r.get('index', -1))
+        self.assert_parity(records, expected)
+
+    def test_sessions(self, media_type: str):
+        status, _, json_body = self.request('GET', '/sessions')
+        assert status == 200
+        status, headers, body = self.request('GET', '/sessions', headers={'Accept': media_type})
+        assert status == 200 and headers['content-type'] == media_type, headers
+        self.assert_parity(decode(body, media_type), json.loads(json_body))
+
+    def test_invalid_body(self, media_type: str):
+        status, _, _ = self.request('POST', '/chat', b'\xc1\xff\x00', headers={'Content-Type': media_type})
+        assert status == 400, status
+
+    def test_json_default(self):
+        # 未指定或 JSON 權重更高時仍返回 JSON
+        for accept in (None, '*/*', f'application/json, {MSGPACK_MEDIA_TYPE};q=0.5'):
+            status, headers, _ = self.request('GET', '/datasets', headers={'Accept': accept} if accept else None)
+            assert status == 200 and headers['content-type'] == 'application/json', (accept, headers)
+
+    def test_specific_over_wildcard(self, media_type: str):
+        # 權重相同時更具體的範圍優先（RFC 9110），通配符不會讓 JSON 勝出
+        for accept in (f'{media_type}, */*', f'*/*, {media_type}', f'{media_type}, application/*',
+                       f'application/json;q=0.5, {media_type};q=0.8, */*;q=0.8'):
+            assert negotiate_media_type(accept) == media_type, accept
+        assert negotiate_media_type(f'{media_type};q=0.5, */*') == 'application/json'
+        assert negotiate_media_type(f'{media_type}, application/json') == 'application/json'
+        status, headers, _ = self.request('GET', '/datasets', headers={'Accept': f'{media_type}, */*'})
+        assert status == 200 and headers['content-type'] == media_type, headers
+
+def main() -> int:
+    if not BINARY_MEDIA_TYPES:
+        print("⚠️ 未安裝 msgpack 或 cbor2，跳過測試")
+        return 0
+
+    datasets = [{'id': f'dataset-{index}', 'name': f'資料集 {index}', 'document_count': index} for index in range(20)]
+    fastapi_server.ragflow_client = CannedRAGFlowClient(make_completion_body(make_chunks(5, 200)), datasets)
+    loop = asyncio.new_event_loop()
+    tester = BinaryFormatTester(loop)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '一致性測試', chat_id='bench-chat'
+        )['session_id']
+        chat_body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': session_id}
+
+        print_header("二進制格式一致性測試")
+        tester.check("未要求二進制格式時返回 JSON", tester.test_json_default)
+        for media_type in BINARY_MEDIA_TYPES:
+            tester.check(f"{media_type} GET /datasets", lambda: tester.test_datasets(media_type))
+            tester.check(f"{media_type} POST /chat", lambda: tester.test_chat(media_type, chat_body))
+            tester.check(f"{media_type} POST /chat/batch", lambda: tester.test_chat_batch(media_type, chat_body))
+            tester.check(f"{media_type} GET /sessions", lambda: tester.test_sessions(media_type))
+            tester.check(f"{media_type} 無效請求體返回 400", lambda: tester.test_invalid_body(media_type))
+            tester.check(f"{media_type} 權重相同時優先於 */*", lambda: tester.test_specific_over_wildcard(media_type))
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+引用片段哈希測試
+檢查 source_refs 模式下回應中的 chunk_hash 在內存片段存儲淘汰後仍能通過 GET /chunks/{hash} 取回，
+包括按 source_fields / max_source_chars 裁剪過的片段，且取回的內容與回應中的片段一致。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_chunk_refs.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from chunk_store import HASH_FIELD, ChunkStore
+from message_log import MessageLog
+
+class ChunkRefsTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop, session_id: str):
+        super().__init__()
+        self.loop = loop
+        self.session_id = session_id
+
+    def request(self, method: str, path: str, body: Any = None):
+        return self.loop.run_until_complete(asgi_request(fastapi_server.app, method, path, body))
+
+    def chat(self, **options) -> List[Dict[str, Any]]:
+        body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': self.session_id,
+                'source_refs': True, **options}
+        status, _, response = self.request('POST', '/chat', body)
+        assert status == 200, response[:200]
+        return json.loads(response)['sources']
+
+    def fetch_after_eviction(self, sources: List[Dict[str, Any]]):
+        """清空內存片段存儲，等日誌寫盤後按哈希逐個取回並比較內容"""
+        fastapi_server.chunk_store = ChunkStore()
+        for source in sources:
+            digest = source[HASH_FIELD]
+            expected = {key: value for key, value in source.items() if key != HASH_FIELD}
+            deadline = time.monotonic() + 5
+            while True:
+                status, _, body = self.request('GET', f'/chunks/{digest}')
+                if status == 200 or time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+            assert status == 200, f'{digest}: {status}'
+            assert json.loads(body) == expected, '取回的片段與回應中的不一致'
+
+    def test_full_chunks(self):
+        self.fetch_after_eviction(self.chat())
+
+    def test_projected_fields(self):
+        sources = self.chat(source_fields=['document_name', 'content'])
+        assert all(set(source) == {'document_name', 'content', HASH_FIELD} for source in sources)
+        self.fetch_after_eviction(sources)
+
+    def test_truncated_content(self):
+        sources = self.chat(max_source_chars=50)
+        assert all(len(source['content']) <= 50 for source in sources)
+        self.fetch_after_eviction(sources)
+
+    def test_unknown_hash(self):
+        status, _, _ = self.request('GET', '/chunks/' + '0' * 32)
+        assert status == 404, status
+
+def main() -> int:
+    fastapi_server.ragflow_client = CannedRAGFlowClient(make_completion_body(make_chunks(5, 200)))
+    loop = asyncio.new_event_loop()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '片段測試', chat_id='bench-chat'
+        )['session_id']
+        tester = ChunkRefsTester(loop, session_id)
+
+        print_header("引用片段哈希測試")
+        # 每項前清除會話的發送記錄，確保回應中帶有片段內容
+        for name, run in [
+            ("完整片段淘汰後可取回", tester.test_full_chunks),
+            ("按字段裁剪的片段淘汰後可取回", tester.test_projected_fields),
+            ("截斷內容的片段淘汰後可取回", tester.test_truncated_content),
+            ("未知哈希返回 404", tester.test_unknown_hash),
+        ]:
+            fastapi_server.chunk_store.forget(session_id)
+            tester.check(name, run)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+多節點測試
+在同一進程內模擬兩個節點：各自持有會話管理器、消息日誌和片段存儲，節點間轉發直接調用 FastAPI 應用。
+檢查節點間接口的令牌校驗，以及成員變更後會話連同消息記錄一起移交給新的歸屬節點。
+用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_cluster.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from chunk_store import ChunkStore
+from cluster import FORWARDED_HEADER, TOKEN_HEADER
+from message_log import MessageLog
+
+NODE_A = 'http://node-a:8000'
+NODE_B = 'http://node-b:8000'
+SECRET = 'test-secret'
+
+class Node:
+    """一個模擬節點的本地狀態，activate 後 fastapi_server 的全局對象指向它"""
+
+    def __init__(self, url: str, log_dir: str):
+        self.url = url
+        self.session_manager = fastapi_server.SessionManager()
+        self.message_log = MessageLog(log_dir)
+        self.chunk_store = ChunkStore()
+
+    def activate(self):
+        fastapi_server.cluster.self_url = self.url
+        fastapi_server.session_manager = self.session_manager
+        fastapi_server.message_log = self.message_log
+        fastapi_server.chunk_store = self.chunk_store
+
+class ForwardedResponse:
+    """模擬 requests.Response 中轉發用到的部分"""
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status_code = status
+        self.headers = {key.title(): value for key, value in headers.items()}
+        self.content = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise fastapi_server.requests.HTTPError(f'{self.status_code}: {self.content[:200]!r}')
+
+    def iter_content(self, chunk_size=None):
+        yield self.content
+
+    def close(self):
+        pass
+
+class ClusterTester(ScriptTester):
+    def __init__(self, nodes: Dict[str, Node]):
+        super().__init__()
+        self.nodes = nodes
+        self.current = nodes[NODE_A]
+
+    def use(self, node: Node):
+        self.current = node
+        node.activate()
+
+    def forward(self, node: str, method: str, path: str, json: Any = None, params: Dict[str, Any] = None,
+                headers: Dict[str, str] = None, stream: bool = False) -> ForwardedResponse:
+        """代替 ClusterManager.forward：切換到目標節點，在新的事件循環中處理請求後切回"""
+        caller = self.current
+        headers = {**(headers or {}), FORWARDED_HEADER: caller.url, TOKEN_HEADER: SECRET}
+        path, _, query = path.partition('?')
+        self.use(self.nodes[node])
+        try:
+            status, response_headers, body = asyncio.run(
+                asgi_request(fastapi_server.app, method, path, json, query=query, headers=headers)
+            )
+        finally:
+            self.use(caller)
+        return ForwardedResponse(status, response_headers, body)
+
+    def request(self, method: str, path: str, body: Any = None, headers: Dict[str, str] = None):
+        return asyncio.run(asgi_request(fastapi_server.app, method, path, body, headers=headers))
+
+    def set_members(self, nodes: List[str], secret: str = SECRET):
+        fastapi_server.cluster.ring.set_nodes(nodes)
+        fastapi_server.cluster.secret = secret
+
+    def test_internal_disabled(self):
+        self.set_members([NODE_A])
+        status, _, _ = self.request('POST', '/internal/sessions', [], headers={TOKEN_HEADER: SECRET})
+        assert status == 404, status
+
+    def test_internal_token(self):
+        self.set_members([NODE_A, NODE_B], secret='')
+        status, _, _ = self.request('POST', '/internal/sessions', [])
+        assert status == 403, f'未設置密鑰: {status}'
+        self.set_members([NODE_A, NODE_B])
+        status, _, _ = self.request('POST', '/internal/sessions', [], headers={TOKEN_HEADER: 'wrong'})
+        assert status == 403, f'錯誤令牌: {status}'
+        status, _, _ = self.request('POST', '/internal/sessions', [], headers={TOKEN_HEADER: SECRET})
+        assert status == 200, f'正確令牌: {status}'
+
+    def test_rebalance_transcript(self):
+        # 單節點時在 A 上創建會話並問答，再加入 B，只移交歸屬 B 的會話
+        self.set_members([NODE_A])
+        self.use(self.nodes[NODE_A])
+        session_ids = [
+            self.current.session_manager.create_session('bench-dataset', '多節點測試', chat_id='bench-chat')['session_id']
+            for _ in range(8)
+        ]
+        for session_id in session_ids:
+            for question in ('什麼是憲法？', '憲法第一條是什麼？'):
+                body = {'question': question, 'dataset_id': 'bench-dataset', 'session_id': session_id}
+                status, _, response = self.request('POST', '/chat', body)
+                assert status == 200, response[:200]
+
+        self.set_members([NODE_A, NODE_B])
+        moved = [session_id for session_id in session_ids if fastapi_server.cluster.owner_of(session_id) == NODE_B]
+        assert moved, '沒有會話歸屬 B，無法測試移交'
+        moved_count = asyncio.run(fastapi_server.rebalance_sessions())
+        assert moved_count == len(moved), (moved_count, len(moved))
+        self.nodes[NODE_B].message_log.flush()
+        self.current.message_log.flush()
+
+        for session_id in moved:
+            assert self.current.session_manager.get_session(session_id) is None, 'A 仍持有已移交的會話'
+            assert not self.current.message_log.has_session(session_id), 'A 仍保留已移交會話的記錄'
+            # 從 A 查詢會被轉發到 B，B 上有完整的問答記錄和展開的引用片段
+            status, _, response = self.request('GET', f'/sessions/{session_id}/messages')
+            assert status == 200, response[:200]
+            messages = json.loads(response)['messages']
+            assert [message['question'] for message in messages] == ['什麼是憲法？', '憲法第一條是什麼？'], messages
+            assert all(message['sources'] and 'content' in message['sources'][0] for message in messages)
+
+        for session_id in set(session_ids) - set(moved):
+            assert self.current.session_manager.get_session(session_id) is not None, 'A 的會話被誤移交'
+            assert len(self.current.message_log.export_session(session_id)) == 2
+
+def main() -> int:
+    fastapi_server.ragflow_client = CannedRAGFlowClient(make_completion_body(make_chunks(3, 200)))
+    original_forward = fastapi_server.cluster.forward
+
+    with tempfile.TemporaryDirectory() as dir_a, tempfile.TemporaryDirectory() as dir_b:
+        nodes = {NODE_A: Node(NODE_A, dir_a), NODE_B: Node(NODE_B, dir_b)}
+        for node in nodes.values():
+            node.message_log.start()
+        tester = ClusterTester(nodes)
+        tester.use(nodes[NODE_A])
+        fastapi_server.cluster.forward = tester.forward
+
+        print_header("多節點測試")
+        tester.check("未啟用集群時節點間接口返回 404", tester.test_internal_disabled)
+        tester.check("節點間接口校驗集群令牌", tester.test_internal_token)
+        tester.check("成員變更後消息記錄隨會話移交", tester.test_rebalance_transcript)
+
+        fastapi_server.cluster.forward = original_forward
+        for node in nodes.values():
+            node.message_log.stop()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+數據集目錄索引測試
+檢查 DatasetIndex 與 GET /datasets?q=、GET /datasets/{id} 的查找結果：中英混合與全半角查詢、
+單字查詢、前綴查詢、文件數範圍，以及目錄刷新（新增、刪除、改名、文件數變化）後索引與按 ID 查找的結果。
+索引查找的結果都與逐個比對名稱的全表掃描比較。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_dataset_catalog.py
+"""
+
+import asyncio
+import json
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from cache import normalize_query
+from catalog import DatasetIndex
+from config import DATASET_PAGE_SIZE
+
+DATASETS = [
+    {'id': 'ds-1', 'name': '憲法 Constitution 2024', 'document_count': 12},
+    {'id': 'ds-2', 'name': '民法Civil Code', 'document_count': 40},
+    {'id': 'ds-3', 'name': 'ＡＰＩ文件', 'document_count': 3},
+    {'id': 'ds-4', 'name': 'Tax稅法彙編', 'document_count': 7},
+    {'id': 'ds-5', 'name': '刑法', 'document_count': 0},
+    {'id': 'ds-6', 'name': 'civil procedure 民事訴訟法', 'document_count': 25},
+    {'id': 'ds-7', 'name': 'X', 'document_count': 1},
+]
+
+# 刷新後：刪除 ds-5，ds-2 改名，ds-4 文件數變化，新增 ds-8
+REFRESHED = [
+    {'id': 'ds-1', 'name': '憲法 Constitution 2024', 'document_count': 12},
+    {'id': 'ds-2', 'name': '民事法規 Civil Law', 'document_count': 40},
+    {'id': 'ds-3', 'name': 'ＡＰＩ文件', 'document_count': 3},
+    {'id': 'ds-4', 'name': 'Tax稅法彙編', 'document_count': 70},
+    {'id': 'ds-6', 'name': 'civil procedure 民事訴訟法', 'document_count': 25},
+    {'id': 'ds-7', 'name': 'X', 'document_count': 1},
+    {'id': 'ds-8', 'name': '行政法 Admin', 'document_count': 9},
+]
+
+QUERIES = ['法c', 'API文', 'constitution', '民事', 'CIVIL', 'ｃｉｖｉｌ ｌ', '2024憲', '法', 'x', '稅', '不存在']
+
+def scan(datasets: List[Dict[str, Any]], q: str, prefix_only: bool = False,
+         min_documents: Optional[int] = None, max_documents: Optional[int] = None) -> List[str]:
+    """逐個比對名稱的參考結果，排序規則與索引相同：名稱以 q 開頭的在前，其餘按目錄順序"""
+    text = normalize_query(q)
+    matched = []
+    for position, dataset in enumerate(datasets):
+        name = normalize_query(dataset['name'])
+        if not (name.startswith(text) if prefix_only else text in name):
+            continue
+        count = dataset.get('document_count') or 0
+        if (min_documents is not None and count < min_documents) or (max_documents is not None and count > max_documents):
+            continue
+        matched.append((not name.startswith(text), position, dataset['id']))
+    return [dataset_id for _, _, dataset_id in sorted(matched)]
+
+def ids(datasets: List[Dict[str, Any]]) -> List[str]:
+    return [dataset['id'] for dataset in datasets]
+
+class DatasetCatalogTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: CannedRAGFlowClient):
+        super().__init__()
+        self.loop = loop
+        self.client = client
+
+    def request(self, path: str, query: str = ''):
+        return self.loop.run_until_complete(
+            asgi_request(fastapi_server.app, 'GET', path, query=quote(query, safe='=&'))
+        )
+
+    @staticmethod
+    def assert_index_matches_scan(index: DatasetIndex, datasets: List[Dict[str, Any]]):
+        for q in QUERIES:
+            for prefix_only in (False, True):
+                expected = scan(datasets, q, prefix_only)
+                assert ids(index.search(q, prefix_only=prefix_only)) == expected, (q, prefix_only)
+
+    @staticmethod
+    def assert_no_stale_postings(index: DatasetIndex):
+        for gram, dataset_ids in index.postings.items():
+            assert dataset_ids, f'殘留空倒排表: {gram!r}'
+            assert dataset_ids <= set(index.by_id), f'倒排表中有已刪除的數據集: {gram!r}'
+
+    def test_mixed_queries(self):
+        index = DatasetIndex()
+        index.update(DATASETS)
+        assert ids(index.search('法c')) == ['ds-2'], '跨中英邊界的子串'
+        assert ids(index.search('API文')) == ['ds-3'], '全角名稱應能以半角查找'
+        assert ids(index.search('ｃｏｎｓｔｉｔｕｔｉｏｎ')) == ['ds-1'], '全角查詢應匹配半角名稱'
+        assert ids(index.search('civil')) == ['ds-6', 'ds-2'], '名稱以查詢開頭的排在前面'
+        assert ids(index.search('2024憲')) == []
+        self.assert_index_matches_scan(index, DATASETS)
+
+    def test_single_character(self):
+        index = DatasetIndex()
+        index.update(DATASETS)
+        assert ids(index.search('法')) == scan(DATASETS, '法') == ['ds-1', 'ds-2', 'ds-4', 'ds-5', 'ds-6']
+        assert ids(index.search('x')) == ['ds-7', 'ds-4'], '單個拉丁字母忽略大小寫'
+        assert ids(index.search('刑', prefix_only=True)) == ['ds-5']
+
+    def test_document_count_filters(self):
+        index = DatasetIndex()
+        index.update(DATASETS)
+        assert ids(index.search(min_documents=7, max_documents=25)) == ['ds-1', 'ds-4', 'ds-6']
+        assert ids(index.search('法', min_documents=10)) == scan(DATASETS, '法', min_documents=10)
+        assert ids(index.search('法', limit=2)) == scan(DATASETS, '法')[:2]
+
+    def test_index_after_refresh(self):
+        index = DatasetIndex()
+        index.update(DATASETS)
+        added, removed, changed = index.update(REFRESHED)
+        assert (added, removed, changed) == (1, 1, 2), (added, removed, changed)
+        assert ids(index.search('Civil Code')) == [], '改名前的名稱不應再命中'
+        assert ids(index.search('民事')) == ['ds-2', 'ds-6']
+        assert ids(index.search('刑')) == [], '已刪除的數據集不應再命中'
+        assert ids(index.search('admin')) == ['ds-8']
+        assert ids(index.search(min_documents=50)) == ['ds-4'], '文件數變化後範圍過濾應使用新值'
+        assert index.get('ds-5') is None and index.get('ds-8')['name'] == '行政法 Admin'
+        assert index.names['ds-2'] == '民事法規 Civil Law'
+        self.assert_index_matches_scan(index, REFRESHED)
+        self.assert_no_stale_postings(index)
+
+        # 刷新結果與從頭建立的索引一致
+        rebuilt = DatasetIndex()
+        rebuilt.update(REFRESHED)
+        assert index.by_name == rebuilt.by_name and index.by_document_count == rebuilt.by_document_count
+        assert index.postings == rebuilt.postings
+
+    def test_endpoint_search(self):
+        for q in ('法c', 'API文', '法', 'x'):
+            status, _, body = self.request('/datasets', f'q={q}')
+            assert status == 200, body[:200]
+            assert ids(json.loads(body)) == scan(DATASETS, q), q
+        status, _, body = self.request('/datasets', 'q=civil&match=prefix')
+        assert status == 200 and ids(json.loads(body)) == ['ds-6']
+
+    def test_endpoint_lookup(self):
+        status, _, body = self.request('/datasets/ds-3')
+        assert status == 200 and json.loads(body)['name'] == 'ＡＰＩ文件', body[:200]
+        status, _, _ = self.request('/datasets/ds-8')
+        assert status == 404, '刷新前不存在的數據集應返回 404'
+
+    def test_endpoint_after_refresh(self):
+        self.client.datasets = REFRESHED
+        fastapi_server.dataset_catalog.invalidate()
+        status, _, body = self.request('/datasets', 'q=民事')
+        assert status == 200 and ids(json.loads(body)) == ['ds-2', 'ds-6'], body[:200]
+        status, _, body = self.request('/datasets/ds-8')
+        assert status == 200 and json.loads(body)['document_count'] == 9, body[:200]
+        status, _, _ = self.request('/datasets/ds-5')
+        assert status == 404, '已刪除的數據集應返回 404'
+        status, _, body = self.request('/datasets/ds-4')
+        assert status == 200 and json.loads(body)['document_count'] == 70
+
+    def test_paged_fetch(self):
+        """多頁目錄逐頁作為上游調用拉取，在上游線程池中執行，不另建線程池"""
+        many = [{'id': f'page-{index}', 'name': f'分頁 {index}', 'document_count': index}
+                for index in range(DATASET_PAGE_SIZE * 3 + 5)]
+        threads = set()
+        original = self.client.list_datasets_page
+
+        def record(*args, **kwargs):
+            threads.add(threading.current_thread().name)
+            return original(*args, **kwargs)
+
+        self.client.datasets, self.client.list_datasets_page = many, record
+        try:
+            fastapi_server.dataset_catalog.invalidate()
+            status, _, body = self.request('/datasets')
+            assert status == 200 and ids(json.loads(body)) == ids(many), body[:200]
+            assert threads and all(name.startswith('ragflow-upstream') for name in threads), threads
+        finally:
+            self.client.datasets, self.client.list_datasets_page = REFRESHED, original
+            fastapi_server.dataset_catalog.invalidate()
+
+def main() -> int:
+    client = CannedRAGFlowClient(b'{}', DATASETS)
+    fastapi_server.ragflow_client = client
+    fastapi_server.dataset_catalog.invalidate()
+    loop = asyncio.new_event_loop()
+    tester = DatasetCatalogTester(loop, client)
+
+    print_header("數據集目錄索引測試")
+    tester.check("中英混合與全半角查詢", tester.test_mixed_queries)
+    tester.check("單字查詢", tester.test_single_character)
+    tester.check("文件數範圍與數量限制", tester.test_document_count_filters)
+    tester.check("目錄刷新後索引與從頭建立一致", tester.test_index_after_refresh)
+    tester.check("GET /datasets?q= 查找", tester.test_endpoint_search)
+    tester.check("GET /datasets/{id} 按 ID 查找", tester.test_endpoint_lookup)
+    tester.check("目錄刷新後的查找與按 ID 查找", tester.test_endpoint_after_refresh)
+    tester.check("多頁目錄經上游線程池逐頁拉取", tester.test_paged_fetch)
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+數據集變化偵測測試
+檢查 DatasetWatcher 分頁輪流掃描時只遞增發生變化的數據集的世代號、第一次見到的數據集不視為變化、
+連續兩遍掃描都未出現的數據集才視為已刪除（刪除導致的前移不會誤判），
+以及數據集變化後只有它的首輪回答緩存失效，文件中舊世代的回答被刪除，其他數據集的緩存不受影響。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_dataset_watch.py
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from answer_cache import AnswerCache, AnswerStore
+from dataset_watch import DatasetWatcher
+from message_log import MessageLog
+
+def make_datasets(count: int) -> List[Dict[str, Any]]:
+    """按創建時間從舊到新排列的數據集"""
+    return [{'id': f'ds-{index}', 'name': f'數據集 {index}', 'document_count': 1, 'chunk_count': 10}
+            for index in range(count)]
+
+class PagedDatasets:
+    """按頁返回可修改的數據集列表，記錄請求過的頁"""
+
+    def __init__(self, datasets: List[Dict[str, Any]]):
+        self.datasets = datasets
+        self.pages: List[int] = []
+
+    async def fetch_page(self, page: int, page_size: int) -> List[Dict[str, Any]]:
+        self.pages.append(page)
+        return [dict(dataset) for dataset in self.datasets[(page - 1) * page_size:page * page_size]]
+
+    def update(self, dataset_id: str, **fields):
+        for dataset in self.datasets:
+            if dataset['id'] == dataset_id:
+                dataset.update(fields)
+
+    def remove(self, dataset_id: str):
+        self.datasets = [dataset for dataset in self.datasets if dataset['id'] != dataset_id]
+
+class DatasetWatchTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.loop = loop
+
+    def make_watcher(self, count: int):
+        source = PagedDatasets(make_datasets(count))
+        watcher = DatasetWatcher(source.fetch_page, page_size=2, pages_per_round=1)
+        notified: List[List[str]] = []
+        watcher.listeners.append(notified.append)
+        return source, watcher, notified
+
+    def sweep(self, watcher: DatasetWatcher) -> List[str]:
+        """輪詢到本遍掃描結束，返回其間變化或刪除的數據集"""
+        sweeps, changed = watcher.sweeps, []
+        while watcher.sweeps == sweeps:
+            changed += self.loop.run_until_complete(watcher.poll_once())
+        return changed
+
+    def test_first_sight(self):
+        source, watcher, notified = self.make_watcher(5)
+        assert self.sweep(watcher) == [] and notified == []
+        assert source.pages == [1, 2, 3], f'每輪只請求一頁: {source.pages}'
+        assert all(watcher.generation(dataset['id']) == 0 for dataset in source.datasets)
+
+    def test_change_bumps_only_changed(self):
+        source, watcher, notified = self.make_watcher(5)
+        self.sweep(watcher)
+        source.update('ds-4', document_count=2)
+        source.update('ds-1', update_time=1700000000)
+        # 第一輪只掃描第一頁，ds-4 在第三頁，要等本遍掃描到該頁才發現
+        assert self.loop.run_until_complete(watcher.poll_once()) == ['ds-1']
+        assert watcher.generation('ds-4') == 0
+        assert self.sweep(watcher) == ['ds-4']
+        assert notified == [['ds-1'], ['ds-4']], notified
+        assert {dataset['id']: watcher.generation(dataset['id']) for dataset in source.datasets} == {
+            'ds-0': 0, 'ds-1': 1, 'ds-2': 0, 'ds-3': 0, 'ds-4': 1
+        }
+        assert self.sweep(watcher) == [], '元數據未再變化時不應重複遞增'
+
+    def test_removal_needs_two_sweeps(self):
+        source, watcher, _ = self.make_watcher(5)
+        self.sweep(watcher)
+        # 第一頁掃描完後刪除 ds-0，ds-2 前移到已掃描的第一頁，本遍掃描看不到它
+        self.loop.run_until_complete(watcher.poll_once())
+        source.remove('ds-0')
+        assert self.sweep(watcher) == [], '只錯過一遍的數據集不應視為刪除'
+        # 本遍掃描在刪除前已看到 ds-0，之後完整的兩遍都未出現才視為刪除
+        assert self.sweep(watcher) == []
+        assert self.sweep(watcher) == ['ds-0']
+        assert watcher.generation('ds-0') == 1 and watcher.generation('ds-2') == 0
+        assert 'ds-0' not in watcher.signatures and 'ds-2' in watcher.signatures
+
+    def test_answer_cache_invalidation(self):
+        datasets = make_datasets(3)
+        client = CannedRAGFlowClient(make_completion_body(make_chunks(3, 200)), datasets[::-1])
+        fastapi_server.ragflow_client = client
+        watcher = fastapi_server.dataset_watcher
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, 'answers.db')
+            cache = AnswerCache(watcher.generation, ttl_seconds=3600, store=AnswerStore(path))
+            fastapi_server.answer_cache = cache
+            watcher.listeners.append(cache.purge)
+            try:
+                self.loop.run_until_complete(cache.start())
+                self.sweep(watcher)
+
+                def ask(dataset_id: str) -> bool:
+                    body = {'question': '什麼是憲法？', 'dataset_id': dataset_id}
+                    status, _, response = self.loop.run_until_complete(
+                        asgi_request(fastapi_server.app, 'POST', '/chat', body)
+                    )
+                    assert status == 200, response[:200]
+                    return json.loads(response)['cached']
+
+                assert [ask('ds-0'), ask('ds-1')] == [False, False]
+                assert [ask('ds-0'), ask('ds-1')] == [True, True]
+
+                # ds-0 的文件數變化：只有它的緩存失效
+                datasets[0]['document_count'] = 5
+                assert self.sweep(watcher) == ['ds-0']
+                assert [ask('ds-0'), ask('ds-1')] == [False, True]
+                assert ask('ds-0'), '重新生成的回答應寫入新世代的緩存'
+                self.loop.run_until_complete(cache.stop())
+            finally:
+                watcher.listeners.remove(cache.purge)
+
+            with sqlite3.connect(path) as connection:
+                rows = sorted(connection.execute('SELECT dataset_id, generation FROM answers'))
+            assert rows == [('ds-0', 1), ('ds-1', 0)], f'文件中舊世代的回答應被刪除: {rows}'
+
+def main() -> int:
+    loop = asyncio.new_event_loop()
+    tester = DatasetWatchTester(loop)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+
+        print_header("數據集變化偵測測試")
+        tester.check("第一次見到的數據集不視為變化", tester.test_first_sight)
+        tester.check("只遞增發生變化的數據集的世代號", tester.test_change_bumps_only_changed)
+        tester.check("連續兩遍未出現才視為刪除", tester.test_removal_needs_two_sweeps)
+        tester.check("數據集變化後只有它的回答緩存失效", tester.test_answer_cache_invalidation)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
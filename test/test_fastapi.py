@@ -167,7 +167,7 @@ def run_comprehensive_test():
     sessions_result = tester.test_get_sessions()
     
     if sessions_result['success']:
-        sessions = sessions_result['data']
+        sessions = sessions_result['data']['sessions']
         print(f"   ✅ 成功獲取 {len(sessions)} 個活躍會話")
         
         for session in sessions:
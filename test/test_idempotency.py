@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+冪等重試測試
+檢查攜帶 Idempotency-Key 的 POST /chat：重試時重放保存的回應、相同鍵的並發請求只調用一次 RAGFlow、
+同一個鍵用於內容不同的請求時返回 422、上游失敗的回應不保存，以及流式和透傳請求攜帶冪等鍵時返回 400。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_idempotency.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from idempotency import IdempotencyStore
+from message_log import MessageLog
+
+class CountingRAGFlowClient(CannedRAGFlowClient):
+    """記錄 chat_completion 調用次數的固定回應客戶端，可設置延遲和失敗"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.completions = 0
+        self.delay = 0.0
+        self.fail = False
+        self.lock = threading.Lock()
+
+    def chat_completion(self, chat_id: str, session_id: str, question: str,
+                        quote: bool = True, stream: bool = False) -> Dict[str, Any]:
+        with self.lock:
+            self.completions += 1
+        time.sleep(self.delay)
+        if self.fail:
+            return {'success': False, 'data': None, 'message': '上游暫時不可用'}
+        return super().chat_completion(chat_id, session_id, question, quote, stream)
+
+    def chat_completion_raw(self, *args, **kwargs):
+        with self.lock:
+            self.completions += 1
+        return super().chat_completion_raw(*args, **kwargs)
+
+    def take(self) -> int:
+        with self.lock:
+            completions, self.completions = self.completions, 0
+        return completions
+
+class IdempotencyTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: CountingRAGFlowClient, session_id: str):
+        super().__init__()
+        self.loop = loop
+        self.client = client
+        self.session_id = session_id
+
+    def chat(self, key: str, question: str = '什麼是憲法？', query: str = '', **fields):
+        body = {'question': question, 'dataset_id': 'bench-dataset', 'session_id': self.session_id, **fields}
+        return asgi_request(fastapi_server.app, 'POST', '/chat', body, query=query, headers={'Idempotency-Key': key})
+
+    def run(self, *requests):
+        async def gather():
+            return await asyncio.gather(*requests)
+        return self.loop.run_until_complete(gather())
+
+    def test_replay(self):
+        self.client.take()
+        [(status, headers, first)] = self.run(self.chat('key-replay'))
+        assert status == 200 and headers['idempotent-replayed'] == 'false', (status, headers)
+        [(status, headers, second)] = self.run(self.chat('key-replay'))
+        assert status == 200 and headers['idempotent-replayed'] == 'true', (status, headers)
+        assert second == first, '重放的回應與首次回應不同'
+        assert self.client.take() == 1, '重試不應再次調用 RAGFlow'
+
+    def test_concurrent_share(self):
+        self.client.take()
+        self.client.delay = 0.2
+        try:
+            responses = self.run(*(self.chat('key-concurrent') for _ in range(4)))
+        finally:
+            self.client.delay = 0.0
+        assert all(status == 200 for status, _, _ in responses)
+        replayed = sorted(headers['idempotent-replayed'] for _, headers, _ in responses)
+        assert replayed == ['false', 'true', 'true', 'true'], replayed
+        assert len({body for _, _, body in responses}) == 1, '並發請求的回應不一致'
+        assert self.client.take() == 1, '相同鍵的並發請求應只調用一次 RAGFlow'
+
+    def test_conflict(self):
+        self.run(self.chat('key-conflict'))
+        self.client.take()
+        [(status, _, body)] = self.run(self.chat('key-conflict', '憲法第一條是什麼？'))
+        assert status == 422, (status, body[:200])
+        assert self.client.take() == 0
+
+    def test_failure_not_stored(self):
+        self.client.take()
+        self.client.fail = True
+        try:
+            [(status, _, _)] = self.run(self.chat('key-failure'))
+        finally:
+            self.client.fail = False
+        assert status == 500, status
+        [(status, headers, body)] = self.run(self.chat('key-failure'))
+        assert status == 200 and headers['idempotent-replayed'] == 'false', (status, body[:200])
+        assert json.loads(body)['answer']
+        assert self.client.take() == 2, '上游失敗後的重試應重新調用 RAGFlow'
+
+    def test_stream_and_raw_rejected(self):
+        self.client.take()
+        [(stream_status, _, _), (raw_status, _, _)] = self.run(
+            self.chat('key-stream', stream=True),
+            self.chat('key-raw', query='raw=true')
+        )
+        assert (stream_status, raw_status) == (400, 400), (stream_status, raw_status)
+        assert self.client.take() == 0, '被拒絕的請求不應調用 RAGFlow'
+
+def main() -> int:
+    client = CountingRAGFlowClient(make_completion_body(make_chunks(3, 200)))
+    fastapi_server.ragflow_client = client
+    fastapi_server.idempotency_store = IdempotencyStore(ttl_seconds=600)
+    loop = asyncio.new_event_loop()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '冪等測試', chat_id='bench-chat'
+        )['session_id']
+        tester = IdempotencyTester(loop, client, session_id)
+
+        print_header("冪等重試測試")
+        tester.check("重試時重放保存的回應", tester.test_replay)
+        tester.check("相同鍵的並發請求只調用一次 RAGFlow", tester.test_concurrent_share)
+        tester.check("同一個鍵用於不同請求時返回 422", tester.test_conflict)
+        tester.check("上游失敗的回應不保存", tester.test_failure_not_stored)
+        tester.check("流式和透傳請求攜帶冪等鍵時返回 400", tester.test_stream_and_raw_rejected)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+回答提前刷新測試
+檢查 RefreshAheadScheduler 只刷新命中次數足夠且即將過期的回答並按命中次數從多到少刷新、
+每分鐘刷新次數不超過 per_minute、上游繁忙時推遲刷新、刷新失敗的回答命中次數歸零，
+以及刷新後緩存中的回答被替換、刷新用的臨時 RAGFlow 會話無論成功失敗都被刪除。
+在進程內直接調用 FastAPI 應用，用固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_refresh_ahead.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmark_utils import CannedRAGFlowClient, asgi_request, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from answer_cache import AnswerCache
+from message_log import MessageLog
+from refresh_ahead import RefreshAheadScheduler, RefreshEntry
+
+class SessionRecordingClient(CannedRAGFlowClient):
+    """記錄創建和刪除的 RAGFlow 會話的固定回應客戶端，可替換回答或設置失敗"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.answer = '舊的回答'
+        self.fail = False
+        self.created: List[str] = []
+        self.deleted: List[str] = []
+
+    def create_session(self, chat_id: str, user_id: str = None) -> Dict[str, Any]:
+        result = super().create_session(chat_id, user_id)
+        self.created.append(result['data']['id'])
+        return result
+
+    def delete_sessions(self, chat_id: str, session_ids: List[str]) -> Dict[str, Any]:
+        self.deleted += session_ids
+        return super().delete_sessions(chat_id, session_ids)
+
+    def chat_completion(self, chat_id: str, session_id: str, question: str,
+                        quote: bool = True, stream: bool = False) -> Dict[str, Any]:
+        if self.fail:
+            return {'success': False, 'data': None, 'message': '上游暫時不可用'}
+        result = super().chat_completion(chat_id, session_id, question, quote, stream)
+        result['data']['answer'] = self.answer
+        return result
+
+class RefreshAheadTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.loop = loop
+
+    def make_scheduler(self, idle: bool = True, fail: bool = False, **options):
+        """返回 (調度器, 已刷新的問題列表)，刷新函數只記錄問題"""
+        refreshed: List[str] = []
+
+        async def refresh(entry: RefreshEntry):
+            refreshed.append(entry.question)
+            if fail:
+                raise RuntimeError('上游暫時不可用')
+
+        options = {'ahead_seconds': 300, 'min_hits': 3, 'per_minute': 10, **options}
+        return RefreshAheadScheduler(refresh, is_idle=lambda: idle, **options), refreshed
+
+    @staticmethod
+    def add(scheduler: RefreshAheadScheduler, question: str, hits: int, ttl_seconds: float):
+        key = question.encode('utf-8')
+        scheduler.track(key, 'ds-0', question, True, 'chat-0', ttl_seconds)
+        for _ in range(hits):
+            scheduler.hit(key)
+
+    def test_hot_and_expiring(self):
+        scheduler, refreshed = self.make_scheduler()
+        self.add(scheduler, '冷門', 1, 60)
+        self.add(scheduler, '熱門', 5, 60)
+        self.add(scheduler, '更熱門', 9, 60)
+        self.add(scheduler, '熱門但未到期', 9, 3600)
+        self.add(scheduler, '已過期', 9, -1)
+        assert self.loop.run_until_complete(scheduler.run_once()) == 2
+        assert refreshed == ['更熱門', '熱門'], f'應按命中次數從多到少只刷新熱門且即將過期的回答: {refreshed}'
+        assert '已過期'.encode('utf-8') not in scheduler.entries, '已過期的條目應被清除'
+
+    def test_per_minute(self):
+        scheduler, refreshed = self.make_scheduler(per_minute=2)
+        for index in range(5):
+            self.add(scheduler, f'問題{index}', 3 + index, 60)
+        assert self.loop.run_until_complete(scheduler.run_once()) == 2
+        assert refreshed == ['問題4', '問題3']
+        # 被刷新的條目在真實刷新中會重新寫入緩存而從候選中移除，這裡沒有寫入，但預算已用完
+        assert self.loop.run_until_complete(scheduler.run_once()) == 0
+        assert len(refreshed) == 2 and scheduler.deferred == 2, (refreshed, scheduler.deferred)
+
+    def test_busy_upstream(self):
+        scheduler, refreshed = self.make_scheduler(idle=False)
+        self.add(scheduler, '熱門', 5, 60)
+        assert self.loop.run_until_complete(scheduler.run_once()) == 0
+        assert refreshed == [] and scheduler.deferred == 1, '上游繁忙時不應刷新'
+
+    def test_failure_resets_hits(self):
+        scheduler, refreshed = self.make_scheduler(fail=True)
+        self.add(scheduler, '熱門', 5, 60)
+        assert self.loop.run_until_complete(scheduler.run_once()) == 0
+        assert scheduler.failed == 1 and scheduler.entries['熱門'.encode('utf-8')].hits == 0
+        assert self.loop.run_until_complete(scheduler.run_once()) == 0
+        assert refreshed == ['熱門'], '失敗後需要重新變熱才會再次刷新'
+
+    def test_refresh_cached_answer(self):
+        client = SessionRecordingClient(make_completion_body(make_chunks(3, 200)))
+        fastapi_server.ragflow_client = client
+        cache = AnswerCache(fastapi_server.dataset_watcher.generation, ttl_seconds=3600)
+        cache.scheduler = RefreshAheadScheduler(
+            fastapi_server.refresh_cached_answer, is_idle=lambda: True, ahead_seconds=7200, min_hits=2
+        )
+        fastapi_server.answer_cache = cache
+
+        def ask() -> Dict[str, Any]:
+            body = {'question': '什麼是憲法？', 'dataset_id': 'ds-refresh'}
+            status, _, response = self.loop.run_until_complete(
+                asgi_request(fastapi_server.app, 'POST', '/chat', body)
+            )
+            assert status == 200, response[:200]
+            return json.loads(response)
+
+        assert [ask()['cached'] for _ in range(3)] == [False, True, True]
+        [(key, entry)] = cache.scheduler.due()
+        client.created, client.deleted = [], []
+
+        # 刷新失敗：臨時會話仍被刪除，緩存中保留舊回答
+        client.fail = True
+        assert self.loop.run_until_complete(cache.scheduler.run_once()) == 0
+        assert len(client.created) == 1 and client.deleted == client.created, (client.created, client.deleted)
+        assert entry.hits == 0
+
+        # 重新變熱後刷新成功：臨時會話被刪除，緩存中的回答被替換，命中次數重新計算
+        client.fail = False
+        client.answer = '新的回答'
+        assert [ask()['answer'] for _ in range(2)] == ['舊的回答', '舊的回答']
+        assert self.loop.run_until_complete(cache.scheduler.run_once()) == 1
+        assert len(client.created) == 2 and client.deleted == client.created, (client.created, client.deleted)
+        assert cache.scheduler.entries[key].hits == 0
+        response = ask()
+        assert response['cached'] and response['answer'] == '新的回答', response
+
+def main() -> int:
+    loop = asyncio.new_event_loop()
+    tester = RefreshAheadTester(loop)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+
+        print_header("回答提前刷新測試")
+        tester.check("只刷新熱門且即將過期的回答", tester.test_hot_and_expiring)
+        tester.check("每分鐘刷新次數受限", tester.test_per_minute)
+        tester.check("上游繁忙時推遲刷新", tester.test_busy_upstream)
+        tester.check("刷新失敗後命中次數歸零", tester.test_failure_resets_hits)
+        tester.check("刷新替換緩存並刪除臨時會話", tester.test_refresh_cached_answer)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+會話索引一致性測試
+對 SessionManager 隨機執行使用時間寫回、單個刪除、按條件批量刪除、過期清理和導入，
+每一步之後把 by_last_used / by_user / by_dataset 與按會話存儲重新計算的結果比較，
+並檢查分頁列表與全表掃描的結果一致。不需要啟動服務，也不調用 RAGFlow。
+
+用法: python test/test_session_index.py
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fastapi_server
+from benchmark_utils import asgi_request
+from check_utils import ScriptTester, print_header
+from message_log import MessageLog
+
+USERS = ['user-a', 'user-b', 'user-c', None]
+DATASETS = ['dataset-1', 'dataset-2', 'dataset-3']
+
+def make_session(rng: random.Random, index: int, now: datetime) -> Dict[str, Any]:
+    created_at = now - timedelta(hours=rng.uniform(0, 72))
+    return {
+        'session_id': f'session-{index:05d}',
+        'chat_id': 'bench-chat',
+        'dataset_id': rng.choice(DATASETS),
+        'dataset_name': '索引測試',
+        'user_id': rng.choice(USERS),
+        'created_at': created_at,
+        'last_used': created_at
+    }
+
+class SessionIndexTester(ScriptTester):
+    def __init__(self, seed: int = 7):
+        super().__init__()
+        self.rng = random.Random(seed)
+        self.now = datetime.now()
+        self.manager = fastapi_server.SessionManager()
+        self.next_index = 0
+
+    def add_sessions(self, count: int):
+        for _ in range(count):
+            self.manager.import_session(make_session(self.rng, self.next_index, self.now))
+            self.next_index += 1
+
+    def assert_consistent(self):
+        """索引內容必須與會話存儲完全對應，且沒有殘留的空索引"""
+        sessions = self.manager.sessions
+        expected = sorted((info['last_used'], session_id) for session_id, info in sessions.items())
+        assert list(self.manager.by_last_used) == expected, 'by_last_used 與會話存儲不一致'
+        for field, index in (('user_id', self.manager.by_user), ('dataset_id', self.manager.by_dataset)):
+            grouped: Dict[str, List] = {}
+            for last_used, session_id in expected:
+                key = sessions[session_id].get(field)
+                if key:
+                    grouped.setdefault(key, []).append((last_used, session_id))
+            assert {key: list(entries) for key, entries in index.items()} == grouped, f'{field} 索引不一致'
+
+    def random_touches(self, count: int):
+        session_ids = list(self.manager.sessions)
+        for _ in range(count):
+            session_id = self.rng.choice(session_ids)
+            self.manager.pending_touches[session_id] = self.now + timedelta(seconds=self.rng.uniform(0, 3600))
+        self.manager.flush_touches()
+
+    def test_touch(self):
+        self.add_sessions(300)
+        self.assert_consistent()
+        for _ in range(5):
+            self.random_touches(200)
+            self.assert_consistent()
+
+    def test_touch_older_ignored(self):
+        session_id = next(iter(self.manager.sessions))
+        before = self.manager.sessions[session_id]['last_used']
+        self.manager.pending_touches[session_id] = before - timedelta(hours=1)
+        assert self.manager.flush_touches() == 0
+        assert self.manager.sessions[session_id]['last_used'] == before
+        self.assert_consistent()
+
+    def test_delete(self):
+        for session_id in self.rng.sample(list(self.manager.sessions), 50):
+            assert self.manager.delete_session(session_id)
+            assert not self.manager.delete_session(session_id)
+        self.assert_consistent()
+
+    def test_delete_filtered(self):
+        self.add_sessions(200)
+        cutoff = self.now - timedelta(hours=24)
+        matched = [
+            session_id for session_id, info in self.manager.sessions.items()
+            if info.get('user_id') == 'user-a' and info['last_used'] < cutoff
+        ]
+        assert len(matched) > 3, '符合條件的會話太少'
+        # 剛使用過的會話只在緩衝區中，批量刪除前必須先寫回
+        touched = matched[:3]
+        for session_id in touched:
+            self.manager.update_session_usage(session_id)
+        deleted = self.manager.delete_sessions(user_id='user-a', last_used_before=cutoff)
+        assert sorted(deleted) == sorted(set(matched) - set(touched)), '批量刪除的會話不符合條件'
+        assert all(session_id in self.manager.sessions for session_id in touched), '剛使用過的會話被誤刪'
+        self.assert_consistent()
+
+    def test_cleanup(self):
+        self.add_sessions(200)
+        cutoff = datetime.now() - timedelta(hours=48)
+        expired = {session_id for session_id, info in self.manager.sessions.items() if info['last_used'] < cutoff}
+        cleaned = self.manager.cleanup_old_sessions(48)
+        assert set(cleaned) == expired, (len(cleaned), len(expired))
+        assert not expired & set(self.manager.sessions)
+        self.assert_consistent()
+
+    def test_import_replaces(self):
+        session_id = next(iter(self.manager.sessions))
+        moved = {**self.manager.sessions[session_id], 'user_id': 'user-z', 'dataset_id': 'dataset-9',
+                 'last_used': self.now + timedelta(days=1)}
+        self.manager.import_session(moved)
+        assert self.manager.by_last_used[-1] == (moved['last_used'], session_id)
+        self.assert_consistent()
+
+    def test_cleanup_endpoint_drops_transcript(self):
+        """過期清理後會話的消息記錄同樣不可見，與刪除接口一致"""
+        session = {**make_session(self.rng, self.next_index, self.now), 'last_used': self.now - timedelta(days=3)}
+        self.next_index += 1
+        session_id = session['session_id']
+        with tempfile.TemporaryDirectory() as log_dir:
+            fastapi_server.message_log = MessageLog(log_dir)
+            fastapi_server.message_log.start()
+            try:
+                fastapi_server.session_manager.import_session(session)
+                fastapi_server.message_log.append(session_id, {
+                    'message_id': 'message-1', 'question': '什麼是憲法？', 'answer': '根本大法',
+                    'sources': [], 'latency_ms': 1.0, 'created_at': self.now
+                })
+                fastapi_server.message_log.flush()
+                status, _, _ = asyncio.run(asgi_request(fastapi_server.app, 'GET', f'/sessions/{session_id}/messages'))
+                assert status == 200, status
+
+                status, _, body = asyncio.run(asgi_request(fastapi_server.app, 'POST', '/sessions/cleanup',
+                                                           query='max_age_hours=48'))
+                assert status == 200, body[:200]
+                fastapi_server.message_log.flush()
+                status, _, _ = asyncio.run(asgi_request(fastapi_server.app, 'GET', f'/sessions/{session_id}/messages'))
+                assert status == 404, f'過期會話的消息記錄仍可讀取: {status}'
+            finally:
+                fastapi_server.message_log.stop()
+
+    def test_list_pages(self):
+        """分頁列表與按條件全表掃描、按 last_used 降序排列的結果一致"""
+        after, before = self.now - timedelta(hours=60), self.now + timedelta(minutes=30)
+        for user_id in (None, 'user-b'):
+            for dataset_id in (None, 'dataset-2'):
+                expected = sorted(
+                    (
+                        (info['last_used'], session_id) for session_id, info in self.manager.sessions.items()
+                        if (not user_id or info.get('user_id') == user_id)
+                        and (not dataset_id or info['dataset_id'] == dataset_id)
+                        and after <= info['last_used'] < before
+                    ),
+                    reverse=True
+                )
+                listed, cursor = [], None
+                while True:
+                    page, cursor = self.manager.list_sessions(user_id, dataset_id, after, before, cursor, limit=17)
+                    listed += [(info['last_used'], info['session_id']) for info in page]
+                    if cursor is None:
+                        break
+                assert listed == expected, f'分頁結果不一致: user={user_id}, dataset={dataset_id}'
+
+def main() -> int:
+    tester = SessionIndexTester()
+
+    print_header("會話索引一致性測試")
+    tester.check("寫回使用時間後索引一致", tester.test_touch)
+    tester.check("較舊的使用時間不覆蓋", tester.test_touch_older_ignored)
+    tester.check("單個刪除後索引一致", tester.test_delete)
+    tester.check("按條件批量刪除先寫回使用時間", tester.test_delete_filtered)
+    tester.check("過期清理後索引一致", tester.test_cleanup)
+    tester.check("導入同 ID 會話時替換舊索引", tester.test_import_replaces)
+    tester.check("分頁列表與全表掃描一致", tester.test_list_pages)
+    tester.check("過期清理同時刪除消息記錄", tester.test_cleanup_endpoint_drops_transcript)
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+流式回答測試
+檢查 RAGFlow 推送的累積回答轉為增量：增量拼接後與完整回答一致、合併間隔內的增量合併為一幀、
+上游停頓時已合併的增量按間隔發出、上游改寫已發出的文字時不再發增量，以及 SSE 事件的格式；
+斷線後按 Last-Event-ID 續傳時事件不重複不遺漏、寬限期內沒有重連時取消生成、缺失的事件已被丟棄時返回 410。
+在進程內直接調用 FastAPI 應用，用按腳本推送的固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_streams.py
+"""
+
+import asyncio
+import functools
+import json
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from benchmark_utils import ScriptedStreamClient, asgi_request, cumulative, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from message_log import MessageLog
+
+ANSWER = '根據資料，憲法是國家的根本大法，規定國家的基本制度和公民的基本權利與義務。'
+
+def parse_sse(body: bytes) -> List[Dict[str, Any]]:
+    """把 SSE 回應體解析為 [{'id', 'event', 'data'}]"""
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        if not block.strip():
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append({'id': fields['id'], 'event': fields['event'], 'data': json.loads(fields['data'])})
+    return events
+
+class StreamTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: ScriptedStreamClient, session_id: str):
+        super().__init__()
+        self.loop = loop
+        self.client = client
+        self.session_id = session_id
+
+    def chat_request(self) -> fastapi_server.ChatRequest:
+        return fastapi_server.ChatRequest(
+            question='什麼是憲法？', dataset_id='bench-dataset', session_id=self.session_id, stream=True
+        )
+
+    def request(self, method: str, path: str, body: Any = None, headers: Dict[str, str] = None):
+        return self.loop.run_until_complete(asgi_request(fastapi_server.app, method, path, body, headers=headers))
+
+    def start_stream(self, script: List[Any]) -> fastapi_server.AnswerStream:
+        self.client.script = script
+        fastapi_server.STREAM_COALESCE_INTERVAL = 0
+
+        async def create():
+            return fastapi_server.stream_registry.create(
+                fastapi_server.new_local_id(), functools.partial(fastapi_server.produce_answer, self.chat_request())
+            )
+        return self.loop.run_until_complete(create())
+
+    def read_then_disconnect(self, stream: fastapi_server.AnswerStream, count: int) -> List[Dict[str, Any]]:
+        """讀取 count 個事件後斷開連接，返回已讀到的事件"""
+        async def read():
+            body = fastapi_server.stream_response(stream).body_iterator
+            chunks = [await body.__anext__() for _ in range(count)]
+            await body.aclose()
+            return parse_sse(''.join(chunks).encode('utf-8'))
+        return self.loop.run_until_complete(read())
+
+    def collect(self, script: List[Any], interval: float) -> Tuple[List[Tuple[float, str]], Any]:
+        """直接調用 stream_chat，返回 ([(距開始的秒數, 增量)], 完整回應)"""
+        self.client.script = script
+        fastapi_server.STREAM_COALESCE_INTERVAL = interval
+        deltas: List[Tuple[float, str]] = []
+        started = time.monotonic()
+
+        async def on_delta(text: str):
+            deltas.append((time.monotonic() - started, text))
+
+        response = self.loop.run_until_complete(fastapi_server.stream_chat(self.chat_request(), on_delta))
+        return deltas, response
+
+    def test_deltas(self):
+        deltas, response = self.collect(cumulative(ANSWER), 0)
+        assert [text for _, text in deltas] == list(ANSWER), '不合併時每條推送應只發出新增的一個字'
+        assert response.answer == ANSWER
+
+    def test_coalesce(self):
+        deltas, response = self.collect(cumulative(ANSWER), 0.2)
+        assert ''.join(text for _, text in deltas) == response.answer == ANSWER
+        assert len(deltas) < 5, f'合併間隔內連續到達的增量應合併: {len(deltas)} 幀'
+
+    def test_flush_on_stall(self):
+        half = len(ANSWER) // 2
+        script = cumulative(ANSWER)[:half] + [0.5] + cumulative(ANSWER)[half:]
+        deltas, response = self.collect(script, 0.05)
+        early = ''.join(text for elapsed, text in deltas if elapsed < 0.4)
+        assert early == ANSWER[:half], f'上游停頓期間應發出已合併的增量: {early!r}'
+        assert ''.join(text for _, text in deltas) == response.answer == ANSWER
+
+    def test_rewrite(self):
+        rewritten = '根據資料 [ID:0]，憲法是根本大法。'
+        deltas, response = self.collect(['根據', '根據資料', '根據資料，憲法', rewritten], 0)
+        assert ''.join(text for _, text in deltas) == '根據資料，憲法', deltas
+        assert response.answer == rewritten, '完整回應應以改寫後的回答為準'
+
+    def test_sse_events(self):
+        self.client.script = cumulative(ANSWER)
+        fastapi_server.STREAM_COALESCE_INTERVAL = 0
+        body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': self.session_id, 'stream': True}
+        status, headers, response = self.loop.run_until_complete(
+            asgi_request(fastapi_server.app, 'POST', '/chat', body)
+        )
+        assert status == 200 and headers['content-type'].startswith('text/event-stream'), (status, headers)
+        events = parse_sse(response)
+        stream_id = headers['x-stream-id']
+        assert [event['id'] for event in events] == [f'{stream_id}:{seq}' for seq in range(1, len(events) + 1)]
+        assert [event['event'] for event in events] == ['delta'] * (len(events) - 1) + ['done']
+        done = events[-1]['data']
+        assert ''.join(event['data']['delta'] for event in events[:-1]) == done['answer'] == ANSWER
+        assert done['session_id'] == self.session_id and done['sources']
+
+    def test_resume_after_disconnect(self):
+        gate = threading.Event()
+        half = len(ANSWER) // 2
+        stream = self.start_stream(cumulative(ANSWER)[:half] + [gate] + cumulative(ANSWER)[half:])
+        received = self.read_then_disconnect(stream, 3)
+        gate.set()
+        # 斷開期間回答繼續生成，重連後從最後收到的事件之後補發
+        status, _, body = self.request('GET', f'/chat/streams/{stream.stream_id}',
+                                       headers={'Last-Event-ID': received[-1]['id']})
+        assert status == 200, body[:200]
+        events = received + parse_sse(body)
+        seqs = [int(event['id'].rsplit(':', 1)[1]) for event in events]
+        assert seqs == list(range(1, len(events) + 1)), f'事件重複或遺漏: {seqs}'
+        assert events[-1]['event'] == 'done'
+        assert ''.join(event['data']['delta'] for event in events[:-1]) == events[-1]['data']['answer'] == ANSWER
+
+    def test_resume_via_chat(self):
+        stream = self.start_stream(cumulative(ANSWER))
+        self.loop.run_until_complete(stream.task)
+        body = {'question': '什麼是憲法？', 'dataset_id': 'bench-dataset', 'session_id': self.session_id, 'stream': True}
+        status, _, response = self.request('POST', '/chat', body, headers={'Last-Event-ID': f'{stream.stream_id}:5'})
+        assert status == 200, response[:200]
+        events = parse_sse(response)
+        assert events[0]['id'] == f'{stream.stream_id}:6' and events[-1]['event'] == 'done'
+        assert ''.join(event['data']['delta'] for event in events[:-1]) == ANSWER[5:]
+
+    def test_abandon_after_grace(self):
+        gate = threading.Event()
+        fastapi_server.stream_registry.grace_seconds = 0.1
+        try:
+            stream = self.start_stream(cumulative(ANSWER)[:3] + [gate] + cumulative(ANSWER)[3:])
+            received = self.read_then_disconnect(stream, 2)
+            self.loop.run_until_complete(asyncio.sleep(0.3))
+        finally:
+            fastapi_server.stream_registry.grace_seconds = 30
+            gate.set()
+        status, _, body = self.request('GET', f'/chat/streams/{stream.stream_id}',
+                                       headers={'Last-Event-ID': received[-1]['id']})
+        assert status == 200, body[:200]
+        events = parse_sse(body)
+        assert events[-1]['event'] == 'error' and events[-1]['data']['status'] == 408, events
+        assert all(event['event'] != 'done' for event in events), '取消後不應再生成完整回答'
+
+    def test_resume_errors(self):
+        fastapi_server.stream_registry.max_bytes = 200
+        try:
+            stream = self.start_stream(cumulative(ANSWER))
+        finally:
+            fastapi_server.stream_registry.max_bytes = fastapi_server.STREAM_REPLAY_MAX_BYTES
+        self.loop.run_until_complete(stream.task)
+        status, _, _ = self.request('GET', f'/chat/streams/{stream.stream_id}',
+                                    headers={'Last-Event-ID': f'{stream.stream_id}:1'})
+        assert status == 410, f'缺失的事件已被丟棄: {status}'
+        status, _, _ = self.request('GET', f'/chat/streams/{stream.stream_id}', headers={'Last-Event-ID': 'other:1'})
+        assert status == 400, f'Last-Event-ID 與流 ID 不符: {status}'
+        status, _, _ = self.request('GET', '/chat/streams/' + '0' * 32)
+        assert status == 404, f'未知的流: {status}'
+
+def main() -> int:
+    client = ScriptedStreamClient(make_completion_body(make_chunks(3, 200)))
+    fastapi_server.ragflow_client = client
+    loop = asyncio.new_event_loop()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_id = fastapi_server.session_manager.create_session(
+            'bench-dataset', '流式測試', chat_id='bench-chat'
+        )['session_id']
+        tester = StreamTester(loop, client, session_id)
+
+        print_header("流式回答測試")
+        tester.check("累積回答轉為增量", tester.test_deltas)
+        tester.check("合併間隔內的增量合併為一幀", tester.test_coalesce)
+        tester.check("上游停頓時按間隔發出已合併的增量", tester.test_flush_on_stall)
+        tester.check("上游改寫已發出的文字時不再發增量", tester.test_rewrite)
+        tester.check("SSE 事件序號與 done 事件", tester.test_sse_events)
+        tester.check("斷線後續傳事件不重複不遺漏", tester.test_resume_after_disconnect)
+        tester.check("POST /chat 攜帶 Last-Event-ID 續傳", tester.test_resume_via_chat)
+        tester.check("寬限期內沒有重連時取消生成", tester.test_abandon_after_grace)
+        tester.check("續傳失敗時返回 410 / 400 / 404", tester.test_resume_errors)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+WebSocket 多路對話測試
+檢查 /ws/chat 上多個對話並發執行、增量幀交錯返回且按 id 拼接後與 done 中的回答一致；
+取消進行中的對話後同一 id 可以立即復用；重複 id、超過 WS_MAX_INFLIGHT、無效消息返回錯誤幀；ping 返回 pong。
+在進程內直接連接 FastAPI 應用，用按腳本推送的固定回應代替 RAGFlow，不需要啟動服務。
+
+用法: python test/test_websocket.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+from typing import Any, Dict, List
+
+from benchmark_utils import ASGIWebSocket, ScriptedStreamClient, cumulative, make_chunks, make_completion_body
+from check_utils import ScriptTester, print_header
+
+import fastapi_server
+from message_log import MessageLog
+
+ANSWERS = {
+    '什麼是憲法？': '憲法是國家的根本大法，規定國家的基本制度。',
+    '什麼是民法？': '民法調整平等主體之間的人身關係和財產關係。',
+    '什麼是刑法？': '刑法規定犯罪和刑罰，是保護社會秩序的法律。',
+}
+
+def paced(text: str, pause: float = 0.01) -> List[Any]:
+    """逐字推送並在每條之間停頓，讓並發的對話交錯"""
+    script: List[Any] = []
+    for step in cumulative(text):
+        script += [step, pause]
+    return script
+
+class WebSocketTester(ScriptTester):
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: ScriptedStreamClient, session_ids: List[str]):
+        super().__init__()
+        self.loop = loop
+        self.client = client
+        self.session_ids = session_ids
+
+    def chat_frame(self, correlation_id: str, question: str, index: int = 0) -> Dict[str, Any]:
+        return {'type': 'chat', 'id': correlation_id, 'question': question,
+                'dataset_id': 'bench-dataset', 'session_id': self.session_ids[index]}
+
+    def run(self, scenario):
+        async def connect():
+            async with ASGIWebSocket(fastapi_server.app, '/ws/chat') as ws:
+                await scenario(ws)
+        self.loop.run_until_complete(connect())
+
+    @staticmethod
+    async def receive_until(ws: ASGIWebSocket, done: int) -> List[Dict[str, Any]]:
+        """接收幀直到收到 done 個 done / error / cancelled 幀"""
+        frames = []
+        while done:
+            frame = await ws.receive_json()
+            frames.append(frame)
+            if frame['type'] in ('done', 'error', 'cancelled'):
+                done -= 1
+        return frames
+
+    def test_multiplex(self):
+        self.client.scripts = {question: paced(answer) for question, answer in ANSWERS.items()}
+
+        async def scenario(ws: ASGIWebSocket):
+            for index, question in enumerate(ANSWERS):
+                await ws.send_json(self.chat_frame(f'conv-{index}', question, index))
+            frames = await self.receive_until(ws, len(ANSWERS))
+
+            deltas = [frame for frame in frames if frame['type'] == 'delta']
+            switches = sum(1 for previous, current in zip(deltas, deltas[1:]) if previous['id'] != current['id'])
+            assert switches > len(ANSWERS), f'並發對話的增量幀應交錯返回: 切換 {switches} 次'
+            for index, (question, answer) in enumerate(ANSWERS.items()):
+                correlation_id = f'conv-{index}'
+                [done] = [frame for frame in frames if frame['type'] == 'done' and frame['id'] == correlation_id]
+                text = ''.join(frame['delta'] for frame in deltas if frame['id'] == correlation_id)
+                assert text == done['response']['answer'] == answer, correlation_id
+                assert done['response']['session_id'] == self.session_ids[index]
+
+        self.run(scenario)
+
+    def test_cancel_and_reuse_id(self):
+        gates = [threading.Event(), threading.Event()]
+        self.client.scripts = {'第一次': ['開始', gates[0], '開始之後'], '第二次': ['再次', gates[1], '再次開始']}
+
+        async def scenario(ws: ASGIWebSocket):
+            await ws.send_json(self.chat_frame('reused', '第一次'))
+            assert (await ws.receive_json())['type'] == 'delta'
+            await ws.send_json({'type': 'cancel', 'id': 'reused'})
+            await ws.send_json(self.chat_frame('reused', '第二次'))
+            frames = [await ws.receive_json(), await ws.receive_json()]
+            assert {'type': 'cancelled', 'id': 'reused'} in frames, frames
+            assert any(frame['type'] == 'delta' and frame['delta'] == '再次' for frame in frames), frames
+
+            # 被取消的任務結束時不能移除復用同一 id 的新對話：新對話仍可取消，也仍計入並發上限
+            await asyncio.sleep(0.2)
+            await ws.send_json({'type': 'cancel', 'id': 'reused'})
+            frame = await ws.receive_json()
+            assert frame == {'type': 'cancelled', 'id': 'reused'}, f'復用 id 的對話已被移除: {frame}'
+
+        try:
+            self.run(scenario)
+        finally:
+            for gate in gates:
+                gate.set()
+
+    def test_limits(self):
+        gate = threading.Event()
+        self.client.scripts = {}
+        self.client.script = ['等待', gate, '等待之後']
+        max_inflight, fastapi_server.WS_MAX_INFLIGHT = fastapi_server.WS_MAX_INFLIGHT, 2
+
+        async def scenario(ws: ASGIWebSocket):
+            await ws.send_json(self.chat_frame('first', '並發上限'))
+            await ws.send_json(self.chat_frame('first', '並發上限'))
+            await ws.send_json(self.chat_frame('second', '並發上限'))
+            await ws.send_json(self.chat_frame('third', '並發上限'))
+            errors = {}
+            while len(errors) < 2:
+                frame = await ws.receive_json()
+                if frame['type'] == 'error':
+                    errors[frame['id']] = frame['status']
+            assert errors == {'first': 400, 'third': 429}, errors
+            gate.set()
+            frames = await self.receive_until(ws, 2)
+            assert sorted(frame['id'] for frame in frames if frame['type'] == 'done') == ['first', 'second']
+
+        try:
+            self.run(scenario)
+        finally:
+            fastapi_server.WS_MAX_INFLIGHT = max_inflight
+            gate.set()
+
+    def test_control_frames(self):
+        async def scenario(ws: ASGIWebSocket):
+            await ws.send_json({'type': 'ping'})
+            assert await ws.receive_json() == {'type': 'pong'}
+            await ws.send_text('not json')
+            frame = await ws.receive_json()
+            assert frame['type'] == 'error' and frame['status'] == 400, frame
+            await ws.send_json({'type': 'unknown', 'id': 'x'})
+            frame = await ws.receive_json()
+            assert frame['type'] == 'error' and frame['status'] == 400 and frame['id'] == 'x', frame
+            await ws.send_json({'type': 'chat', 'id': 'bad'})
+            frame = await ws.receive_json()
+            assert frame['type'] == 'error' and frame['status'] == 422, frame
+
+        self.run(scenario)
+
+def main() -> int:
+    client = ScriptedStreamClient(make_completion_body(make_chunks(3, 200)))
+    fastapi_server.ragflow_client = client
+    fastapi_server.STREAM_COALESCE_INTERVAL = 0
+    loop = asyncio.new_event_loop()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        fastapi_server.message_log = MessageLog(log_dir)
+        fastapi_server.message_log.start()
+        session_ids = [
+            fastapi_server.session_manager.create_session('bench-dataset', '多路測試', chat_id='bench-chat')['session_id']
+            for _ in ANSWERS
+        ]
+        tester = WebSocketTester(loop, client, session_ids)
+
+        print_header("WebSocket 多路對話測試")
+        tester.check("多個對話並發且增量幀交錯", tester.test_multiplex)
+        tester.check("取消後同一 id 可立即復用", tester.test_cancel_and_reuse_id)
+        tester.check("重複 id 與並發上限返回錯誤幀", tester.test_limits)
+        tester.check("ping 與無效消息", tester.test_control_frames)
+
+        fastapi_server.message_log.stop()
+    loop.close()
+
+    return tester.summary()
+
+if __name__ == "__main__":
+    sys.exit(main())